@@ -15,6 +15,8 @@ import numpy as np
 import math
 from timm.models.vision_transformer import PatchEmbed, Attention, Mlp
 
+from ..utils.patchify import unpatchify
+
 
 def modulate(x, shift, scale):
 	return x * (1 + scale.unsqueeze(1)) + shift.unsqueeze(1)
@@ -226,23 +228,23 @@ class DiT(nn.Module):
 		h = w = int(x.shape[1] ** 0.5)
 		assert h * w == x.shape[1]
 
-		x = x.reshape(shape=(x.shape[0], h, w, p, p, c))
-		x = torch.einsum('nhwpqc->nchpwq', x)
-		imgs = x.reshape(shape=(x.shape[0], c, h * p, h * p))
-		return imgs
+		return unpatchify(x, h, w, p, c)
 
-	def forward_raw(self, x, t, y):
+	def forward_raw(self, x, t, y, layer_skip=None):
 		"""
 		Forward pass of DiT.
 		x: (N, C, H, W) tensor of spatial inputs (images or latent representations of images)
 		t: (N,) tensor of diffusion timesteps
 		y: (N,) tensor of class labels
+		layer_skip: optional fn(layer, depth), blocks it returns True for are skipped
 		"""
 		x = self.x_embedder(x) + self.pos_embed  # (N, T, D), where T = H * W / patch_size ** 2
 		t = self.t_embedder(t)                   # (N, D)
 		y = self.y_embedder(y, self.training)    # (N, D)
 		c = t + y                                # (N, D)
-		for block in self.blocks:
+		for layer, block in enumerate(self.blocks):
+			if layer_skip is not None and layer_skip(layer, len(self.blocks)):
+				continue
 			x = block(x, c)                      # (N, T, D)
 		x = self.final_layer(x, c)                # (N, T, patch_size ** 2 * out_channels)
 		x = self.unpatchify(x)                   # (N, out_channels, H, W)
@@ -258,18 +260,18 @@ class DiT(nn.Module):
 		"""
 		## Remove outer array from cond
 		context = context[:, 0]
+		transformer_options = kwargs.get("transformer_options", {})
 
 		## run original forward pass
 		out = self.forward_raw(
 			x = x.to(self.dtype),
 			t = timesteps.to(self.dtype),
 			y = context.to(torch.int),
+			layer_skip = transformer_options.get("layer_skip", None),
 		)
 
-		## only return EPS
-		out = out.to(torch.float)
-		eps, rest = out[:, :self.in_channels], out[:, self.in_channels:]
-		return eps
+		## only return EPS, dropping the sigma channels before the cast
+		return out[:, :self.in_channels].to(torch.float)
 
 #################################################################################
 #				   Sine/Cosine Positional Embedding Functions				  #
@@ -5,8 +5,10 @@ import comfy.model_base
 import comfy.utils
 import comfy.conds
 import torch
+from argparse import Namespace
 from comfy import model_management
 from tqdm import tqdm
+from ..utils.sampling import add_sampling_hooks, CONDHost
 
 class EXM_HYDiT(comfy.supported_models_base.BASE):
 	unet_config = {}
@@ -33,13 +35,17 @@ class EXM_HYDiT_Model(comfy.model_base.BaseModel):
 		for name in ["context_t5", "context_mask", "context_t5_mask"]:
 			out[name] = comfy.conds.CONDRegular(kwargs[name])
 
+		# (clip, t5) token counts per row, lets the masked text attention cut the padding without a sync
+		lens = [kwargs[name].reshape(kwargs[name].shape[0], -1).sum(dim=1) for name in ["context_mask", "context_t5_mask"]]
+		out["text_lens"] = CONDHost(torch.stack(lens, dim=1).to(device="cpu", dtype=torch.long))
+
 		src_size_cond = kwargs.get("src_size_cond", None)
 		if src_size_cond is not None:
-			out["src_size_cond"] = comfy.conds.CONDRegular(torch.tensor(src_size_cond))
+			out["src_size_cond"] = comfy.conds.CONDConstant(tuple(src_size_cond)) # host side, read every step
 
 		return out
 
-def load_hydit(model_path, model_conf):
+def load_hydit(model_path, model_conf, infer_mode=None):
 	state_dict = comfy.utils.load_torch_file(model_path)
 	state_dict = state_dict.get("model", state_dict)
 
@@ -61,9 +67,14 @@ def load_hydit(model_path, model_conf):
 		device=model_management.get_torch_device()
 	)
 
+	# attention backend override, don't modify shared args from conf
+	unet_config = model_conf.unet_config.copy()
+	if infer_mode is not None:
+		unet_config["args"] = Namespace(**{**vars(unet_config["args"]), "infer_mode": infer_mode})
+
 	from .models.models import HunYuanDiT
 	model.diffusion_model = HunYuanDiT(
-		**model_conf.unet_config,
+		**unet_config,
 		log_fn=tqdm.write,
 	)
 
@@ -77,4 +88,9 @@ def load_hydit(model_path, model_conf):
 		load_device = load_device,
 		offload_device = offload_device,
 	)
+	add_sampling_hooks(
+		model_patcher, "hydit_sampling",
+		start = model.diffusion_model.sampling_start,
+		end = model.diffusion_model.sampling_end,
+	)
 	return model_patcher
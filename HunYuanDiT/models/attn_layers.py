@@ -2,16 +2,7 @@ import torch
 import torch.nn as nn
 from typing import Tuple, Union, Optional
 
-try:
-    import flash_attn
-    if hasattr(flash_attn, '__version__') and int(flash_attn.__version__[0]) == 2:
-        from flash_attn.flash_attn_interface import flash_attn_kvpacked_func
-        from flash_attn.modules.mha import FlashSelfAttention, FlashCrossAttention
-    else:
-        from flash_attn.flash_attn_interface import flash_attn_unpadded_kvpacked_func
-        from flash_attn.modules.mha import FlashSelfAttention, FlashCrossAttention
-except Exception as e:
-    print(f'flash_attn import failed: {e}')
+from ...utils.attention import attention
 
 
 def reshape_for_broadcast(freqs_cis: Union[torch.Tensor, Tuple[torch.Tensor]], x: torch.Tensor, head_first=False):
@@ -103,6 +94,26 @@ def apply_rotary_emb(
     return xq_out, xk_out
 
 
+def apply_rotary_emb_sdpa(x: torch.Tensor, cos: torch.Tensor, sin: torch.Tensor) -> torch.Tensor:
+    """
+    Apply real-valued rotary embeddings in the dtype of 'x'.
+
+    Same math as the tuple branch of `apply_rotary_emb`, but without the float upcast and for the
+    head-first layout used by `scaled_dot_product_attention`, so cos/sin broadcast over the last two dims.
+
+    Args:
+        x (torch.Tensor): Query or key tensor. [B, H, S, D]
+        cos (torch.Tensor): Cosine part of the RoPE, already cast to x.dtype/x.device. [S, D]
+        sin (torch.Tensor): Sine part of the RoPE, already cast to x.dtype/x.device. [S, D]
+
+    Returns:
+        torch.Tensor: Tensor with rotary embeddings applied. [B, H, S, D]
+    """
+    x_real, x_imag = x.unflatten(-1, (-1, 2)).unbind(-1)        # [B, H, S, D//2]
+    x_rot = torch.stack([-x_imag, x_real], dim=-1).flatten(-2)  # [B, H, S, D]
+    return torch.addcmul(x * cos, x_rot, sin)
+
+
 class FlashSelfMHAModified(nn.Module):
     """
     Use QK Normalization.
@@ -130,7 +141,7 @@ class FlashSelfMHAModified(nn.Module):
         # TODO: eps should be 1 / 65530 if using fp16
         self.q_norm = norm_layer(self.head_dim, elementwise_affine=True, eps=1e-6) if qk_norm else nn.Identity()
         self.k_norm = norm_layer(self.head_dim, elementwise_affine=True, eps=1e-6) if qk_norm else nn.Identity()
-        self.inner_attn = FlashSelfAttention(attention_dropout=attn_drop)
+        self.attn_drop = attn_drop
         self.out_proj = nn.Linear(dim, dim, bias=qkv_bias, **factory_kwargs)
         self.proj_drop = nn.Dropout(proj_drop)
 
@@ -157,9 +168,9 @@ class FlashSelfMHAModified(nn.Module):
             assert qq.shape == q.shape and kk.shape == k.shape, f'qq: {qq.shape}, q: {q.shape}, kk: {kk.shape}, k: {k.shape}'
             q, k = qq, kk
 
-        qkv = torch.stack([q, k, v], dim=2)     # [b, s, 3, h, d]
-        context = self.inner_attn(qkv)
-        out = self.out_proj(context.view(b, s, d))
+        q, k, v = (t.transpose(1, 2) for t in (q, k, v.to(q.dtype)))   # [b, h, s, d]
+        context = attention(q, k, v, dropout_p=self.attn_drop if self.training else 0.0, backend="flash")
+        out = self.out_proj(context.transpose(1, 2).reshape(b, s, d))
         out = self.proj_drop(out)
 
         out_tuple = (out,)
@@ -201,11 +212,11 @@ class FlashCrossMHAModified(nn.Module):
         self.q_norm = norm_layer(self.head_dim, elementwise_affine=True, eps=1e-6) if qk_norm else nn.Identity()
         self.k_norm = norm_layer(self.head_dim, elementwise_affine=True, eps=1e-6) if qk_norm else nn.Identity()
 
-        self.inner_attn = FlashCrossAttention(attention_dropout=attn_drop)
+        self.attn_drop = attn_drop
         self.out_proj = nn.Linear(qdim, qdim, bias=qkv_bias, **factory_kwargs)
         self.proj_drop = nn.Dropout(proj_drop)
 
-    def forward(self, x, y, freqs_cis_img=None):
+    def forward(self, x, y, freqs_cis_img=None, attn_mask=None):
         """
         Parameters
         ----------
@@ -215,6 +226,9 @@ class FlashCrossMHAModified(nn.Module):
             (batch, seqlen2, hidden_dim2)
         freqs_cis_img: torch.Tensor
             (batch, hidden_dim // num_heads), RoPE for image
+        attn_mask: torch.Tensor
+            (batch, seqlen2) bool, False for keys that should be ignored. flash_attn has no
+            masks, masked calls run on sdpa instead.
         """
         b, s1, _ = x.shape     # [b, s1, D]
         _, s2, _ = y.shape     # [b, s2, 1024]
@@ -230,9 +244,11 @@ class FlashCrossMHAModified(nn.Module):
             qq, _ = apply_rotary_emb(q, None, freqs_cis_img)
             assert qq.shape == q.shape, f'qq: {qq.shape}, q: {q.shape}'
             q = qq                              # [b, s1, h, d]
-        kv = torch.stack([k, v], dim=2)         # [b, s1, 2, h, d]
-        context = self.inner_attn(q, kv)        # [b, s1, h, d]
-        context = context.view(b, s1, -1)       # [b, s1, D]
+        q, k, v = (t.transpose(1, 2) for t in (q, k, v.to(q.dtype)))   # [b, h, s, d]
+        if attn_mask is not None:
+            attn_mask = attn_mask[:, None, None, :]                     # [b, 1, 1, s2]
+        context = attention(q, k, v, attn_mask=attn_mask, dropout_p=self.attn_drop if self.training else 0.0, backend="flash")
+        context = context.transpose(1, 2).reshape(b, s1, -1)            # [b, s1, D]
 
         out = self.out_proj(context)
         out = self.proj_drop(out)
@@ -278,7 +294,7 @@ class CrossAttention(nn.Module):
         self.out_proj = nn.Linear(qdim, qdim, bias=qkv_bias, **factory_kwargs)
         self.proj_drop = nn.Dropout(proj_drop)
 
-    def forward(self, x, y, freqs_cis_img=None):
+    def forward(self, x, y, freqs_cis_img=None, attn_mask=None):
         """
         Parameters
         ----------
@@ -288,6 +304,8 @@ class CrossAttention(nn.Module):
             (batch, seqlen2, hidden_dim2)
         freqs_cis_img: torch.Tensor
             (batch, hidden_dim // 2), RoPE for image
+        attn_mask: torch.Tensor
+            (batch, seqlen2) bool, False for keys that should be ignored
         """
         b, s1, c = x.shape     # [b, s1, D]
         _, s2, c = y.shape     # [b, s2, 1024]
@@ -304,16 +322,11 @@ class CrossAttention(nn.Module):
             assert qq.shape == q.shape, f'qq: {qq.shape}, q: {q.shape}'
             q = qq
 
-        q = q * self.scale
-        q = q.transpose(-2, -3).contiguous()        # q ->  B, L1, H, C - B, H, L1, C
-        k = k.permute(0, 2, 3, 1).contiguous()      # k ->  B, L2, H, C - B, H, C, L2
-        attn = q @ k                                # attn -> B, H, L1, L2
-        attn = attn.softmax(dim=-1)                 # attn -> B, H, L1, L2
-        attn = self.attn_drop(attn)
-        x = attn @ v.transpose(-2, -3)              # v -> B, L2, H, C - B, H, L2, C    x-> B, H, L1, C
-        context = x.transpose(1, 2)                 # context -> B, H, L1, C - B, L1, H, C
-
-        context = context.contiguous().view(b, s1, -1)
+        q, k, v = (t.transpose(1, 2) for t in (q, k, v))   # B, L, H, C - B, H, L, C
+        if attn_mask is not None:
+            attn_mask = attn_mask[:, None, None, :]         # B, L2 - B, 1, 1, L2
+        x = attention(q, k, v, attn_mask=attn_mask, dropout_p=self.attn_drop.p if self.training else 0.0)
+        context = x.transpose(1, 2).reshape(b, s1, -1)     # x -> B, H, L1, C - B, L1, H*C
 
         out = self.out_proj(context)  # context.reshape - B, L1, -1
         out = self.proj_drop(out)
@@ -362,13 +375,158 @@ class Attention(nn.Module):
                 f'qq: {qq.shape}, q: {q.shape}, kk: {kk.shape}, k: {k.shape}'
             q, k = qq, kk
 
-        # just use SDP here for now
-        x = torch.nn.functional.scaled_dot_product_attention(
-                q, k, v,
-        ).permute(0, 2, 1, 3).contiguous().reshape(B, N, C)
+        x = attention(q, k, v, dropout_p=self.attn_drop.p if self.training else 0.0)
+        x = x.transpose(1, 2).reshape(B, N, C)
         x = self.out_proj(x)
         x = self.proj_drop(x)
 
         out_tuple = (x,)
 
         return out_tuple
+
+
+class SDPASelfMHA(nn.Module):
+    """
+    Self-attention through the attention backend registry (sdpa unless another backend is picked).
+    Keeps q/k/v in the input dtype (no forced fp16) and applies RoPE in the head-first layout.
+    Parameter names match `FlashSelfMHAModified` / `Attention` so the same checkpoints load.
+    """
+    def __init__(self,
+                 dim,
+                 num_heads,
+                 qkv_bias=True,
+                 qk_norm=False,
+                 attn_drop=0.0,
+                 proj_drop=0.0,
+                 device=None,
+                 dtype=None,
+                 norm_layer=nn.LayerNorm,
+                 ):
+        factory_kwargs = {'device': device, 'dtype': dtype}
+        super().__init__()
+        self.dim = dim
+        self.num_heads = num_heads
+        assert self.dim % num_heads == 0, "self.kdim must be divisible by num_heads"
+        self.head_dim = self.dim // num_heads
+        assert self.head_dim % 8 == 0 and self.head_dim <= 128, "Only support head_dim <= 128 and divisible by 8"
+
+        self.Wqkv = nn.Linear(dim, 3 * dim, bias=qkv_bias, **factory_kwargs)
+        self.q_norm = norm_layer(self.head_dim, elementwise_affine=True, eps=1e-6) if qk_norm else nn.Identity()
+        self.k_norm = norm_layer(self.head_dim, elementwise_affine=True, eps=1e-6) if qk_norm else nn.Identity()
+        self.attn_drop = attn_drop
+        self.out_proj = nn.Linear(dim, dim, bias=qkv_bias, **factory_kwargs)
+        self.proj_drop = nn.Dropout(proj_drop)
+
+    def forward(self, x, freqs_cis_img=None):
+        """
+        Parameters
+        ----------
+        x: torch.Tensor
+            (batch, seqlen, hidden_dim) (where hidden_dim = num heads * head dim)
+        freqs_cis_img: tuple of torch.Tensor
+            (cos, sin), each (seqlen, head_dim), RoPE for image
+        """
+        b, s, d = x.shape
+
+        qkv = self.Wqkv(x).view(b, s, 3, self.num_heads, self.head_dim).permute(2, 0, 3, 1, 4)  # [3, b, h, s, d]
+        q, k, v = qkv.unbind(0)     # [b, h, s, d]
+        q = self.q_norm(q)
+        k = self.k_norm(k)
+
+        # Apply RoPE if needed
+        if freqs_cis_img is not None:
+            cos, sin = (f.to(device=q.device, dtype=q.dtype) for f in freqs_cis_img)
+            q = apply_rotary_emb_sdpa(q, cos, sin)
+            k = apply_rotary_emb_sdpa(k, cos, sin)
+
+        context = attention(
+            q, k, v,
+            dropout_p=self.attn_drop if self.training else 0.0,
+        )                                                   # [b, h, s, d]
+        out = self.out_proj(context.transpose(1, 2).reshape(b, s, d))
+        out = self.proj_drop(out)
+
+        out_tuple = (out,)
+
+        return out_tuple
+
+
+class SDPACrossMHA(nn.Module):
+    """
+    Cross-attention through the attention backend registry (sdpa unless another backend is picked).
+    Keeps q/k/v in the input dtype (no forced fp16) and applies RoPE to q in the head-first layout.
+    Parameter names match `FlashCrossMHAModified` / `CrossAttention` so the same checkpoints load.
+    """
+    def __init__(self,
+                 qdim,
+                 kdim,
+                 num_heads,
+                 qkv_bias=True,
+                 qk_norm=False,
+                 attn_drop=0.0,
+                 proj_drop=0.0,
+                 device=None,
+                 dtype=None,
+                 norm_layer=nn.LayerNorm,
+                 ):
+        factory_kwargs = {'device': device, 'dtype': dtype}
+        super().__init__()
+        self.qdim = qdim
+        self.kdim = kdim
+        self.num_heads = num_heads
+        assert self.qdim % num_heads == 0, "self.qdim must be divisible by num_heads"
+        self.head_dim = self.qdim // num_heads
+        assert self.head_dim % 8 == 0 and self.head_dim <= 128, "Only support head_dim <= 128 and divisible by 8"
+
+        self.q_proj = nn.Linear(qdim, qdim, bias=qkv_bias, **factory_kwargs)
+        self.kv_proj = nn.Linear(kdim, 2 * qdim, bias=qkv_bias, **factory_kwargs)
+
+        self.q_norm = norm_layer(self.head_dim, elementwise_affine=True, eps=1e-6) if qk_norm else nn.Identity()
+        self.k_norm = norm_layer(self.head_dim, elementwise_affine=True, eps=1e-6) if qk_norm else nn.Identity()
+        self.attn_drop = attn_drop
+        self.out_proj = nn.Linear(qdim, qdim, bias=qkv_bias, **factory_kwargs)
+        self.proj_drop = nn.Dropout(proj_drop)
+
+    def forward(self, x, y, freqs_cis_img=None, attn_mask=None):
+        """
+        Parameters
+        ----------
+        x: torch.Tensor
+            (batch, seqlen1, hidden_dim) (where hidden_dim = num_heads * head_dim)
+        y: torch.Tensor
+            (batch, seqlen2, hidden_dim2)
+        freqs_cis_img: tuple of torch.Tensor
+            (cos, sin), each (seqlen1, head_dim), RoPE for image
+        attn_mask: torch.Tensor
+            (batch, seqlen2) bool, False for keys that should be ignored
+        """
+        b, s1, _ = x.shape     # [b, s1, D]
+        _, s2, _ = y.shape     # [b, s2, 1024]
+
+        q = self.q_proj(x).view(b, s1, self.num_heads, self.head_dim).transpose(1, 2)             # [b, h, s1, d]
+        kv = self.kv_proj(y).view(b, s2, 2, self.num_heads, self.head_dim).permute(2, 0, 3, 1, 4)  # [2, b, h, s2, d]
+        k, v = kv.unbind(0)                     # [b, h, s2, d]
+        q = self.q_norm(q)
+        k = self.k_norm(k)
+
+        # Apply RoPE if needed
+        if freqs_cis_img is not None:
+            cos, sin = (f.to(device=q.device, dtype=q.dtype) for f in freqs_cis_img)
+            q = apply_rotary_emb_sdpa(q, cos, sin)
+
+        if attn_mask is not None:
+            attn_mask = attn_mask[:, None, None, :]  # [b, 1, 1, s2]
+
+        context = attention(
+            q, k, v,
+            attn_mask=attn_mask,
+            dropout_p=self.attn_drop if self.training else 0.0,
+        )                                       # [b, h, s1, d]
+        context = context.transpose(1, 2).reshape(b, s1, -1)  # [b, s1, D]
+
+        out = self.out_proj(context)
+        out = self.proj_drop(out)
+
+        out_tuple = (out,)
+
+        return out_tuple
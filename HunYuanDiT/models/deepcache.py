@@ -0,0 +1,66 @@
+from tqdm import tqdm
+
+from ...utils.sampling import SamplingRun
+
+
+class DeepCache:
+    """
+    DeepCache (arXiv:2312.00858) for the U-shaped HunYuanDiT block layout.
+
+    Full steps run every block and keep the input of block `depth - shallow`.
+    Cheap steps only run the `shallow` outermost blocks on each side of the U
+    (which still produce the long skips they need) and reuse the kept feature
+    for everything in between.
+
+    Steps are counted per model evaluation by `sampling`, which the model's sampling
+    hooks begin and end.
+    """
+    def __init__(self):
+        self.sampling = SamplingRun(reset=self.reset, report=self.report)
+
+    def reset(self):
+        self.step = -1
+        self.features = {}
+        self.blocks_run = 0
+        self.blocks_total = 0
+
+    def speedup(self):
+        return self.blocks_total / self.blocks_run if self.blocks_run else 1.0
+
+    def report(self):
+        if not self.blocks_run:
+            return
+        tqdm.write(
+            f"HyDiT DeepCache: ran {self.blocks_run}/{self.blocks_total} blocks over {self.step + 1} steps, "
+            f"~{self.speedup():.2f}x transformer speedup"
+        )
+
+    def update(self, opts, timesteps, transformer_options):
+        """
+        Advances the step counter and decides whether this step may reuse the cached feature.
+        Returns the `deepcache` argument for `HunYuanDiT.forward_raw`.
+        """
+        key = tuple(transformer_options.get("cond_or_uncond", []))
+        self.step = self.sampling.step(timesteps, transformer_options, key=key)
+
+        start, end, interval = opts["start_step"], opts["end_step"], opts["interval"]
+        reuse = (
+            self.step > start and
+            (end < 0 or self.step < end) and
+            (self.step - start) % interval != 0
+        )
+        return opts["depth"], key, reuse
+
+    def get(self, key, x):
+        feature = self.features.get(key, None)
+        if feature is None or feature.shape != x.shape or feature.device != x.device:
+            return None
+        return feature
+
+    def store(self, key, feature):
+        self.features[key] = feature
+
+    def count(self, run, total):
+        self.blocks_run += run
+        self.blocks_total += total
+        self.sampling.last(self.step)
@@ -5,6 +5,8 @@ from einops import repeat
 
 from timm.models.layers import to_2tuple
 
+from ...utils.patchify import patchify
+
 
 class PatchEmbed(nn.Module):
     """ 2D Image to Patch Embedding
@@ -55,6 +57,10 @@ class PatchEmbed(nn.Module):
         # B, C, H, W = x.shape
         # _assert(H == self.img_size[0], f"Input image height ({H}) doesn't match model ({self.img_size[0]}).")
         # _assert(W == self.img_size[1], f"Input image width ({W}) doesn't match model ({self.img_size[1]}).")
+        if self.flatten:
+            tokens = patchify(x, self.proj)
+            if tokens is not None:
+                return self.norm(tokens)
         x = self.proj(x)
         if self.flatten:
             x = x.flatten(2).transpose(1, 2)  # BCHW -> BNC
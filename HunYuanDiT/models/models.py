@@ -2,12 +2,16 @@ import torch
 import torch.nn as nn
 import torch.nn.functional as F
 from timm.models.vision_transformer import Mlp
+from tqdm import tqdm
 
-from .attn_layers import Attention, FlashCrossMHAModified, FlashSelfMHAModified, CrossAttention
+from .attn_layers import Attention, FlashCrossMHAModified, FlashSelfMHAModified, CrossAttention, SDPASelfMHA, SDPACrossMHA
 from .embedders import TimestepEmbedder, PatchEmbed, timestep_embedding
 from .norm_layers import RMSNorm
 from .poolers import AttentionPool
 from .posemb_layers import get_2d_rotary_pos_embed, get_fill_resize_and_crop
+from .deepcache import DeepCache
+from ...utils.patchify import unpatchify
+from ...utils.ffnchunk import chunked_ffn
 
 def modulate(x, shift, scale):
     return x * (1 + scale.unsqueeze(1)) + shift.unsqueeze(1)
@@ -36,6 +40,7 @@ class HunYuanDiTBlock(nn.Module):
                  mlp_ratio=4.0,
                  text_states_dim=1024,
                  use_flash_attn=False,
+                 use_sdpa=False,
                  qk_norm=False,
                  norm_type="layer",
                  skip=False,
@@ -55,6 +60,8 @@ class HunYuanDiTBlock(nn.Module):
         self.norm1 = norm_layer(hidden_size, elementwise_affine=use_ele_affine, eps=1e-6)
         if use_flash_attn:
             self.attn1 = FlashSelfMHAModified(hidden_size, num_heads=num_heads, qkv_bias=True, qk_norm=qk_norm)
+        elif use_sdpa:
+            self.attn1 = SDPASelfMHA(hidden_size, num_heads=num_heads, qkv_bias=True, qk_norm=qk_norm)
         else:
             self.attn1 = Attention(hidden_size, num_heads=num_heads, qkv_bias=True, qk_norm=qk_norm)
 
@@ -75,6 +82,9 @@ class HunYuanDiTBlock(nn.Module):
         if use_flash_attn:
             self.attn2 = FlashCrossMHAModified(hidden_size, text_states_dim, num_heads=num_heads, qkv_bias=True,
                                                qk_norm=qk_norm)
+        elif use_sdpa:
+            self.attn2 = SDPACrossMHA(hidden_size, text_states_dim, num_heads=num_heads, qkv_bias=True,
+                                      qk_norm=qk_norm)
         else:
             self.attn2 = CrossAttention(hidden_size, text_states_dim, num_heads=num_heads, qkv_bias=True,
                                         qk_norm=qk_norm)
@@ -87,29 +97,39 @@ class HunYuanDiTBlock(nn.Module):
         else:
             self.skip_linear = None
 
-    def forward(self, x, c=None, text_states=None, freq_cis_img=None, skip=None):
+    def forward(self, x, c=None, text_states=None, freq_cis_img=None, skip=None, text_states_mask=None, tome=None, ffn_chunk=None):
         # Long Skip Connection
         if self.skip_linear is not None:
             cat = torch.cat([x, skip], dim=-1)
             cat = self.skip_norm(cat)
             x = self.skip_linear(cat)
 
+        # Token Merging, planned on the block input including the long skip
+        merge = unmerge = lambda x: x
+        freq_cis_merged = freq_cis_img
+        plan = tome(x) if tome is not None else None
+        if plan is not None:
+            merge, unmerge, keep_idx = plan
+            # merged tokens keep the RoPE of the position they were taken from
+            freq_cis_merged = tuple(f[keep_idx] for f in freq_cis_img)
+
         # Self-Attention
         shift_msa = self.default_modulation(c).unsqueeze(dim=1)
         attn_inputs = (
-            self.norm1(x) + shift_msa, freq_cis_img,
+            merge(self.norm1(x) + shift_msa), freq_cis_merged,
         )
-        x = x + self.attn1(*attn_inputs)[0]
+        x = x + unmerge(self.attn1(*attn_inputs)[0])
 
         # Cross-Attention
         cross_inputs = (
             self.norm3(x), text_states, freq_cis_img
         )
-        x = x + self.attn2(*cross_inputs)[0]
+        cross_kwargs = {} if text_states_mask is None else {"attn_mask": text_states_mask}
+        x = x + self.attn2(*cross_inputs, **cross_kwargs)[0]
 
         # FFN Layer
-        mlp_inputs = self.norm2(x)
-        x = x + self.mlp(mlp_inputs)
+        mlp_inputs = merge(self.norm2(x))
+        x = x + unmerge(chunked_ffn(self.mlp, mlp_inputs, ffn_chunk))
 
         return x
 
@@ -134,6 +154,61 @@ class FinalLayer(nn.Module):
         return x
 
 
+class TextCondCache:
+    """
+    Cache for the step-invariant part of the HunYuanDiT conditioning (text states, text mask,
+    pooled text / image size embedding). Only used within a sampling run and cleared by the
+    sampling hooks, the weights and prompts can't change under it. Entries are keyed on host
+    side values (see `key`), nothing is compared on the device.
+    """
+    def __init__(self, max_entries=4):
+        self.max_entries = max_entries
+        self.entries = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(cond_key, *args):
+        """
+        cond_key: identity of the conditioning in the batch (ComfyUI's cond uuids)
+        args: the inputs, only the shape/dtype/device of the tensors is part of the key
+        """
+        return (cond_key,) + tuple((tuple(a.shape), a.dtype, a.device) if torch.is_tensor(a) else a for a in args)
+
+    def get(self, fn, key, *args):
+        value = self.entries.pop(key, None)
+        if value is None:
+            self.misses += 1
+            value = fn(*args)
+        else:
+            self.hits += 1
+        self.entries[key] = value # most recent last
+        if len(self.entries) > self.max_entries:
+            del self.entries[next(iter(self.entries))]
+        return value
+
+    def clear(self):
+        self.entries = {}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self.entries),
+        }
+
+    def report(self):
+        s = self.stats()
+        if s["hits"] + s["misses"]:
+            tqdm.write(f"HyDiT TextCondCache: {s['hits']} hits, {s['misses']} misses ({s['hit_rate']:.0%} hit rate), {s['entries']} entries")
+
+
 class HunYuanDiT(nn.Module):
     """
     HunYuanDiT: Diffusion model with a Transformer backbone.
@@ -193,8 +268,11 @@ class HunYuanDiT(nn.Module):
         self.cond_style = cond_style
 
         use_flash_attn = args.infer_mode == 'fa'
+        use_sdpa = args.infer_mode == 'sdpa'
         if use_flash_attn:
             log_fn(f"    Enable Flash Attention.")
+        elif use_sdpa:
+            log_fn(f"    Enable SDPA Attention.")
         qk_norm = True  # See http://arxiv.org/abs/2302.05442 for details.
 
         self.mlp_t5 = nn.Sequential(
@@ -221,6 +299,8 @@ class HunYuanDiT(nn.Module):
 
         # Text embedding for `add`
         self.last_size = input_size
+        self.rope = None # (cos, sin) on device for self.rope_key
+        self.rope_key = None
         self.x_embedder = PatchEmbed(input_size, patch_size, in_channels, hidden_size)
         self.t_embedder = TimestepEmbedder(hidden_size)
         self.extra_in_dim += 1024
@@ -242,6 +322,7 @@ class HunYuanDiT(nn.Module):
                             mlp_ratio=mlp_ratio,
                             text_states_dim=self.text_states_dim,
                             use_flash_attn=use_flash_attn,
+                            use_sdpa=use_sdpa,
                             qk_norm=qk_norm,
                             norm_type=self.norm,
                             skip=layer > depth // 2,
@@ -252,6 +333,91 @@ class HunYuanDiT(nn.Module):
         self.final_layer = FinalLayer(hidden_size, hidden_size, patch_size, self.out_channels)
         self.unpatchify_channels = self.out_channels
 
+        # Prompt/size conditioning only changes between sampling runs, reuse it across steps.
+        self.text_cond_cache = TextCondCache()
+        self.sampling = False
+        # Feature reuse across steps, only active when enabled through the transformer options.
+        self.deepcache = DeepCache()
+
+    def sampling_start(self):
+        """
+        Called by the sampling hooks the loader installs, the weights can only be patched between runs.
+        """
+        self.text_cond_cache.clear()
+        self.text_cond_cache.reset_stats()
+        self.sampling = True
+        self.deepcache.sampling.begin()
+
+    def sampling_end(self):
+        self.text_cond_cache.report()
+        self.text_cond_cache.clear()
+        self.sampling = False
+        self.deepcache.sampling.end()
+
+    def prepare_text_cond(self,
+                          encoder_hidden_states,
+                          text_embedding_mask,
+                          encoder_hidden_states_t5,
+                          text_embedding_mask_t5,
+                          image_meta_size,
+                          style,
+                          text_attn,
+                          text_lens=None,
+                          static_text=False,
+                          ):
+        """
+        Builds everything that only depends on the prompt and size condition.
+        Returns the text states, the text mask (None in "padding" mode) and the extra embedding added to `t`.
+        text_lens: optional (B, 2) host tensor of the clip/t5 token counts, computed from the masks (one device sync) if missing.
+        static_text: keep the full text length in the "masked" mode, same shapes for every prompt (compiled blocks).
+        """
+        text_states = encoder_hidden_states                     # 2,77,1024
+        text_states_t5 = encoder_hidden_states_t5               # 2,256,2048
+        text_states_mask = text_embedding_mask.bool()           # 2,77
+        text_states_t5_mask = text_embedding_mask_t5.bool()     # 2,256
+        if text_attn == "masked" and not static_text:
+            # Cut the padding shared by the whole batch, the rest is masked in the cross-attention.
+            if text_lens is None:
+                # direct calls only, through ComfyUI they're the host tensor of the loader's CONDHost
+                text_lens = torch.stack([text_states_mask.sum(1), text_states_t5_mask.sum(1)], dim=1).cpu()
+            assert text_lens.device.type == "cpu", "text_lens has to stay on the host, see CONDHost"
+            l_clip, l_t5 = text_lens.max(dim=0).values.tolist()
+            l_clip = max(l_clip, 1) # keep BOS, see below
+            text_states, text_states_mask = text_states[:, :l_clip], text_states_mask[:, :l_clip]
+            text_states_t5, text_states_t5_mask = text_states_t5[:, :l_t5], text_states_t5_mask[:, :l_t5]
+        b_t5, l_t5, c_t5 = text_states_t5.shape
+        text_states_t5 = self.mlp_t5(text_states_t5.reshape(-1, c_t5))
+        text_states = torch.cat([text_states, text_states_t5.view(b_t5, l_t5, -1)], dim=1)  # 2,205，1024
+        clip_t5_mask = torch.cat([text_states_mask, text_states_t5_mask], dim=-1)
+
+        if text_attn == "masked":
+            # Always attend to the first CLIP token (BOS), rows without any valid key would softmax to NaN.
+            text_mask = torch.cat([torch.ones_like(clip_t5_mask[:, :1]), clip_t5_mask[:, 1:]], dim=1)
+        else:
+            text_mask = None
+            text_states = torch.where(clip_t5_mask.unsqueeze(2), text_states, self.text_embedding_padding.to(text_states))
+
+        # ========================= Concatenate all extra vectors =========================
+        # Build text tokens with pooling
+        extra_vec = self.pooler(encoder_hidden_states_t5)
+
+        if self.cond_res:
+                # Build image meta size tokens
+                image_meta_size = timestep_embedding(image_meta_size.view(-1), 256)   # [B * 6, 256]
+                # if self.args.use_fp16:
+                    # image_meta_size = image_meta_size.half()
+        
+                image_meta_size = image_meta_size.view(-1, 6 * 256)
+                extra_vec = torch.cat([extra_vec, image_meta_size], dim=1)  # [B, D + 6 * 256]
+
+        if self.cond_style:
+                # Build style tokens
+                style_embedding = self.style_embedder(style)
+                extra_vec = torch.cat([extra_vec, style_embedding], dim=1)
+
+        extra_emb = self.extra_embedder(extra_vec.to(self.dtype))  # [B, D]
+        return text_states, text_mask, extra_emb
+
     def forward_raw(self,
                 x,
                 t,
@@ -264,6 +430,14 @@ class HunYuanDiT(nn.Module):
                 cos_cis_img=None,
                 sin_cis_img=None,
                 return_dict=False,
+                text_attn="padding",
+                text_lens=None,
+                deepcache=None,
+                tome=None,
+                layer_skip=None,
+                ffn_chunk=None,
+                static_text=False,
+                text_cond_key=None,
                 ):
         """
         Forward pass of the encoder.
@@ -290,19 +464,38 @@ class HunYuanDiT(nn.Module):
         sin_cis_img: torch.Tensor
         return_dict: bool
             Whether to return a dictionary.
+        text_attn: str
+            "padding" replaces padded text tokens with `text_embedding_padding` (reference behavior).
+            "masked" drops padded text tokens and masks them out of the cross-attention instead.
+        text_lens: torch.Tensor
+            Optional (B, 2) host side clip/t5 token counts for the "masked" mode.
+        deepcache: tuple
+            (shallow, key, reuse) from `DeepCache.update`, None to always run every block.
+        tome: callable
+            fn(layer, x, (th, tw)) returning the token merging plan for that block, or None.
+        layer_skip: callable
+            fn(layer, depth), blocks it returns True for are skipped. Their long skips are still passed along.
+        ffn_chunk: int
+            Tokens per MLP pass, bounds the hidden activations at high resolutions. None for a single pass.
+        static_text: bool
+            Don't cut the text padding in the "masked" mode, the shapes stay the same for every prompt.
+        text_cond_key: tuple
+            Host side identity of the conditioning rows and size condition (ComfyUI's cond uuids),
+            the prepared text conditioning is cached under it for the rest of the sampling run.
+            None to not cache.
         """
 
-        text_states = encoder_hidden_states                     # 2,77,1024
-        text_states_t5 = encoder_hidden_states_t5               # 2,256,2048
-        text_states_mask = text_embedding_mask.bool()           # 2,77
-        text_states_t5_mask = text_embedding_mask_t5.bool()     # 2,256
-        b_t5, l_t5, c_t5 = text_states_t5.shape
-        text_states_t5 = self.mlp_t5(text_states_t5.view(-1, c_t5))
-        text_states = torch.cat([text_states, text_states_t5.view(b_t5, l_t5, -1)], dim=1)  # 2,205，1024
-        clip_t5_mask = torch.cat([text_states_mask, text_states_t5_mask], dim=-1)
-
-        clip_t5_mask = clip_t5_mask
-        text_states = torch.where(clip_t5_mask.unsqueeze(2), text_states, self.text_embedding_padding.to(text_states))
+        text_cond = (
+            encoder_hidden_states, text_embedding_mask,
+            encoder_hidden_states_t5, text_embedding_mask_t5,
+            image_meta_size, style, text_attn, text_lens, static_text,
+        )
+        if self.sampling and text_cond_key is not None and not torch.is_grad_enabled():
+            text_states, text_mask, extra_emb = self.text_cond_cache.get(
+                self.prepare_text_cond, self.text_cond_cache.key(text_cond_key, *text_cond), *text_cond
+            )
+        else:
+            text_states, text_mask, extra_emb = self.prepare_text_cond(*text_cond)
 
         _, _, oh, ow = x.shape
         th, tw = oh // self.patch_size, ow // self.patch_size
@@ -314,35 +507,42 @@ class HunYuanDiT(nn.Module):
         # Get image RoPE embedding according to `reso`lution.
         freqs_cis_img = (cos_cis_img, sin_cis_img)
 
-        # ========================= Concatenate all extra vectors =========================
-        # Build text tokens with pooling
-        extra_vec = self.pooler(encoder_hidden_states_t5)
-
-        if self.cond_res:
-                # Build image meta size tokens
-                image_meta_size = timestep_embedding(image_meta_size.view(-1), 256)   # [B * 6, 256]
-                # if self.args.use_fp16:
-                    # image_meta_size = image_meta_size.half()
-        
-                image_meta_size = image_meta_size.view(-1, 6 * 256)
-                extra_vec = torch.cat([extra_vec, image_meta_size], dim=1)  # [B, D + 6 * 256]
-
-        if self.cond_style:
-                # Build style tokens
-                style_embedding = self.style_embedder(style)
-                extra_vec = torch.cat([extra_vec, style_embedding], dim=1)
-
-        # Concatenate all extra vectors
-        c = t + self.extra_embedder(extra_vec.to(self.dtype))  # [B, D]
+        c = t + extra_emb  # [B, D]
 
         # ========================= Forward pass through HunYuanDiT blocks =========================
+        layers = range(self.depth)
+        cached = None
+        if deepcache is not None:
+            shallow, cache_key, reuse = deepcache
+            shallow = max(1, min(shallow, self.depth // 2 - 1))
+            cached = self.deepcache.get(cache_key, x) if reuse else None
+            if cached is not None:
+                layers = list(range(shallow)) + list(range(self.depth - shallow, self.depth))
+            self.deepcache.count(len(layers), self.depth)
+
         skips = []
-        for layer, block in enumerate(self.blocks):
+        for layer in layers:
+            block = self.blocks[layer]
+            if cached is not None and layer == self.depth - shallow:
+                x = cached
+            elif deepcache is not None and layer == self.depth - shallow:
+                self.deepcache.store(cache_key, x)
+
+            if layer_skip is not None and layer_skip(layer, self.depth):
+                if layer > self.depth // 2:
+                    skips.pop()
+                if layer < (self.depth // 2 - 1):
+                    skips.append(x)
+                continue
+
+            block_tome = None
+            if tome is not None:
+                block_tome = lambda x, layer=layer: tome(layer, x, (th, tw))
             if layer > self.depth // 2:
                 skip = skips.pop()
-                x = block(x, c, text_states, freqs_cis_img, skip)   # (N, L, D)
+                x = block(x, c, text_states, freqs_cis_img, skip, text_states_mask=text_mask, tome=block_tome, ffn_chunk=ffn_chunk)   # (N, L, D)
             else:
-                x = block(x, c, text_states, freqs_cis_img)         # (N, L, D)
+                x = block(x, c, text_states, freqs_cis_img, text_states_mask=text_mask, tome=block_tome, ffn_chunk=ffn_chunk)         # (N, L, D)
 
             if layer < (self.depth // 2 - 1):
                 skips.append(x)
@@ -377,20 +577,35 @@ class HunYuanDiT(nn.Module):
         """
         # context_mask = torch.zeros(x.shape[0], 77, device=x.device)
         # context_t5_mask = torch.zeros(x.shape[0], 256, device=x.device)
+        transformer_options = kwargs.get("transformer_options", {})
 
         # style
-        style = torch.as_tensor([0] * (x.shape[0]), device=x.device)
+        style = torch.zeros(x.shape[0], dtype=torch.long, device=x.device)
 
         # image size - todo separate for cond/uncond when batched
+        # passed as a host tuple by the loader, tensors (older workflows) cost a device sync
         if torch.is_tensor(src_size_cond):
                 src_size_cond = (int(src_size_cond[0][0]), int(src_size_cond[0][1]))
         
         image_size = (x.shape[2]//2*16, x.shape[3]//2*16)
         size_cond = list(src_size_cond) + [image_size[1], image_size[0], 0, 0]
-        image_meta_size = torch.as_tensor([size_cond] * x.shape[0], device=x.device)
+        image_meta_size = torch.tensor([size_cond] * x.shape[0], dtype=self.dtype, device=x.device)
+
+        # prepared text conditioning is cached per cond and size for the sampling run, see TextCondCache
+        text_cond_key = transformer_options.get("uuids", None)
+        if text_cond_key is not None:
+                text_cond_key = (tuple(text_cond_key), tuple(size_cond))
 
-        # RoPE
-        rope = self.calc_rope(*image_size)
+        # RoPE, only recomputed when the size changes
+        rope_key = (image_size, x.device)
+        if self.rope is None or self.rope_key != rope_key:
+                self.rope = tuple(r.to(x.device) for r in self.calc_rope(*image_size))
+                self.rope_key = rope_key
+
+        # DeepCache
+        deepcache = transformer_options.get("hydit_deepcache", None)
+        if deepcache is not None:
+                deepcache = self.deepcache.update(deepcache, timesteps, transformer_options)
 
         # Update x_embedder if image size changed
         if self.last_size != image_size:
@@ -401,27 +616,32 @@ class HunYuanDiT(nn.Module):
                 )
                 self.last_size = image_size
 
-        # Run original forward pass
+        # Run original forward pass, the masks are only used as bool so they're passed as-is
         out = self.forward_raw(
                 x = x.to(self.dtype),
                 t = timesteps.to(self.dtype),
                 encoder_hidden_states = context.to(self.dtype),
-                text_embedding_mask   = context_mask.to(self.dtype),
+                text_embedding_mask   = context_mask,
                 encoder_hidden_states_t5 = context_t5.to(self.dtype),
-                text_embedding_mask_t5   = context_t5_mask.to(self.dtype),
-                image_meta_size = image_meta_size.to(self.dtype),
+                text_embedding_mask_t5   = context_t5_mask,
+                image_meta_size = image_meta_size,
                 style = style,
-                cos_cis_img = rope[0],
-                sin_cis_img = rope[1],
+                cos_cis_img = self.rope[0],
+                sin_cis_img = self.rope[1],
+                text_attn = transformer_options.get("hydit_text_attn", "padding"),
+                text_lens = kwargs.get("text_lens", None),
+                deepcache = deepcache,
+                tome = transformer_options.get("tome", None),
+                layer_skip = transformer_options.get("layer_skip", None),
+                ffn_chunk = transformer_options.get("ffn_chunk", None),
+                static_text = transformer_options.get("static_text", False),
+                text_cond_key = text_cond_key,
         )
         
-        # return
-        out = out.to(torch.float)
+        # return, drop the sigma channels before casting
         if self.learn_sigma:
-                eps, rest = out[:, :self.in_channels], out[:, self.in_channels:]
-                return eps
-        else:
-                return out
+                out = out[:, :self.in_channels]
+        return out.to(torch.float)
 
     def unpatchify(self, x, h, w):
         """
@@ -433,7 +653,4 @@ class HunYuanDiT(nn.Module):
         # h = w = int(x.shape[1] ** 0.5)
         assert h * w == x.shape[1]
 
-        x = x.reshape(shape=(x.shape[0], h, w, p, p, c))
-        x = torch.einsum('nhwpqc->nchpwq', x)
-        imgs = x.reshape(shape=(x.shape[0], c, h * p, w * p))
-        return imgs
+        return unpatchify(x, h, w, p, c)
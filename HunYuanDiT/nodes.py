@@ -12,6 +12,7 @@ class HYDiTCheckpointLoader:
 			"required": {
 				"ckpt_name": (folder_paths.get_filename_list("checkpoints"),),
 				"model": (list(hydit_conf.keys()),{"default":"G/2"}),
+				"attention": (["torch", "sdpa", "fa"],{"default":"torch"}),
 			}
 		}
 	RETURN_TYPES = ("MODEL",)
@@ -20,12 +21,13 @@ class HYDiTCheckpointLoader:
 	CATEGORY = "ExtraModels/HunyuanDiT"
 	TITLE = "Hunyuan DiT Checkpoint Loader"
 
-	def load_checkpoint(self, ckpt_name, model):
+	def load_checkpoint(self, ckpt_name, model, attention):
 		ckpt_path = folder_paths.get_full_path("checkpoints", ckpt_name)
 		model_conf = hydit_conf[model]
 		model = load_hydit(
 			model_path = ckpt_path,
 			model_conf = model_conf,
+			infer_mode = attention,
 		)
 		return (model,)
 
@@ -189,10 +191,69 @@ class HYDiTSrcSizeCond:
 			})
 		return (cond,)
 
+class HYDiTTextAttention:
+	@classmethod
+	def INPUT_TYPES(s):
+		return {
+			"required": {
+				"model": ("MODEL",),
+				"mode": (["padding", "masked"],{"default":"padding"}),
+			}
+		}
+
+	RETURN_TYPES = ("MODEL",)
+	FUNCTION = "patch"
+	CATEGORY = "ExtraModels/HunyuanDiT"
+	TITLE = "Hunyuan DiT Text Attention Mode"
+
+	def patch(self, model, mode):
+		"""
+		padding: padded text tokens are replaced with the learned padding embedding (reference).
+		masked: padded text tokens are dropped from the cross-attention, faster for short prompts.
+		"""
+		m = model.clone()
+		m.model_options["transformer_options"]["hydit_text_attn"] = mode
+		return (m,)
+
+class HYDiTDeepCache:
+	@classmethod
+	def INPUT_TYPES(s):
+		return {
+			"required": {
+				"model": ("MODEL",),
+				"cache_interval": ("INT", {"default": 3, "min": 1, "max": 1000}),
+				"cache_depth": ("INT", {"default": 2, "min": 1, "max": 19}),
+				"start_step": ("INT", {"default": 0, "min": 0, "max": 10000}),
+				"end_step": ("INT", {"default": -1, "min": -1, "max": 10000}),
+			}
+		}
+
+	RETURN_TYPES = ("MODEL",)
+	FUNCTION = "patch"
+	CATEGORY = "ExtraModels/HunyuanDiT"
+	TITLE = "Hunyuan DiT DeepCache"
+
+	def patch(self, model, cache_interval, cache_depth, start_step, end_step):
+		"""
+		Runs every block once every `cache_interval` steps. The steps in between only run the
+		`cache_depth` outermost blocks on each side and reuse the deep features of the last full step.
+		Steps before `start_step` and from `end_step` on (-1 for never) always run every block.
+		"""
+		m = model.clone()
+		m.model_options["transformer_options"]["hydit_deepcache"] = {
+			"interval": cache_interval,
+			"depth": cache_depth,
+			"start_step": start_step,
+			"end_step": end_step,
+		}
+		return (m,)
+
 NODE_CLASS_MAPPINGS = {
 	"HYDiTCheckpointLoader": HYDiTCheckpointLoader,
 	"HYDiTTextEncoderLoader": HYDiTTextEncoderLoader,
 	"HYDiTTextEncode": HYDiTTextEncode,
 	"HYDiTTextEncodeSimple": HYDiTTextEncodeSimple,
 	"HYDiTSrcSizeCond": HYDiTSrcSizeCond,
+	"HYDiTTextAttention": HYDiTTextAttention,
+	"HYDiTDeepCache": HYDiTDeepCache,
 }
@@ -15,8 +15,11 @@ from timm.models.layers import DropPath
 from timm.models.vision_transformer import Mlp
 
 from .utils import auto_grad_checkpoint, to_2tuple
-from .PixArt_blocks import t2i_modulate, CaptionEmbedder, AttentionKVCompress, MultiHeadCrossAttention, T2IFinalLayer, TimestepEmbedder, SizeEmbedder
+from .PixArt_blocks import CaptionEmbedder, AttentionKVCompress, MultiHeadCrossAttention, T2IFinalLayer, TimestepEmbedder, SizeEmbedder
 from .PixArt import PixArt, get_2d_sincos_pos_embed
+from ...utils.fused import norm_modulate, gated_residual
+from ...utils.patchify import patchify, unpatchify
+from ...utils.ffnchunk import chunked_ffn
 
 
 class PatchEmbed(nn.Module):
@@ -40,6 +43,10 @@ class PatchEmbed(nn.Module):
         self.norm = norm_layer(embed_dim) if norm_layer else nn.Identity()
 
     def forward(self, x):
+        if self.flatten:
+            tokens = patchify(x, self.proj)
+            if tokens is not None:
+                return self.norm(tokens)
         x = self.proj(x)
         if self.flatten:
             x = x.flatten(2).transpose(1, 2)  # BCHW -> BNC
@@ -68,13 +75,20 @@ class PixArtMSBlock(nn.Module):
         self.drop_path = DropPath(drop_path) if drop_path > 0. else nn.Identity()
         self.scale_shift_table = nn.Parameter(torch.randn(6, hidden_size) / hidden_size ** 0.5)
 
-    def forward(self, x, y, t, mask=None, HW=None, **kwargs):
+    def forward(self, x, y, t, mask=None, HW=None, tome=None, kv_compress=None, kv_gather=None, ffn_chunk=None, **kwargs):
         B, N, C = x.shape
 
+        # token merging, KV compression needs the full token grid
+        merge = unmerge = lambda x: x
+        if tome is not None and self.attn.kv_compress_mode(kv_compress)[1] == 1:
+            merge, unmerge, _ = tome
+
         shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = (self.scale_shift_table[None] + t.reshape(B, 6, -1)).chunk(6, dim=1)
-        x = x + self.drop_path(gate_msa * self.attn(t2i_modulate(self.norm1(x), shift_msa, scale_msa), HW=HW))
+        h = unmerge(self.attn(merge(norm_modulate(x, self.norm1, shift_msa, scale_msa)), HW=HW, kv_compress=kv_compress, kv_gather=kv_gather))
+        x = gated_residual(x, gate_msa, self.drop_path(h))
         x = x + self.cross_attn(x, y, mask)
-        x = x + self.drop_path(gate_mlp * self.mlp(t2i_modulate(self.norm2(x), shift_mlp, scale_mlp)))
+        h = unmerge(chunked_ffn(self.mlp, merge(norm_modulate(x, self.norm2, shift_mlp, scale_mlp)), ffn_chunk))
+        x = gated_residual(x, gate_mlp, self.drop_path(h), inplace=True)
 
         return x
 
@@ -128,6 +142,8 @@ class PixArtMS(PixArt):
         )
         self.dtype = torch.get_default_dtype()
         self.h = self.w = 0
+        self.pos_embed_ms = None
+        self.pos_embed_key = None
         approx_gelu = lambda: nn.GELU(approximate="tanh")
         self.t_block = nn.Sequential(
             nn.SiLU(),
@@ -158,12 +174,19 @@ class PixArtMS(PixArt):
         ])
         self.final_layer = T2IFinalLayer(hidden_size, patch_size, self.out_channels)
 
-    def forward_raw(self, x, t, y, mask=None, data_info=None, **kwargs):
+    def forward_raw(self, x, t, y, mask=None, data_info=None, block_cache=None, tome=None, kv_compress=None, layer_skip=None, patch_parallel=None, ffn_chunk=None, static_text=False, **kwargs):
         """
         Original forward pass of PixArt.
         x: (N, C, H, W) tensor of spatial inputs (images or latent representations of images)
         t: (N,) tensor of diffusion timesteps
         y: (N, 1, 120, C) tensor of class labels
+        block_cache: optional fn(x, first, rest) that may skip the blocks after the first one
+        tome: optional fn(layer, x, HW) returning the token merging plan for that block
+        kv_compress: optional runtime override of kv_compress_config, applied to the blocks in [start_block, end_block)
+        layer_skip: optional fn(layer, depth), blocks it returns True for are skipped
+        patch_parallel: optional bound PatchParallel, the blocks only run on this rank's slice of the tokens
+        ffn_chunk: optional number of tokens per MLP pass, bounds the hidden activations
+        static_text: keep the text padded and mask it on the device, same shapes for every prompt (compiled blocks)
         """
         bs = x.shape[0]
         x = x.to(self.dtype)
@@ -176,15 +199,22 @@ class PixArtMS(PixArt):
             pe_interpolation = round((x.shape[-1]+x.shape[-2])/2.0 / (512/8.0), self.pe_precision or 0)
 
         self.h, self.w = x.shape[-2]//self.patch_size, x.shape[-1]//self.patch_size
-        pos_embed = torch.from_numpy(
-            get_2d_sincos_pos_embed(
-                self.pos_embed.shape[-1], (self.h, self.w), pe_interpolation=pe_interpolation,
-                base_size=self.base_size
-            )
-        ).unsqueeze(0).to(device=x.device, dtype=self.dtype)
+        pe_key = (self.h, self.w, pe_interpolation, x.device, self.dtype)
+        if self.pos_embed_ms is None or self.pos_embed_key != pe_key:
+            self.pos_embed_ms = torch.from_numpy(
+                get_2d_sincos_pos_embed(
+                    self.pos_embed.shape[-1], (self.h, self.w), pe_interpolation=pe_interpolation,
+                    base_size=self.base_size
+                )
+            ).unsqueeze(0).to(device=x.device, dtype=self.dtype)
+            self.pos_embed_key = pe_key
 
-        x = self.x_embedder(x) + pos_embed  # (N, T, D), where T = H * W / patch_size ** 2
+        x = self.x_embedder(x) + self.pos_embed_ms  # (N, T, D), where T = H * W / patch_size ** 2
         t = self.t_embedder(timestep)  # (N, D)
+        if patch_parallel is not None and not patch_parallel.can_split(x):
+            patch_parallel = None
+        if patch_parallel is not None:
+            x = patch_parallel.split(x)
 
         if self.micro_conditioning:
             c_size, ar = data_info['img_hw'].to(self.dtype), data_info['aspect_ratio'].to(self.dtype)
@@ -199,15 +229,39 @@ class PixArtMS(PixArt):
             if mask.shape[0] != y.shape[0]:
                 mask = mask.repeat(y.shape[0] // mask.shape[0], 1)
             mask = mask.squeeze(1).squeeze(1)
-            y = y.squeeze(1).masked_select(mask.unsqueeze(-1) != 0).view(1, -1, x.shape[-1])
-            y_lens = mask.sum(dim=1).tolist()
+            if static_text:
+                y = y.squeeze(1).reshape(1, -1, x.shape[-1])
+                y_lens = (mask != 0).sum(dim=1)
+            else:
+                y = y.squeeze(1).masked_select(mask.unsqueeze(-1) != 0).view(1, -1, x.shape[-1])
+                y_lens = (mask != 0).sum(dim=1).tolist()
         else:
             y_lens = [y.shape[2]] * y.shape[0]
             y = y.squeeze(1).view(1, -1, x.shape[-1])
-        for block in self.blocks:
-            x = auto_grad_checkpoint(block, x, y, t0, y_lens, (self.h, self.w), **kwargs)  # (N, T, D) #support grad checkpoint
+        def run_blocks(x, start, end):
+            for layer in range(start, end):
+                if layer_skip is not None and layer_skip(layer, len(self.blocks)):
+                    continue
+                block_tome = tome(layer, x, (self.h, self.w)) if tome is not None else None
+                block_kv = None
+                if kv_compress is not None and kv_compress['start_block'] <= layer and (kv_compress['end_block'] < 0 or layer < kv_compress['end_block']):
+                    block_kv = (kv_compress['sampling'], kv_compress['scale_factor'])
+                block_kv_gather = patch_parallel.kv_gather(layer) if patch_parallel is not None else None
+                x = auto_grad_checkpoint(self.blocks[layer], x, y, t0, y_lens, (self.h, self.w), tome=block_tome, kv_compress=block_kv, kv_gather=block_kv_gather, ffn_chunk=ffn_chunk, **kwargs)  # (N, T, D) #support grad checkpoint
+            return x
+
+        if block_cache is not None:
+            x = block_cache(
+                x,
+                lambda x: run_blocks(x, 0, 1),
+                lambda x: run_blocks(x, 1, len(self.blocks)),
+            )
+        else:
+            x = run_blocks(x, 0, len(self.blocks))
 
         x = self.final_layer(x, t)  # (N, T, patch_size ** 2 * out_channels)
+        if patch_parallel is not None:
+            x = patch_parallel.gather(x)
         x = self.unpatchify(x)  # (N, out_channels, H, W)
         
         return x
@@ -223,6 +277,9 @@ class PixArtMS(PixArt):
         """
         ## size/ar from cond with fallback based on the latent image shape.
         bs = x.shape[0]
+        transformer_options = kwargs.get("transformer_options", {})
+        if transformer_options.get("resolution_from_latent", False):
+            img_hw = None # reduced resolution pass of a progressive sampler
         data_info = {}
         if img_hw is None:
             data_info["img_hw"] = torch.tensor(
@@ -231,7 +288,7 @@ class PixArtMS(PixArt):
                 device=x.device
             ).repeat(bs, 1)
         else:
-            data_info["img_hw"] = img_hw.to(dtype=x.dtype, device=x.device)
+            data_info["img_hw"] = img_hw.to(dtype=self.dtype, device=x.device)
         if aspect_ratio is None or True:
             data_info["aspect_ratio"] = torch.tensor(
                 [[x.shape[2]/x.shape[3]]],
@@ -239,24 +296,43 @@ class PixArtMS(PixArt):
                 device=x.device
             ).repeat(bs, 1)
         else:
-            data_info["aspect_ratio"] = aspect_ratio.to(dtype=x.dtype, device=x.device)
+            data_info["aspect_ratio"] = aspect_ratio.to(dtype=self.dtype, device=x.device)
 
         ## Still accepts the input w/o that dim but returns garbage
         if len(context.shape) == 3:
             context = context.unsqueeze(1)
 
-        ## run original forward pass
+        ## optional residual caching for the blocks after the first one
+        block_cache = transformer_options.get("block_cache", None)
+        tome = transformer_options.get("tome", None)
+
+        ## patch parallel, every rank has to take the same path so skip the data-dependent features
+        patch_parallel = transformer_options.get("patch_parallel", None)
+        if patch_parallel is not None:
+            patch_parallel = patch_parallel.bind(timesteps, transformer_options)
+        if patch_parallel is not None:
+            block_cache = tome = None
+
+        if block_cache is not None:
+            block_cache = block_cache.bind(timesteps, transformer_options)
+
+        ## run original forward pass, it casts the inputs to the model dtype
         out = self.forward_raw(
-            x = x.to(self.dtype),
-            t = timesteps.to(self.dtype),
-            y = context.to(self.dtype),
+            x = x,
+            t = timesteps,
+            y = context,
             data_info=data_info,
+            block_cache=block_cache,
+            tome=tome,
+            kv_compress=transformer_options.get("pixart_kv_compress", None),
+            layer_skip=transformer_options.get("layer_skip", None),
+            patch_parallel=patch_parallel,
+            ffn_chunk=transformer_options.get("ffn_chunk", None),
+            static_text=transformer_options.get("static_text", False),
         )
 
-        ## only return EPS
-        out = out.to(torch.float)
-        eps, rest = out[:, :self.in_channels], out[:, self.in_channels:]
-        return eps
+        ## only return EPS, dropping the sigma channels before the cast
+        return out[:, :self.in_channels].to(torch.float)
 
     def unpatchify(self, x):
         """
@@ -267,7 +343,4 @@ class PixArtMS(PixArt):
         p = self.x_embedder.patch_size[0]
         assert self.h * self.w == x.shape[1]
 
-        x = x.reshape(shape=(x.shape[0], self.h, self.w, p, p, c))
-        x = torch.einsum('nhwpqc->nchpwq', x)
-        imgs = x.reshape(shape=(x.shape[0], c, self.h * p, self.w * p))
-        return imgs
+        return unpatchify(x, self.h, self.w, p, c)
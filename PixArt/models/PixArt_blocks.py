@@ -15,27 +15,7 @@ import torch.nn.functional as F
 from timm.models.vision_transformer import Mlp, Attention as Attention_
 from einops import rearrange
 
-sdpa_32b = None
-Q_4GB_LIMIT = 32000000
-"""If q is greater than this, the operation will likely require >4GB VRAM, which will fail on Intel Arc Alchemist GPUs without a workaround."""
-# 2k   = 37 748 736
-# 1024 =  9 437 184
-# 2k model goes very slightly over 4GB
-
-from comfy import model_management
-if model_management.xformers_enabled():
-    import xformers
-    import xformers.ops
-else:
-    if model_management.xpu_available:
-        import intel_extension_for_pytorch as ipex
-        import os
-        if not torch.xpu.has_fp64_dtype() and not os.environ.get('IPEX_FORCE_ATTENTION_SLICE', None):
-            from ...utils.IPEX.attention import scaled_dot_product_attention_32_bit
-            sdpa_32b = scaled_dot_product_attention_32_bit
-            print("Using IPEX 4GB SDPA workaround")
-        else:
-            print("No IPEX 4GB workaround")
+from ...utils.attention import attention, unpack_kv
 
 def modulate(x, shift, scale):
     return x * (1 + scale.unsqueeze(1)) + shift.unsqueeze(1)
@@ -62,50 +42,16 @@ class MultiHeadCrossAttention(nn.Module):
         # query/value: img tokens; key: condition; mask: if padding tokens
         B, N, C = x.shape
 
-        q = self.q_linear(x).view(1, -1, self.num_heads, self.head_dim)
+        q = self.q_linear(x).view(B, N, self.num_heads, self.head_dim).transpose(1, 2)
         kv = self.kv_linear(cond).view(1, -1, 2, self.num_heads, self.head_dim)
         k, v = kv.unbind(2)
 
-        if model_management.xformers_enabled():
-            attn_bias = None
-            if mask is not None:
-                attn_bias = xformers.ops.fmha.BlockDiagonalMask.from_seqlens([N] * B, mask)
-            x = xformers.ops.memory_efficient_attention(
-                q, k, v,
-                p=self.attn_drop.p,
-                attn_bias=attn_bias
-            )
-        else:
-            q, k, v = map(lambda t: t.permute(0, 2, 1, 3),(q, k, v),)
-            attn_mask = None
-            if mask is not None and len(mask) > 1:
-
-                # Create equivalent of xformer diagonal block mask, still only correct for square masks
-                # But depth doesn't matter as tensors can expand in that dimension
-                attn_mask_template = torch.ones(
-                    [q.shape[2] // B, mask[0]],
-                    dtype=torch.bool,
-                    device=q.device
-                )
-                attn_mask = torch.block_diag(attn_mask_template)
-
-                # create a mask on the diagonal for each mask in the batch
-                for n in range(B - 1):
-                    attn_mask = torch.block_diag(attn_mask, attn_mask_template)
-
-            p = getattr(self.attn_drop, "p", 0) # IPEX.optimize() will turn attn_drop into an Identity()
-
-            if sdpa_32b is not None and (q.element_size() * q.nelement()) > Q_4GB_LIMIT:
-                sdpa = sdpa_32b
-            else:
-                sdpa = torch.nn.functional.scaled_dot_product_attention
-
-            x = sdpa(
-                q, k, v,
-                attn_mask=attn_mask,
-                dropout_p=p
-            ).permute(0, 2, 1, 3).contiguous()
-        x = x.view(B, -1, C)
+        # text tokens are packed across the batch, mask holds the per row lengths
+        k, v, attn_mask = unpack_kv(k, v, mask, B)
+
+        p = getattr(self.attn_drop, "p", 0) if self.training else 0.0 # IPEX.optimize() will turn attn_drop into an Identity()
+        x = attention(q, k, v, attn_mask=attn_mask, dropout_p=p)
+        x = x.transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
@@ -153,11 +99,10 @@ class AttentionKVCompress(Attention_):
         B, N, C = tensor.shape
 
         if sampling == 'uniform_every':
-            return tensor[:, ::scale_factor], int(N // scale_factor)
+            tensor = tensor[:, ::scale_factor]
+            return tensor, tensor.shape[1]
 
         tensor = tensor.reshape(B, H, W, C).permute(0, 3, 1, 2)
-        new_H, new_W = int(H / scale_factor), int(W / scale_factor)
-        new_N = new_H * new_W
 
         if sampling == 'ave':
             tensor = F.interpolate(
@@ -171,11 +116,25 @@ class AttentionKVCompress(Attention_):
         else:
             raise ValueError
 
+        # grids that don't divide evenly round down (ave/conv) or up (uniform)
+        new_N = tensor.numel() // (B * C)
         return tensor.reshape(B, new_N, C).contiguous(), new_N
 
-    def forward(self, x, mask=None, HW=None, block_id=None):
+    def kv_compress_mode(self, kv_compress=None):
+        """
+        Sampling and ratio to use for the KV tokens, kv_compress is an optional (sampling, ratio) runtime override.
+        The learned 'conv' sampler only exists for the ratio the checkpoint was trained with, use 'ave' otherwise.
+        """
+        if kv_compress is None:
+            return self.sampling, self.sr_ratio
+        sampling, sr_ratio = kv_compress
+        if sampling in [None, 'auto', 'conv']:
+            learned = hasattr(self, 'sr') and sr_ratio == self.sr_ratio
+            sampling = 'conv' if learned else 'ave'
+        return sampling, sr_ratio
+
+    def forward(self, x, mask=None, HW=None, block_id=None, kv_compress=None, kv_gather=None):
         B, N, C = x.shape # 2 4096 1152
-        new_N = N
         if HW is None:
             H = W = int(N ** 0.5)
         else:
@@ -187,42 +146,28 @@ class AttentionKVCompress(Attention_):
         q = self.q_norm(q)
         k = self.k_norm(k)
 
+        # patch parallel, attend to the K/V of every rank
+        if kv_gather is not None:
+            k, v = kv_gather(k, v)
+        new_N = k.shape[1]
+
         # KV compression
-        if self.sr_ratio > 1:
-            k, new_N = self.downsample_2d(k, H, W, self.sr_ratio, sampling=self.sampling)
-            v, new_N = self.downsample_2d(v, H, W, self.sr_ratio, sampling=self.sampling)
+        sampling, sr_ratio = self.kv_compress_mode(kv_compress)
+        if sr_ratio > 1:
+            k, new_N = self.downsample_2d(k, H, W, sr_ratio, sampling=sampling)
+            v, new_N = self.downsample_2d(v, H, W, sr_ratio, sampling=sampling)
 
-        q = q.reshape(B, N, self.num_heads, C // self.num_heads).to(dtype)
-        k = k.reshape(B, new_N, self.num_heads, C // self.num_heads).to(dtype)
-        v = v.reshape(B, new_N, self.num_heads, C // self.num_heads).to(dtype)
+        q = q.reshape(B, N, self.num_heads, C // self.num_heads).to(dtype).transpose(1, 2)
+        k = k.reshape(B, new_N, self.num_heads, C // self.num_heads).to(dtype).transpose(1, 2)
+        v = v.reshape(B, new_N, self.num_heads, C // self.num_heads).to(dtype).transpose(1, 2)
 
-        attn_bias = None
+        attn_mask = None
         if mask is not None:
-            attn_bias = torch.zeros([B * self.num_heads, q.shape[1], k.shape[1]], dtype=q.dtype, device=q.device)
-            attn_bias.masked_fill_(mask.squeeze(1).repeat(self.num_heads, 1, 1) == 0, float('-inf'))
-        # Switch between torch / xformers attention
-        if model_management.xformers_enabled():
-            x = xformers.ops.memory_efficient_attention(
-                q, k, v,
-                p=self.attn_drop.p,
-                attn_bias=attn_bias
-            )
-        else:
-            q, k, v = map(lambda t: t.transpose(1, 2),(q, k, v),)
-
-            p = getattr(self.attn_drop, "p", 0) # IPEX.optimize() will turn attn_drop into an Identity()
-            
-            if sdpa_32b is not None and (q.element_size() * q.nelement()) > Q_4GB_LIMIT:
-                sdpa = sdpa_32b
-            else:
-                sdpa = torch.nn.functional.scaled_dot_product_attention
-
-            x = sdpa(
-                q, k, v,
-                dropout_p=p,
-                attn_mask=attn_bias
-            ).transpose(1, 2).contiguous()
-        x = x.view(B, N, C)
+            attn_mask = (mask.squeeze(1) != 0).unsqueeze(1) # (B, 1, N, new_N), True attends
+
+        p = getattr(self.attn_drop, "p", 0) if self.training else 0.0 # IPEX.optimize() will turn attn_drop into an Identity()
+        x = attention(q, k, v, attn_mask=attn_mask, dropout_p=p)
+        x = x.transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
@@ -236,16 +181,14 @@ class Attention(Attention_):
         B, N, C = x.shape
         qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         q, k, v = qkv.unbind(0)  # make torchscript happy (cannot use tensor as tuple)
+        dtype = q.dtype
         use_fp32_attention = getattr(self, 'fp32_attention', False)
         if use_fp32_attention:
-            q, k = q.float(), k.float()
+            q, k, v = q.float(), k.float(), v.float()
         with torch.cuda.amp.autocast(enabled=not use_fp32_attention):
-            attn = (q @ k.transpose(-2, -1)) * self.scale
-            attn = attn.softmax(dim=-1)
-
-        attn = self.attn_drop(attn)
+            x = attention(q, k, v, dropout_p=self.attn_drop.p if self.training else 0.0)
 
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
+        x = x.to(dtype).transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
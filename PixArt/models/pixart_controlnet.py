@@ -10,6 +10,7 @@ from typing import Any, Mapping
 from .PixArt import PixArt, get_2d_sincos_pos_embed
 from .PixArtMS import PixArtMSBlock, PixArtMS
 from .utils import auto_grad_checkpoint
+from ...utils.patchify import unpatchify
 
 # The implementation of ControlNet-Half architrecture
 # https://github.com/lllyasviel/ControlNet/discussions/188
@@ -152,10 +153,8 @@ class ControlPixArtHalf(Module):
             c = cn_hint,
         )
 
-        ## only return EPS
-        out = out.to(torch.float)
-        eps, rest = out[:, :self.in_channels], out[:, self.in_channels:]
-        return eps
+        ## only return EPS, dropping the sigma channels before the cast
+        return out[:, :self.in_channels].to(torch.float)
 
     def forward_with_dpmsolver(self, x, t, y, data_info, c, **kwargs):
         model_out = self.forward_raw(x, t, y, data_info=data_info, c=c, **kwargs)
@@ -190,10 +189,7 @@ class ControlPixArtHalf(Module):
         p = self.x_embedder.patch_size[0]
         assert self.h * self.w == x.shape[1]
 
-        x = x.reshape(shape=(x.shape[0], self.h, self.w, p, p, c))
-        x = torch.einsum('nhwpqc->nchpwq', x)
-        imgs = x.reshape(shape=(x.shape[0], c, self.h * p, self.w * p))
-        return imgs
+        return unpatchify(x, self.h, self.w, p, c)
 
     # @property
     # def dtype(self):
@@ -306,7 +302,5 @@ class ControlPixArtMSHalf(ControlPixArtHalf):
             data_info=data_info,
         )
 
-        ## only return EPS
-        out = out.to(torch.float)
-        eps, rest = out[:, :self.in_channels], out[:, self.in_channels:]
-        return eps
+        ## only return EPS, dropping the sigma channels before the cast
+        return out[:, :self.in_channels].to(torch.float)
@@ -266,6 +266,39 @@ class PixArtT5FromSD3CLIP:
 
 		return (clip, )
 
+class PixArtKVCompress:
+	@classmethod
+	def INPUT_TYPES(s):
+		return {
+			"required": {
+				"model": ("MODEL",),
+				"sampling": (["auto", "ave", "uniform", "uniform_every"],{"default":"auto"}),
+				"scale_factor": ("INT", {"default": 2, "min": 1, "max": 8}),
+				"start_block": ("INT", {"default": 14, "min": 0, "max": 100}),
+				"end_block": ("INT", {"default": -1, "min": -1, "max": 100}),
+			}
+		}
+
+	RETURN_TYPES = ("MODEL",)
+	FUNCTION = "patch"
+	CATEGORY = "ExtraModels/PixArt"
+	TITLE = "PixArt KV Compression"
+
+	def patch(self, model, sampling, scale_factor, start_block, end_block):
+		"""
+		Subsample the self-attention keys/values of the blocks in [start_block, end_block) by scale_factor.
+		auto uses the learned conv sampler of the checkpoint where it exists for that ratio, ave otherwise.
+		end_block -1 means up to the last block, scale_factor 1 disables compression for that range.
+		"""
+		m = model.clone()
+		m.model_options["transformer_options"]["pixart_kv_compress"] = {
+			"sampling": sampling,
+			"scale_factor": scale_factor,
+			"start_block": start_block,
+			"end_block": end_block,
+		}
+		return (m,)
+
 NODE_CLASS_MAPPINGS = {
 	"PixArtCheckpointLoader" : PixArtCheckpointLoader,
 	"PixArtCheckpointLoaderSimple" : PixArtCheckpointLoaderSimple,
@@ -275,4 +308,5 @@ NODE_CLASS_MAPPINGS = {
 	"PixArtResolutionCond" : PixArtResolutionCond,
 	"PixArtControlNetCond" : PixArtControlNetCond,
 	"PixArtT5FromSD3CLIP": PixArtT5FromSD3CLIP,
+	"PixArtKVCompress": PixArtKVCompress,
 }
@@ -9,10 +9,12 @@ import math
 from comfy import model_management
 from comfy.latent_formats import LatentFormat
 from .diffusers_convert import convert_state_dict
+from ..utils.sampling import CONDHost
 
 
 class SanaLatent(LatentFormat):
     latent_channels = 32
+    spacial_downscale_ratio = 32
     def __init__(self):
         self.scale_factor = 0.41407
 
@@ -41,6 +43,12 @@ class EXM_Sana_Model(comfy.model_base.BaseModel):
 	def extra_conds(self, **kwargs):
 		out = super().extra_conds(**kwargs)
 
+		# number of text tokens per row, computed once instead of on every step
+		cross_attn = kwargs.get("cross_attn", None)
+		if cross_attn is not None:
+			y_lens = ((cross_attn != 0).sum(dim=-1) > 0).sum(dim=-1).flatten()
+			out["y_lens"] = CONDHost(y_lens.to(device="cpu", dtype=torch.long))
+
 		cn_hint = kwargs.get("cn_hint", None)
 		if cn_hint is not None:
 			out["cn_hint"] = comfy.conds.CONDRegular(cn_hint)
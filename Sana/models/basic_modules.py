@@ -17,6 +17,7 @@
 # This file is modified from https://github.com/PixArt-alpha/PixArt-sigma
 import torch
 import torch.nn as nn
+import torch.nn.functional as F
 from timm.models.vision_transformer import Mlp
 
 from .act import build_act, get_act_name
@@ -129,26 +130,72 @@ class GLUMBConv(nn.Module):
         )
         # from IPython import embed; embed(header='debug dilate conv')
 
-    def forward(self, x: torch.Tensor, HW=None) -> torch.Tensor:
+    def forward(self, x: torch.Tensor, HW=None, chunk=None) -> torch.Tensor:
         B, N, C = x.shape
         if HW is None:
             H = W = int(N**0.5)
         else:
             H, W = HW
 
-        x = x.reshape(B, H, W, C).permute(0, 3, 1, 2)
-        x = self.inverted_conv(x)
-        x = self.depth_conv(x)
+        if chunk is not None and chunk < N and self.depth_conv.stride == 1:
+            return self.forward_rows(x, H, W, max(1, chunk // W))
 
-        x, gate = torch.chunk(x, 2, dim=1)
+        # channels last, only the depthwise conv sees an NCHW view of the (B, H, W, C) tokens
+        x = self.pointwise(self.inverted_conv, x.reshape(B, H, W, C))
+        x = self.depth_conv(x.permute(0, 3, 1, 2)).permute(0, 2, 3, 1)
+
+        x, gate = torch.chunk(x, 2, dim=-1)
         gate = self.glu_act(gate)
         x = x * gate
 
-        x = self.point_conv(x)
-        x = x.reshape(B, C, N).permute(0, 2, 1)
+        x = self.pointwise(self.point_conv, x)
+        x = x.reshape(B, N, -1)
 
         return x
 
+    @staticmethod
+    def pointwise(layer, x):
+        """
+        1x1 ConvLayer on (B, H, W, C), as a Linear over the channels unless it has a norm.
+        """
+        if layer.norm or layer.dropout is not None:
+            return layer(x.permute(0, 3, 1, 2)).permute(0, 2, 3, 1)
+        x = F.linear(x, layer.conv.weight.flatten(1), layer.conv.bias)
+        return layer.act(x) if layer.act else x
+
+    def forward_rows(self, x, H, W, rows):
+        """
+        Same as forward, computed over bands of `rows` image rows so the hidden
+        activations only exist for one band at a time. Every band is extended by the
+        halo rows the depthwise conv reads, zero rows at the image border stand in for
+        its padding, so the result matches the full pass.
+        """
+        B, N, C = x.shape
+        conv = self.depth_conv.conv
+        halo = conv.padding[0]
+        x = x.reshape(B, H, W, C)
+        out = None
+        for r0 in range(0, H, rows):
+            r1 = min(H, r0 + rows)
+            a, b = max(0, r0 - halo), min(H, r1 + halo)
+            h = self.pointwise(self.inverted_conv, x[:, a:b])
+            h = F.pad(h, (0, 0, 0, 0, halo - (r0 - a), halo - (b - r1)))
+            h = h.permute(0, 3, 1, 2)
+            h = F.conv2d(h, conv.weight, conv.bias, conv.stride, (0, conv.padding[1]), conv.dilation, conv.groups)
+            if self.depth_conv.norm:
+                h = self.depth_conv.norm(h)
+            if self.depth_conv.act:
+                h = self.depth_conv.act(h)
+            h = h.permute(0, 2, 3, 1)
+
+            h, gate = torch.chunk(h, 2, dim=-1)
+            h = h * self.glu_act(gate)
+            h = self.pointwise(self.point_conv, h)
+            if out is None:
+                out = h.new_empty((B, N, h.shape[-1]))
+            out[:, r0 * W:r1 * W] = h.reshape(B, -1, h.shape[-1])
+        return out
+
 
 class SlimGLUMBConv(GLUMBConv):
     def __init__(self, *args, **kwargs):
@@ -36,6 +36,7 @@ from .sana_blocks import (
 )
 from .norms import RMSNorm
 from .utils import auto_grad_checkpoint, to_2tuple
+from ...utils.patchify import unpatchify
 
 
 class SanaBlock(nn.Module):
@@ -287,10 +288,7 @@ class Sana(nn.Module):
         h = w = int(x.shape[1] ** 0.5)
         assert h * w == x.shape[1]
 
-        x = x.reshape(shape=(x.shape[0], h, w, p, p, c))
-        x = torch.einsum("nhwpqc->nchpwq", x)
-        imgs = x.reshape(shape=(x.shape[0], c, h * p, h * p))
-        return imgs
+        return unpatchify(x, h, w, p, c)
 
     def initialize_weights(self):
         # Initialize transformer layers:
@@ -28,28 +28,8 @@ from transformers import AutoModelForCausalLM
 
 from .norms import RMSNorm
 from .utils import get_same_padding, to_2tuple
-
-sdpa_32b = None
-Q_4GB_LIMIT = 32000000
-"""If q is greater than this, the operation will likely require >4GB VRAM, which will fail on Intel Arc Alchemist GPUs without a workaround."""
-# 2k   = 37 748 736
-# 1024 =  9 437 184
-# 2k model goes very slightly over 4GB
-
-from comfy import model_management
-if model_management.xformers_enabled():
-    import xformers
-    import xformers.ops
-else:
-    if model_management.xpu_available:
-        import intel_extension_for_pytorch as ipex
-        import os
-        if not torch.xpu.has_fp64_dtype() and not os.environ.get('IPEX_FORCE_ATTENTION_SLICE', None):
-            from ...utils.IPEX.attention import scaled_dot_product_attention_32_bit
-            sdpa_32b = scaled_dot_product_attention_32_bit
-            print("Using IPEX 4GB SDPA workaround")
-        else:
-            print("No IPEX 4GB workaround")
+from ...utils.attention import attention, unpack_kv
+from ...utils.patchify import patchify
 
 
 def modulate(x, shift, scale):
@@ -86,50 +66,16 @@ class MultiHeadCrossAttention(nn.Module):
         # query/value: img tokens; key: condition; mask: if padding tokens
         B, N, C = x.shape
 
-        q = self.q_linear(x).view(1, -1, self.num_heads, self.head_dim)
+        q = self.q_linear(x).view(B, N, self.num_heads, self.head_dim).transpose(1, 2)
         kv = self.kv_linear(cond).view(1, -1, 2, self.num_heads, self.head_dim)
         k, v = kv.unbind(2)
 
-        if model_management.xformers_enabled():
-            attn_bias = None
-            if mask is not None:
-                attn_bias = xformers.ops.fmha.BlockDiagonalMask.from_seqlens([N] * B, mask)
-            x = xformers.ops.memory_efficient_attention(
-                q, k, v,
-                p=self.attn_drop.p,
-                attn_bias=attn_bias
-            )
-        else:
-            q, k, v = map(lambda t: t.permute(0, 2, 1, 3),(q, k, v),)
-            attn_mask = None
-            if mask is not None and len(mask) > 1:
-
-                # Create equivalent of xformer diagonal block mask, still only correct for square masks
-                # But depth doesn't matter as tensors can expand in that dimension
-                attn_mask_template = torch.ones(
-                    [q.shape[2] // B, mask[0]],
-                    dtype=torch.bool,
-                    device=q.device
-                )
-                attn_mask = torch.block_diag(attn_mask_template)
-
-                # create a mask on the diagonal for each mask in the batch
-                for n in range(B - 1):
-                    attn_mask = torch.block_diag(attn_mask, attn_mask_template)
-
-            p = getattr(self.attn_drop, "p", 0) # IPEX.optimize() will turn attn_drop into an Identity()
-
-            if sdpa_32b is not None and (q.element_size() * q.nelement()) > Q_4GB_LIMIT:
-                sdpa = sdpa_32b
-            else:
-                sdpa = torch.nn.functional.scaled_dot_product_attention
-
-            x = sdpa(
-                q, k, v,
-                attn_mask=attn_mask,
-                dropout_p=p
-            ).permute(0, 2, 1, 3).contiguous()
-        x = x.view(B, -1, C)
+        # text tokens are packed across the batch, mask holds the per row lengths
+        k, v, attn_mask = unpack_kv(k, v, mask, B)
+
+        p = getattr(self.attn_drop, "p", 0) if self.training else 0.0 # IPEX.optimize() will turn attn_drop into an Identity()
+        x = attention(q, k, v, attn_mask=attn_mask, dropout_p=p)
+        x = x.transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
@@ -139,6 +85,7 @@ class LiteLA(Attention_):
     r"""Lightweight linear attention"""
 
     PAD_VAL = 1
+    CHUNK = 4096 # tokens upcast to fp32 at a time
 
     def __init__(
         self,
@@ -169,20 +116,32 @@ class LiteLA(Attention_):
             self.q_norm = nn.Identity()
             self.k_norm = nn.Identity()
 
-    def attn_matmul(self, q, k, v: torch.Tensor) -> torch.Tensor:
-        # lightweight linear attention
+    def attn_matmul(self, q, k, v: torch.Tensor, chunk=None) -> torch.Tensor:
+        """
+        Lightweight linear attention, (v @ k) @ q normalized by sum(k) @ q.
+        Only the (h_d + 1, h_d) KV state is kept in fp32, the token sized tensors stay
+        in the compute dtype and are upcast `chunk` tokens at a time.
+        q/v: (B, h, h_d, N), k: (B, h, N, h_d), returns (B, h, h_d, N)
+        """
         q = self.kernel_func(q)  # B, h, h_d, N
         k = self.kernel_func(k)
-
-        q, k, v = q.float(), k.float(), v.float()
-
-        v = F.pad(v, (0, 0, 0, 1), mode="constant", value=LiteLA.PAD_VAL)
-        vk = torch.matmul(v, k)
-        out = torch.matmul(vk, q)
-
-        if out.dtype in [torch.float16, torch.bfloat16]:
-            out = out.float()
-        out = out[:, :, :-1] / (out[:, :, -1:] + self.eps)
+        B, h, h_d, N = q.shape
+        chunk = chunk or LiteLA.CHUNK
+
+        # same as padding v with a row of PAD_VAL, the last row of the state is the normalizer.
+        # Accumulated in place, (B * h) batched views of the state rows
+        vk = torch.zeros((B, h, h_d + 1, h_d), dtype=torch.float32, device=q.device)
+        vk_v, vk_norm = vk.view(B * h, h_d + 1, h_d)[:, :-1], vk[:, :, -1]
+        for start in range(0, N, chunk):
+            k_c = k[:, :, start:start + chunk].float()
+            v_c = v[..., start:start + chunk].float()
+            vk_v.baddbmm_(v_c.reshape(B * h, h_d, -1), k_c.reshape(B * h, -1, h_d))
+            vk_norm.add_(k_c.sum(dim=2), alpha=LiteLA.PAD_VAL)
+
+        out = q.new_empty(q.shape)
+        for start in range(0, N, chunk):
+            out_c = torch.matmul(vk, q[..., start:start + chunk].float())
+            out[..., start:start + chunk] = out_c[:, :, :-1] / (out_c[:, :, -1:] + self.eps)
 
         return out
 
@@ -252,7 +211,7 @@ class PAGCFGIdentitySelfAttnProcessorLiteLA:
 
         # perturbed path (identity attention)
         v_weight = self.attn.qkv.weight[C * 2 : C * 3, :]  # Shape: (dim, dim)
-        if self.attn.qkv.bias:
+        if self.attn.qkv.bias is not None:
             v_bias = self.attn.qkv.bias[C * 2 : C * 3]  # Shape: (dim,)
             x_ptb = (torch.matmul(x_ptb, v_weight.t()) + v_bias).to(dtype)
         else:
@@ -296,7 +255,7 @@ class PAGIdentitySelfAttnProcessorLiteLA:
 
         # perturbed path (identity attention)
         v_weight = self.attn.qkv.weight[C * 2 : C * 3, :]  # Shape: (dim, dim)
-        if self.attn.qkv.bias:
+        if self.attn.qkv.bias is not None:
             v_bias = self.attn.qkv.bias[C * 2 : C * 3]  # Shape: (dim,)
             x_ptb = (torch.matmul(x_ptb, v_weight.t()) + v_bias).to(dtype)
         else:
@@ -382,30 +341,23 @@ class FlashAttention(Attention_):
         q = self.q_norm(q)
         k = self.k_norm(k)
 
-        q = q.reshape(B, N, self.num_heads, C // self.num_heads).to(dtype)
-        k = k.reshape(B, N, self.num_heads, C // self.num_heads).to(dtype)
-        v = v.reshape(B, N, self.num_heads, C // self.num_heads).to(dtype)
+        q = q.reshape(B, N, self.num_heads, C // self.num_heads).to(dtype).transpose(1, 2)
+        k = k.reshape(B, N, self.num_heads, C // self.num_heads).to(dtype).transpose(1, 2)
+        v = v.reshape(B, N, self.num_heads, C // self.num_heads).to(dtype).transpose(1, 2)
 
         use_fp32_attention = getattr(self, "fp32_attention", False)  # necessary for NAN loss
         if use_fp32_attention:
             q, k, v = q.float(), k.float(), v.float()
 
-        attn_bias = None
-        if mask is not None:
-            attn_bias = torch.zeros([B * self.num_heads, q.shape[1], k.shape[1]], dtype=q.dtype, device=q.device)
-            attn_bias.masked_fill_(mask.squeeze(1).repeat(self.num_heads, 1, 1) == 0, float("-inf"))
+        attn_mask = None
+        if mask is not None and mask.ndim == 2:
+            # (B, 1, 1, N) key padding as an additive bias, rows without valid keys stay finite
+            attn_mask = (1 - mask[:, None, None].to(q.dtype)) * -10000.0
+        elif mask is not None:
+            attn_mask = (mask.squeeze(1) != 0).unsqueeze(1)
 
-        if _xformers_available:
-            x = xformers.ops.memory_efficient_attention(q, k, v, p=self.attn_drop.p, attn_bias=attn_bias)
-        else:
-            q, k, v = q.transpose(1, 2), k.transpose(1, 2), v.transpose(1, 2)
-            if mask is not None and mask.ndim == 2:
-                mask = (1 - mask.to(x.dtype)) * -10000.0
-                mask = mask[:, None, None].repeat(1, self.num_heads, 1, 1)
-            x = F.scaled_dot_product_attention(q, k, v, attn_mask=mask, dropout_p=0.0, is_causal=False)
-            x = x.transpose(1, 2)
-
-        x = x.view(B, N, C)
+        x = attention(q, k, v, attn_mask=attn_mask)
+        x = x.to(dtype).transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
 
@@ -424,17 +376,15 @@ class Attention(Attention_):
         qkv = self.qkv(x).reshape(B, N, 3, self.num_heads, C // self.num_heads).permute(2, 0, 3, 1, 4)
         # B,N,3,H,C -> B,H,N,C
         q, k, v = qkv.unbind(0)  # make torchscript happy (cannot use tensor as tuple)
+        dtype = q.dtype
         use_fp32_attention = getattr(self, "fp32_attention", False)
         if use_fp32_attention:
-            q, k = q.float(), k.float()
+            q, k, v = q.float(), k.float(), v.float()
 
         with torch.cuda.amp.autocast(enabled=not use_fp32_attention):
-            attn = (q @ k.transpose(-2, -1)) * self.scale
-            attn = attn.softmax(dim=-1)
+            x = attention(q, k, v, dropout_p=self.attn_drop.p if self.training else 0.0)
 
-        attn = self.attn_drop(attn)
-
-        x = (attn @ v).transpose(1, 2).reshape(B, N, C)
+        x = x.to(dtype).transpose(1, 2).reshape(B, N, C)
         x = self.proj(x)
         x = self.proj_drop(x)
         return x
@@ -755,6 +705,10 @@ class PatchEmbed(nn.Module):
         B, C, H, W = x.shape
         assert (H == self.img_size[0], f"Input image height ({H}) doesn't match model ({self.img_size[0]}).")
         assert (W == self.img_size[1], f"Input image width ({W}) doesn't match model ({self.img_size[1]}).")
+        if self.flatten:
+            tokens = patchify(x, self.proj)
+            if tokens is not None:
+                return self.norm(tokens)
         x = self.proj(x)
         if self.flatten:
             x = x.flatten(2).transpose(1, 2)  # BCHW -> BNC
@@ -789,6 +743,10 @@ class PatchEmbedMS(nn.Module):
         self.norm = norm_layer(embed_dim) if norm_layer else nn.Identity()
 
     def forward(self, x):
+        if self.flatten:
+            tokens = patchify(x, self.proj)
+            if tokens is not None:
+                return self.norm(tokens)
         x = self.proj(x)
         if self.flatten:
             x = x.flatten(2).transpose(1, 2)  # BCHW -> BNC
@@ -27,11 +27,15 @@ from .sana_blocks import (
     FlashAttention,
     LiteLA,
     MultiHeadCrossAttention,
+    PAGCFGIdentitySelfAttnProcessorLiteLA,
+    PAGIdentitySelfAttnProcessorLiteLA,
     PatchEmbedMS,
     T2IFinalLayer,
-    t2i_modulate,
 )
 from .utils import auto_grad_checkpoint
+from ...utils.fused import norm_modulate, gated_residual
+from ...utils.patchify import unpatchify
+from ...utils.ffnchunk import chunked_ffn
 
 
 class SanaMSBlock(nn.Module):
@@ -120,15 +124,23 @@ class SanaMSBlock(nn.Module):
         self.drop_path = DropPath(drop_path) if drop_path > 0.0 else nn.Identity()
         self.scale_shift_table = nn.Parameter(torch.randn(6, hidden_size) / hidden_size**0.5)
 
-    def forward(self, x, y, t, mask=None, HW=None, **kwargs):
+    def forward(self, x, y, t, mask=None, HW=None, attn_processor=None, ffn_chunk=None, **kwargs):
         B, N, C = x.shape
 
+        attn = self.attn if attn_processor is None else attn_processor(self.attn)
         shift_msa, scale_msa, gate_msa, shift_mlp, scale_mlp, gate_mlp = (
             self.scale_shift_table[None] + t.reshape(B, 6, -1)
         ).chunk(6, dim=1)
-        x = x + self.drop_path(gate_msa * self.attn(t2i_modulate(self.norm1(x), shift_msa, scale_msa), HW=HW))
+        x = gated_residual(x, gate_msa, self.drop_path(attn(norm_modulate(x, self.norm1, shift_msa, scale_msa), HW=HW)))
         x = x + self.cross_attn(x, y, mask)
-        x = x + self.drop_path(gate_mlp * self.mlp(t2i_modulate(self.norm2(x), shift_mlp, scale_mlp), HW=HW))
+        h = norm_modulate(x, self.norm2, shift_mlp, scale_mlp)
+        if ffn_chunk and type(self.mlp) is GLUMBConv:
+            h = self.mlp(h, HW=HW, chunk=ffn_chunk) # row bands with halo
+        elif ffn_chunk and type(self.mlp) is Mlp:
+            h = chunked_ffn(self.mlp, h, ffn_chunk)
+        else:
+            h = self.mlp(h, HW=HW)
+        x = gated_residual(x, gate_mlp, self.drop_path(h), inplace=True)
 
         return x
 
@@ -250,24 +262,56 @@ class SanaMS(Sana):
         if len(context.shape) == 3:
             context = context.unsqueeze(1)
 
-        ## run original forward pass
+        ## optional residual caching for the blocks after the first one
+        transformer_options = kwargs.get("transformer_options", {})
+        block_cache = transformer_options.get("block_cache", None)
+        if block_cache is not None:
+            block_cache = block_cache.bind(timesteps, transformer_options)
+
+        ## perturbed attention guidance, batched with the cond row(s)
+        pag = transformer_options.get("sana_pag", None)
+        cond_or_uncond = transformer_options.get("cond_or_uncond", [])
+        pag_args = None
+        if pag is not None and cond_or_uncond.count(0) == 1 and len(cond_or_uncond) <= 2:
+            chunk = bs // len(cond_or_uncond)
+            start = cond_or_uncond.index(0) * chunk
+            pag_args = (pag["blocks"], slice(start, start + chunk))
+
+        ## run original forward pass, it casts the inputs to the model dtype
         out = self.forward_raw(
-            x = x.to(self.dtype),
-            timestep = timesteps.to(self.dtype),
-            y = context.to(self.dtype),
+            x = x,
+            timestep = timesteps,
+            y = context,
+            block_cache = block_cache,
+            pag = pag_args,
+            layer_skip = transformer_options.get("layer_skip", None),
+            y_lens = kwargs.get("y_lens", None),
+            ffn_chunk = transformer_options.get("ffn_chunk", None),
+            static_text = transformer_options.get("static_text", False),
         )
 
         ## only return EPS
-        out = out.to(torch.float)
-        
-        return out
-
-    def forward_raw(self, x, timestep, y, mask=None, data_info=None, **kwargs):
+        if pag_args is not None:
+            out, ptb = out[:bs].to(torch.float), out[bs:]
+            # shifting every branch by the same amount adds scale * (cond - perturbed) after CFG, for any CFG scale
+            delta = (out[pag_args[1]] - ptb).mul_(pag["scale"])
+            return (out.view(len(cond_or_uncond), -1, *out.shape[1:]) + delta).view(out.shape)
+        return out.to(torch.float)
+
+    def forward_raw(self, x, timestep, y, mask=None, data_info=None, block_cache=None, pag=None, layer_skip=None, y_lens=None, ffn_chunk=None, static_text=False, **kwargs):
         """
         Forward pass of Sana.
         x: (N, C, H, W) tensor of spatial inputs (images or latent representations of images)
         t: (N,) tensor of diffusion timesteps
         y: (N, 1, 120, C) tensor of class labels
+        block_cache: optional fn(x, first, rest) that may skip the blocks after the first one
+        pag: optional (blocks, rows), appends a copy of the batch rows `rows` that uses identity
+             self-attention in `blocks` (perturbed attention guidance). Returns N + len(rows) outputs.
+        layer_skip: optional fn(layer, depth), blocks it returns True for are skipped
+        y_lens: optional (N,) text token counts on the host, computed from y (one device sync) if missing
+        ffn_chunk: optional number of tokens per FFN pass (image row bands for GLUMBConv)
+        static_text: keep every text token and mask them on the device instead of cutting them,
+                     same shapes for every prompt and no host sync (compiled blocks)
         """
         bs = x.shape[0]
         x = x.to(self.dtype)
@@ -296,24 +340,59 @@ class SanaMS(Sana):
 
         t = self.t_embedder(timestep)  # (N, D)
 
-        y_lens = ((y != 0).sum(dim=3) > 0).sum(dim=2).squeeze()
-        y_lens = [y_lens.item() if torch.is_tensor(y_lens) and y_lens.numel() == 1 else y_lens[1]] * bs
-
-        mask = torch.zeros((len(y_lens), self.model_max_length), dtype=torch.int).to(x.device)
-        for i, count in enumerate(y_lens):
-            mask[i, :count] = 1
+        if y_lens is None:
+            y_lens = ((y != 0).sum(dim=3) > 0).sum(dim=2).flatten()
+        # every row keeps the same number of leading text tokens, the second row's when batched
+        if static_text:
+            y_lens = torch.as_tensor(y_lens, device=x.device)
+            y_len = y.shape[2]
+            y_lens = y_lens[1 if len(y_lens) > 1 else 0].expand(bs)
+        else:
+            y_lens = y_lens.tolist() if torch.is_tensor(y_lens) else list(y_lens)
+            y_len = int(y_lens[1] if len(y_lens) > 1 else y_lens[0])
+            y_lens = [y_len] * bs
 
         t0 = self.t_block(t)
         y = self.y_embedder(y, self.training)  # (N, D)
         if self.y_norm:
             y = self.attention_y_norm(y)
 
-        y = y.squeeze(1).masked_select(mask.unsqueeze(-1).bool()).view(1, -1, y.shape[-1])
-
-        for block in self.blocks:
-            x = auto_grad_checkpoint(
-                block, x, y, t0, y_lens, (self.h, self.w), **kwargs
-            )  # (N, T, D) #support grad checkpoint
+        y = y.squeeze(1)[:, :y_len].reshape(1, -1, y.shape[-1])
+
+        def run_blocks(x, start, end, attn_blocks=(), attn_processor=None):
+            for layer in range(start, end):
+                if layer_skip is not None and layer_skip(layer, len(self.blocks)):
+                    continue
+                block_kwargs = {"attn_processor": attn_processor} if layer in attn_blocks else {}
+                block_kwargs["ffn_chunk"] = ffn_chunk
+                x = auto_grad_checkpoint(
+                    self.blocks[layer], x, y, t0, y_lens, (self.h, self.w), **block_kwargs, **kwargs
+                )  # (N, T, D) #support grad checkpoint
+            return x
+
+        if pag is not None:
+            pag_blocks, pag_rows = pag
+            # the perturbed rows only diverge from their source rows at the first perturbed block
+            first = min(pag_blocks)
+            x = run_blocks(x, 0, first)
+            x = torch.cat([x, x[pag_rows]])
+            t, t0 = torch.cat([t, t[pag_rows]]), torch.cat([t0, t0[pag_rows]])
+            y = torch.cat([y, y.view(bs, -1, y.shape[-1])[pag_rows].reshape(1, -1, y.shape[-1])], dim=1)
+            y_lens = torch.cat([y_lens, y_lens[pag_rows]]) if static_text else y_lens + y_lens[pag_rows]
+            # [uncond, cond, perturbed] or [cond, perturbed]
+            if x.shape[0] == 3 * (x.shape[0] - bs):
+                processor = PAGCFGIdentitySelfAttnProcessorLiteLA
+            else:
+                processor = PAGIdentitySelfAttnProcessorLiteLA
+            x = run_blocks(x, first, len(self.blocks), pag_blocks, processor)
+        elif block_cache is not None:
+            x = block_cache(
+                x,
+                lambda x: run_blocks(x, 0, 1),
+                lambda x: run_blocks(x, 1, len(self.blocks)),
+            )
+        else:
+            x = run_blocks(x, 0, len(self.blocks))
 
         x = self.final_layer(x, t)  # (N, T, patch_size ** 2 * out_channels)
         x = self.unpatchify(x)  # (N, out_channels, H, W)
@@ -344,10 +423,7 @@ class SanaMS(Sana):
         p = self.x_embedder.patch_size[0]
         assert self.h * self.w == x.shape[1]
 
-        x = x.reshape(shape=(x.shape[0], self.h, self.w, p, p, c))
-        x = torch.einsum("nhwpqc->nchpwq", x)
-        imgs = x.reshape(shape=(x.shape[0], c, self.h * p, self.w * p))
-        return imgs
+        return unpatchify(x, self.h, self.w, p, c)
 
     def initialize(self):
         # Initialize transformer layers:
@@ -222,10 +222,46 @@ preset_te_prompt = [
 	'User Prompt: '
 ]
 
+class SanaPAG:
+	@classmethod
+	def INPUT_TYPES(s):
+		return {
+			"required": {
+				"model": ("MODEL",),
+				"scale": ("FLOAT", {"default": 2.0, "min": 0.0, "max": 100.0, "step": 0.1}),
+				"blocks": ("STRING", {"default": "8"}),
+			}
+		}
+
+	RETURN_TYPES = ("MODEL",)
+	FUNCTION = "patch"
+	CATEGORY = "ExtraModels/Sana"
+	TITLE = "Sana PAG (batched)"
+
+	def patch(self, model, scale, blocks):
+		"""
+		Perturbed attention guidance with identity self-attention on the comma separated blocks.
+		The perturbed branch runs in the same forward pass as cond/uncond.
+		"""
+		blocks = [int(x) for x in blocks.replace(" ", "").split(",") if x]
+		if not blocks:
+			raise ValueError("Sana PAG: no blocks selected")
+		depth = len(model.get_model_object("diffusion_model").blocks)
+		invalid = [x for x in blocks if not 0 <= x < depth]
+		if invalid:
+			raise ValueError(f"Sana PAG: invalid block(s) {invalid}, valid range is 0-{depth-1}")
+		m = model.clone()
+		m.model_options["transformer_options"]["sana_pag"] = {
+			"scale": scale,
+			"blocks": blocks,
+		}
+		return (m,)
+
 NODE_CLASS_MAPPINGS = {
 	"SanaCheckpointLoader" : SanaCheckpointLoader,
 	"SanaResolutionSelect" : SanaResolutionSelect,
 	"SanaTextEncode" : SanaTextEncode,
 	"SanaResolutionCond" : SanaResolutionCond,
 	"EmptySanaLatentImage": EmptySanaLatentImage,
+	"SanaPAG": SanaPAG,
 }
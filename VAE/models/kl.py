@@ -2,6 +2,8 @@ import torch
 import numpy as np
 from torch import nn
 
+from ...utils.attention import attention
+
 
 def Normalize(in_channels, num_groups=32):
 	return torch.nn.GroupNorm(num_groups=num_groups, num_channels=in_channels, eps=1e-6, affine=True)
@@ -429,19 +431,9 @@ class AttnBlock(nn.Module):
 
 		# compute attention
 		b,c,h,w = q.shape
-		q = q.reshape(b,c,h*w)
-		q = q.permute(0,2,1)   # b,hw,c
-		k = k.reshape(b,c,h*w) # b,c,hw
-		w_ = torch.bmm(q,k)	 # b,hw,hw	w[b,i,j]=sum_c q[b,i,c]k[b,c,j]
-		# w_ = w_ * (int(c)**(-0.5))
-		w_ = w_ * (c**(-0.5))
-		w_ = torch.nn.functional.softmax(w_, dim=2)
-
-		# attend to values
-		v = v.reshape(b,c,h*w)
-		w_ = w_.permute(0,2,1)   # b,hw,hw (first hw of k, second of q)
-		h_ = torch.bmm(v,w_)	 # b, c,hw (hw of q) h_[b,c,j] = sum_i v[b,c,i] w_[b,i,j]
-		h_ = h_.reshape(b,c,h,w)
+		q, k, v = (t.reshape(b,1,c,h*w).transpose(-1,-2) for t in (q, k, v)) # b,1,hw,c (single head)
+		h_ = attention(q, k, v)
+		h_ = h_.transpose(-1,-2).reshape(b,c,h,w)
 
 		h_ = self.proj_out(h_)
 
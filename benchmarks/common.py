@@ -0,0 +1,41 @@
+#
+# Shared setup for the benchmark scripts. Like the tests they need ComfyUI on the path, e.g.
+#  PYTHONPATH=/path/to/ComfyUI python benchmarks/tome.py
+#
+import os
+import sys
+import time
+import types
+import torch
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if "extramodels" not in sys.modules:
+    package = types.ModuleType("extramodels")
+    package.__path__ = [root]
+    sys.modules["extramodels"] = package
+
+def default_device():
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+def default_dtype(device):
+    return torch.float16 if device.type == "cuda" else torch.float32
+
+def sync(device):
+    if device.type == "cuda":
+        torch.cuda.synchronize(device)
+
+@torch.no_grad()
+def timeit(fn, device, warmup=2, repeat=5):
+    """
+    Median wall time of fn() in milliseconds.
+    """
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        sync(device)
+        start = time.perf_counter()
+        fn()
+        sync(device)
+        times.append((time.perf_counter() - start) * 1000)
+    return sorted(times)[len(times) // 2]
@@ -0,0 +1,43 @@
+#
+# Fused adaLN-single: LayerNorm + modulate and the gated residual of one block, unfused vs fused
+#  python benchmarks/fused.py [--tokens 4096 16384] [--hidden-size 1152]
+#
+import argparse
+import torch
+
+from common import default_device, default_dtype, timeit
+from extramodels.PixArt.models.PixArt_blocks import t2i_modulate
+from extramodels.utils import fused
+from extramodels.utils.fused import norm_modulate, gated_residual
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tokens", type=int, nargs="+", default=[1024, 4096, 16384])
+    parser.add_argument("--hidden-size", type=int, default=1152)
+    parser.add_argument("--batch", type=int, default=2)
+    args = parser.parse_args()
+
+    device = default_device()
+    dtype = default_dtype(device)
+    C, B = args.hidden_size, args.batch
+    norm = torch.nn.LayerNorm(C, elementwise_affine=False, eps=1e-6).to(device)
+    shift, scale, gate = (torch.randn(B, 1, C, device=device, dtype=dtype) for _ in range(3))
+
+    kernel = "triton" if fused.use_triton and device.type == "cuda" else "torch fallback"
+    print(f"{device} {dtype}, hidden size {C}, batch {B}, {kernel}")
+    print(f"{'tokens':>7} {'unfused ms':>11} {'fused ms':>9} {'speedup':>7}")
+    for N in args.tokens:
+        x = torch.randn(B, N, C, device=device, dtype=dtype)
+        y = torch.randn(B, N, C, device=device, dtype=dtype)
+        def unfused():
+            h = t2i_modulate(norm(x), shift, scale)
+            return x + gate * (h + y)
+        def fused_():
+            h = norm_modulate(x, norm, shift, scale)
+            return gated_residual(x, gate, h.add_(y))
+        base = timeit(unfused, device)
+        ms = timeit(fused_, device)
+        print(f"{N:>7} {base:>11.2f} {ms:>9.2f} {base / ms:>6.2f}x")
+
+if __name__ == "__main__":
+    main()
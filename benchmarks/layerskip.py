@@ -0,0 +1,79 @@
+#
+# Layer skip draft mode: model latency vs block budget, randomly initialized models at their real size
+#  python benchmarks/layerskip.py [--models pixart sana hydit dit] [--res 1024] [--keep-every 1 2 3 4]
+#
+import argparse
+import torch
+
+from common import default_device, default_dtype, timeit
+from extramodels.utils.layerskip import LayerSkip
+
+def make_pixart(res, device, dtype):
+    from extramodels.PixArt.conf import pixart_conf
+    from extramodels.PixArt.models.PixArtMS import PixArtMS
+    model = PixArtMS(**pixart_conf["PixArtMS_Sigma_XL_2"]["unet_config"])
+    x = torch.randn(1, 4, res // 8, res // 8)
+    return model, dict(x=x, timesteps=torch.tensor([500.0]), context=torch.randn(1, 300, 4096))
+
+def make_sana(res, device, dtype):
+    from extramodels.Sana.conf import sana_conf
+    from extramodels.Sana.models.sana_multi_scale import SanaMS
+    model = SanaMS(**sana_conf["SanaMS_600M_P1_D28"]["unet_config"])
+    x = torch.randn(1, 32, res // 32, res // 32)
+    return model, dict(x=x, timesteps=torch.tensor([500.0]), context=torch.randn(1, 300, 2304))
+
+def make_hydit(res, device, dtype):
+    from extramodels.HunYuanDiT.conf import hydit_conf
+    from extramodels.HunYuanDiT.models.models import HunYuanDiT
+    model = HunYuanDiT(**hydit_conf["G/2"]["unet_config"], log_fn=lambda *a: None)
+    x = torch.randn(1, 4, res // 8, res // 8)
+    return model, dict(
+        x=x, timesteps=torch.tensor([500.0]),
+        context=torch.randn(1, 77, 1024), context_mask=torch.ones(1, 77),
+        context_t5=torch.randn(1, 256, 2048), context_t5_mask=torch.ones(1, 256),
+    )
+
+def make_dit(res, device, dtype):
+    from extramodels.DiT.conf import dit_conf
+    from extramodels.DiT.model import DiT
+    model = DiT(**dit_conf["XL/2"]["unet_config"], input_size=res // 8)
+    x = torch.randn(1, 4, res // 8, res // 8)
+    return model, dict(x=x, timesteps=torch.tensor([500.0]), context=torch.tensor([[207]]))
+
+models = {
+    "pixart": make_pixart,
+    "sana": make_sana,
+    "hydit": make_hydit,
+    "dit": make_dit,
+}
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--models", nargs="+", choices=list(models), default=list(models))
+    parser.add_argument("--res", type=int, default=1024, help="image resolution, DiT uses its ImageNet sizes (256/512)")
+    parser.add_argument("--keep-every", type=int, nargs="+", default=[1, 2, 3, 4])
+    parser.add_argument("--start-block", type=int, default=2)
+    parser.add_argument("--end-block", type=int, default=-2)
+    args = parser.parse_args()
+
+    device = default_device()
+    dtype = default_dtype(device)
+    print(f"{device} {dtype}, {args.res}px")
+    print(f"{'model':>6} {'keep':>4} {'blocks':>7} {'ms':>8} {'speedup':>7}")
+    for name in args.models:
+        res = min(args.res, 512) if name == "dit" else args.res
+        model, inputs = models[name](res, device, dtype)
+        model.dtype = dtype
+        model = model.to(device, dtype).eval()
+        inputs = {k: v.to(device) for k, v in inputs.items()}
+        depth = len(model.blocks)
+        full_ms = None
+        for keep_every in args.keep_every:
+            skip = LayerSkip(args.start_block, args.end_block, keep_every)
+            ms = timeit(lambda: model(**inputs, transformer_options={"layer_skip": skip}), device)
+            full_ms = full_ms or ms
+            print(f"{name:>6} {keep_every:>4} {skip.budget(depth):>3}/{depth:<3} {ms:>8.1f} {full_ms / ms:>6.2f}x")
+        del model
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#
+# Token merging: self-attention FLOPs and time saved per resolution, on a single PixArt-Sigma sized block
+#  python benchmarks/tome.py [--resolutions 512 1024 2048] [--ratios 0.25 0.5 0.75]
+#
+import argparse
+import torch
+
+from common import default_device, default_dtype, timeit
+from extramodels.PixArt.models.PixArtMS import PixArtMSBlock
+from extramodels.utils.tome import TokenMerging
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--resolutions", type=int, nargs="+", default=[512, 1024, 2048])
+    parser.add_argument("--ratios", type=float, nargs="+", default=[0.25, 0.5, 0.75])
+    parser.add_argument("--hidden-size", type=int, default=1152)
+    parser.add_argument("--heads", type=int, default=16)
+    args = parser.parse_args()
+
+    device = default_device()
+    dtype = default_dtype(device)
+    C = args.hidden_size
+    block = PixArtMSBlock(C, args.heads).to(device, dtype).eval()
+    y = torch.randn(1, 300, C, device=device, dtype=dtype)
+    t = torch.randn(1, 6 * C, device=device, dtype=dtype)
+
+    print(f"{device} {dtype}, hidden size {C}, {args.heads} heads")
+    print(f"{'res':>5} {'tokens':>7} {'ratio':>5} {'merged':>7} {'attn GFLOPs':>12} {'saved':>6} {'block ms':>9} {'speedup':>7}")
+    for res in args.resolutions:
+        h = w = res // 16 # 8x VAE, 2x2 patches
+        x = torch.randn(1, h * w, C, device=device, dtype=dtype)
+        full_flops = TokenMerging.attention_flops(h * w, C)
+        full_ms = timeit(lambda: block(x, y, t, mask=[300], HW=(h, w)), device)
+        print(f"{res:>5} {h * w:>7} {0:>5.2f} {h * w:>7} {full_flops / 1e9:>12.1f} {0:>6.0%} {full_ms:>9.1f} {1:>6.2f}x")
+        for ratio in args.ratios:
+            tome = TokenMerging([(0, -1, ratio)])
+            tome.report = lambda *args: None
+            def run():
+                # the plan is part of the cost, it's computed for every block
+                return block(x, y, t, mask=[300], HW=(h, w), tome=tome(0, x, (h, w)))
+            merged = len(tome(0, x, (h, w))[2])
+            flops = TokenMerging.attention_flops(merged, C)
+            ms = timeit(run, device)
+            print(f"{res:>5} {h * w:>7} {ratio:>5.2f} {merged:>7} {flops / 1e9:>12.1f} {1 - flops / full_flops:>6.0%} {ms:>9.1f} {full_ms / ms:>6.2f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+#
+# The node folder is loaded by ComfyUI as a package, register it under a fixed
+# name so the relative imports resolve. Needs ComfyUI on the path, e.g.
+#  PYTHONPATH=/path/to/ComfyUI python -m pytest tests
+#
+import os
+import sys
+import types
+import importlib.util
+import pytest
+
+collect_ignore_glob = []
+if importlib.util.find_spec("comfy") is None:
+    collect_ignore_glob.append("test_*.py") # nothing to test against without ComfyUI
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if "extramodels" not in sys.modules:
+    package = types.ModuleType("extramodels")
+    package.__path__ = [root]
+    sys.modules["extramodels"] = package
+
+@pytest.fixture(autouse=True)
+def compile_cache_root(tmp_path, monkeypatch):
+    """
+    Compile artifacts and the attention backend timings go to a per test folder,
+    never to the user's cache.
+    """
+    root = tmp_path / "compile_cache"
+    monkeypatch.setenv("EXTRAMODELS_COMPILE_CACHE", str(root))
+    attention = sys.modules.get("extramodels.utils.attention", None)
+    if attention is not None:
+        monkeypatch.setattr(attention, "backend_cache", attention.BackendCache())
+    return root
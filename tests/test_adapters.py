@@ -0,0 +1,60 @@
+import pytest
+import torch
+from torch.utils._python_dispatch import TorchDispatchMode
+from torch.utils._pytree import tree_flatten
+
+from extramodels.PixArt.models.PixArtMS import PixArtMS
+from extramodels.Sana.models.sana_multi_scale import SanaMS
+
+class AllocationCounter(TorchDispatchMode):
+    """
+    Counts the tensors whose storage isn't one of the op inputs, views don't count.
+    """
+    def __init__(self):
+        super().__init__()
+        self.count = 0
+        self.bytes = 0
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        out = func(*args, **(kwargs or {}))
+        inputs = {t.untyped_storage().data_ptr() for t in tree_flatten((args, kwargs))[0] if torch.is_tensor(t)}
+        for t in tree_flatten(out)[0]:
+            if torch.is_tensor(t) and t.untyped_storage().data_ptr() not in inputs:
+                self.count += 1
+                self.bytes += t.untyped_storage().nbytes()
+        return out
+
+def make(name, dtype):
+    if name == "pixart":
+        model = PixArtMS(input_size=64, patch_size=2, in_channels=4, hidden_size=96, depth=1, num_heads=2, caption_channels=96, model_max_length=120)
+        inputs = (torch.randn(2, 4, 64, 64), torch.full((2,), 500.0), torch.randn(2, 1, 120, 96))
+    else:
+        model = SanaMS(input_size=32, patch_size=1, in_channels=32, hidden_size=64, depth=1, num_heads=2, caption_channels=96, model_max_length=300, linear_head_dim=32)
+        inputs = (torch.randn(2, 32, 32, 32), torch.full((2,), 500.0), torch.randn(2, 1, 300, 96))
+    model.dtype = dtype
+    return model, inputs
+
+@pytest.mark.parametrize("name", ["pixart", "sana"])
+@pytest.mark.parametrize("dtype", [torch.float32, torch.bfloat16])
+def test_forward_adapter_allocations(name, dtype):
+    """
+    The comfy adapters around forward_raw only allocate the small conditioning tensors,
+    one cast of each input when the model dtype differs and the float cast of the eps half.
+    """
+    model, (x, t, y) = make(name, dtype)
+    out = torch.randn(x.shape[0], model.out_channels, *x.shape[2:], dtype=dtype)
+    seen = {}
+    def forward_raw(x, *args, y=None, **kwargs):
+        seen["x"], seen["y"] = x, y
+        return out
+    model.forward_raw = forward_raw
+
+    counter = AllocationCounter()
+    with torch.no_grad(), counter:
+        eps = model(x, t, y)
+    assert eps.dtype == torch.float32 and eps.shape == x.shape
+    # the inputs are cast once, by forward_raw
+    assert seen["x"] is x and seen["y"] is y
+    # only the eps half of the output is cast, the timestep/size conditioning is tiny
+    output = 0 if dtype == torch.float32 else eps.nbytes
+    assert output <= counter.bytes <= output + 1024
@@ -0,0 +1,73 @@
+import os
+import pytest
+import torch
+
+from extramodels.Sana.models.sana_blocks import FlashAttention
+from extramodels.utils import attention as attn
+
+def devices():
+    return ["cpu"] + (["cuda"] if torch.cuda.is_available() else [])
+
+def inputs(mask, dtype, device, B=2, H=4, N=96, Nk=40, D=32):
+    g = torch.Generator().manual_seed(0)
+    q = torch.randn(B, H, N, D, generator=g).to(device, dtype)
+    k, v = (torch.randn(B, H, Nk, D, generator=g).to(device, dtype) for _ in range(2))
+    attn_mask = None
+    if mask == "bool":
+        attn_mask = torch.arange(Nk, device=device)[None, None, None] < torch.tensor([Nk, 17], device=device)[:, None, None, None]
+    elif mask == "bias":
+        attn_mask = torch.randn(B, 1, N, Nk, generator=g).to(device, dtype)
+    return q, k, v, attn_mask
+
+@pytest.mark.parametrize("device", devices())
+@pytest.mark.parametrize("dtype, tol", [(torch.float32, 1e-5), (torch.float16, 2e-3), (torch.bfloat16, 2e-2)])
+@pytest.mark.parametrize("mask", ["none", "bool", "bias"])
+@pytest.mark.parametrize("name", sorted(attn.backends))
+def test_backend_matches_math(name, mask, dtype, tol, device, monkeypatch):
+    if device == "cpu" and dtype == torch.float16:
+        pytest.skip("no fp16 math on CPU")
+    monkeypatch.setattr(attn, "SLICE_BYTES", 4096) # several slices for the sliced backend
+    q, k, v, attn_mask = inputs(mask, dtype, device)
+    fn, supports = attn.backends[name]
+    if not supports(q, k, v, attn_mask):
+        pytest.skip(f"{name} can't run this call")
+    with torch.no_grad():
+        out = fn(q, k, v, attn_mask=attn_mask)
+        ref = attn.math_attention(q.float(), k.float(), v.float(), attn_mask=attn_mask if mask != "bias" else attn_mask.float())
+    assert out.shape == ref.shape
+    assert (out.float() - ref).abs().max() < tol
+
+def test_auto_resolves_once_per_shape(monkeypatch):
+    cache = attn.BackendCache()
+    calls = []
+    monkeypatch.setattr(cache, "get", lambda *args: calls.append(args) or "math")
+    monkeypatch.setattr(attn, "backend_cache", cache)
+    monkeypatch.setattr(attn, "default_backend", "auto")
+    q, k, v, _ = inputs("none", torch.float32, "cpu")
+    for _ in range(3):
+        attn.attention(q, k, v)
+    attn.attention(q[:1], k[:1], v[:1])
+    assert len(calls) == 2
+
+@pytest.mark.parametrize("name", ["sdpa", "math"])
+def test_sana_flash_attention_empty_mask_row(name, monkeypatch):
+    monkeypatch.setattr(attn, "forced", [name])
+    torch.manual_seed(0)
+    layer = FlashAttention(64, num_heads=2).eval()
+    x = torch.randn(2, 16, 64)
+    mask = torch.ones(2, 16)
+    mask[1] = 0 # no valid keys, the additive bias keeps the row finite
+    with torch.no_grad():
+        out = layer(x, mask=mask)
+        ref = layer(x[:1], mask=mask[:1])
+    assert torch.isfinite(out).all()
+    assert torch.allclose(out[:1], ref, atol=1e-5)
+
+def test_auto_is_opt_in_and_cached_outside_the_package(compile_cache_root, monkeypatch):
+    assert attn.default_backend == os.environ.get("EXTRAMODELS_ATTENTION", "sdpa")
+    monkeypatch.setattr(attn, "default_backend", "auto")
+    q, k, v, _ = inputs("none", torch.float32, "cpu")
+    attn.attention(q, k, v)
+    assert (compile_cache_root / "attention_backends.json").is_file()
+    package = os.path.dirname(os.path.dirname(os.path.abspath(attn.__file__)))
+    assert not os.path.exists(os.path.join(package, "compile_cache"))
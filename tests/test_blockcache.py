@@ -0,0 +1,60 @@
+import torch
+
+from extramodels.utils.blockcache import FirstBlockCache
+
+def sample(cache, residuals):
+    """
+    Runs one "model call" per first block residual, returns the steps the other blocks ran on.
+    """
+    ran = []
+    x = torch.ones(1, 4, 8)
+    for step, r in enumerate(residuals):
+        run = cache.bind(torch.tensor([999.0 - step]), {"sample_sigmas": torch.zeros(len(residuals) + 1), "cond_or_uncond": [0]})
+        def rest(h, step=step):
+            ran.append(step)
+            return h * 2
+        out = run(x, lambda x: x + r, rest)
+        # exact as long as the residual of the other blocks is unchanged, which holds for the ones used here
+        assert torch.equal(out, (x + r) * 2)
+    return ran
+
+def test_skips_while_residual_is_stable():
+    cache = FirstBlockCache(threshold=0.1, max_skips=10)
+    cache.sampling.begin()
+    # the flag is always predicted one step ahead, so the first two steps run
+    assert sample(cache, [torch.full((1, 4, 8), 1.0)] * 6) == [0, 1]
+    assert cache.skipped == {2, 3, 4, 5}
+
+def test_runs_when_residual_changes():
+    cache = FirstBlockCache(threshold=0.1, max_skips=10)
+    cache.sampling.begin()
+    residuals = [torch.full((1, 4, 8), 1.0 + i) for i in range(6)]
+    assert sample(cache, residuals) == list(range(6))
+
+def test_max_skips():
+    cache = FirstBlockCache(threshold=0.1, max_skips=1)
+    cache.sampling.begin()
+    assert sample(cache, [torch.full((1, 4, 8), 1.0)] * 6) == [0, 1, 3, 5]
+
+def test_finish_drops_states():
+    cache = FirstBlockCache()
+    cache.sampling.begin()
+    sample(cache, [torch.full((1, 4, 8), 1.0)] * 3)
+    assert cache.states
+    cache.sampling.end()
+    assert not cache.states and not cache.sampling.steps
+
+def test_hooked_cache_ignores_timesteps():
+    cache = FirstBlockCache()
+    cache.sampling.begin()
+    # runs are told apart by the sampling hooks, the timestep is never read back from the device
+    run = cache.bind(None, {"cond_or_uncond": [0]})
+    assert torch.equal(run(torch.zeros(1, 2), lambda x: x + 1, lambda h: h * 2), torch.full((1, 2), 2.0))
+
+def test_unhooked_runs_are_split_on_the_timestep():
+    cache = FirstBlockCache(threshold=0.1, max_skips=10)
+    sample(cache, [torch.full((1, 4, 8), 1.0)] * 4)
+    assert cache.skipped == {2, 3}
+    # the timestep went back up, a new run
+    assert sample(cache, [torch.full((1, 4, 8), 1.0)] * 3) == [0, 1]
+    assert cache.skipped == {2}
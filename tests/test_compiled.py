@@ -0,0 +1,94 @@
+import os
+import torch
+
+from extramodels.PixArt.models.PixArtMS import PixArtMS
+from extramodels.Sana.models.sana_multi_scale import SanaMS
+from extramodels.utils.compiled import CompiledBlocks, CompileCache
+
+def make_pixart():
+    torch.manual_seed(0)
+    model = PixArtMS(input_size=64, patch_size=2, in_channels=4, hidden_size=96, depth=2, num_heads=2, caption_channels=96, model_max_length=120)
+    model.dtype = torch.float32
+    return model.eval()
+
+def make_sana():
+    torch.manual_seed(0)
+    model = SanaMS(input_size=32, patch_size=1, in_channels=32, hidden_size=64, depth=2, num_heads=2, caption_channels=96, model_max_length=300, linear_head_dim=32)
+    model.dtype = torch.float32
+    return model.eval()
+
+def prompt(batch, length, seed=1):
+    y = torch.randn(batch, 1, 300, 96, generator=torch.Generator().manual_seed(seed))
+    y[:, :, length:] = 0
+    return y
+
+def test_pixart_static_text_matches_packed():
+    model = make_pixart()
+    g = torch.Generator().manual_seed(1)
+    x, y = torch.randn(2, 4, 64, 64, generator=g), torch.randn(2, 1, 120, 96, generator=g)
+    mask = torch.zeros(2, 1, 1, 120)
+    mask[0, ..., :17] = 1
+    mask[1, ..., :64] = 1
+    t = torch.full((2,), 500.0)
+    data_info = {"img_hw": torch.tensor([[512.0, 512.0]] * 2), "aspect_ratio": torch.ones(2, 1)}
+    with torch.no_grad():
+        packed = model.forward_raw(x, t, y, mask=mask, data_info=data_info)
+        static = model.forward_raw(x, t, y, mask=mask, data_info=data_info, static_text=True)
+    assert torch.allclose(packed, static, atol=1e-5)
+
+def test_sana_static_text_matches_cut():
+    model = make_sana()
+    x, y = torch.randn(2, 32, 32, 32, generator=torch.Generator().manual_seed(2)), prompt(2, 23)
+    t = torch.full((2,), 500.0)
+    with torch.no_grad():
+        cut = model(x, t, y)
+        static = model(x, t, y, transformer_options={"static_text": True})
+    assert torch.allclose(cut, static, atol=1e-5)
+
+def test_prompt_length_does_not_recompile():
+    model = make_sana()
+    torch._dynamo.reset()
+    compiled = CompiledBlocks(backend="eager")
+    forwards = compiled.forwards(model)
+    for i, forward in forwards.items():
+        model.blocks[i].forward = forward
+
+    def apply_model(x, t, **c):
+        return model(x, t, **c)
+
+    x = torch.randn(2, 32, 32, 32, generator=torch.Generator().manual_seed(2))
+    t = torch.full((2,), 500.0)
+    with torch.no_grad():
+        out = compiled(apply_model, {"input": x, "timestep": t, "c": {"context": prompt(2, 11)}})
+        graphs = torch._dynamo.utils.counters["stats"]["unique_graphs"]
+        for length in (37, 120, 300):
+            compiled(apply_model, {"input": x, "timestep": t, "c": {"context": prompt(2, length)}})
+        assert torch._dynamo.utils.counters["stats"]["unique_graphs"] == graphs
+        assert torch.allclose(out, model(x, t, prompt(2, 11)), atol=1e-5)
+    assert not compiled.active
+    torch._dynamo.reset()
+
+def test_compile_cache_one_file_per_process(tmp_path, monkeypatch):
+    monkeypatch.delenv("TORCHINDUCTOR_CACHE_DIR", raising=False)
+    monkeypatch.setattr(CompileCache, "loaded", set())
+    loaded = []
+    monkeypatch.setattr(torch.compiler, "save_cache_artifacts", lambda: (b"artifacts", None))
+    monkeypatch.setattr(torch.compiler, "load_cache_artifacts", loaded.append)
+    cache = CompileCache(root=str(tmp_path), max_files=2)
+    assert "TORCHINDUCTOR_CACHE_DIR" not in os.environ # nothing process wide until it's used
+    os.makedirs(tmp_path / "torch-0.0")
+    os.makedirs(cache.path)
+    for name in ("1.bin", "2.bin", "3.bin"):
+        (tmp_path / cache.path / name).write_bytes(name.encode())
+
+    # every save rewrites the file of this process, the artifacts are cumulative
+    cache.save()
+    cache.save()
+    assert sorted(os.listdir(cache.path)) == sorted(["1.bin", "2.bin", "3.bin", cache.name])
+
+    assert cache.load() == 2
+    assert sorted(loaded) == [b"2.bin", b"3.bin"]
+    assert sorted(os.listdir(cache.path)) == sorted(["2.bin", "3.bin", cache.name])
+    assert os.listdir(tmp_path) == [os.path.basename(cache.path)]
+    assert os.environ["TORCHINDUCTOR_CACHE_DIR"] == os.path.join(cache.path, "inductor")
+    assert cache.load() == 0
@@ -0,0 +1,44 @@
+import pytest
+import torch
+
+from extramodels.PixArt.models.PixArt_blocks import t2i_modulate
+from extramodels.utils import fused
+from extramodels.utils.fused import norm_modulate, gated_residual
+
+def inputs(B=2, N=77, C=96, seed=0, device="cpu"):
+    g = torch.Generator().manual_seed(seed)
+    x, shift, scale = torch.randn(B, N, C, generator=g), torch.randn(B, 1, C, generator=g), torch.randn(B, 1, C, generator=g)
+    return x.to(device), shift.to(device), scale.to(device)
+
+@pytest.mark.parametrize("affine", [False, True])
+def test_norm_modulate_matches_unfused(affine):
+    x, shift, scale = inputs()
+    norm = torch.nn.LayerNorm(96, elementwise_affine=affine, eps=1e-6)
+    if affine:
+        with torch.no_grad():
+            norm.weight.normal_()
+            norm.bias.normal_()
+    with torch.no_grad():
+        assert torch.allclose(norm_modulate(x, norm, shift, scale), t2i_modulate(norm(x), shift, scale), atol=1e-5)
+
+def test_gated_residual_matches_unfused():
+    x, gate, _ = inputs(seed=1)
+    y = torch.randn_like(x)
+    ref = x + gate * y
+    assert torch.allclose(gated_residual(x, gate, y), ref, atol=1e-6)
+    with torch.no_grad():
+        out = gated_residual(x, gate, y, inplace=True)
+    assert out.data_ptr() == x.data_ptr()
+    assert torch.allclose(out, ref, atol=1e-6)
+
+@pytest.mark.skipif(not torch.cuda.is_available() or fused.triton is None, reason="needs CUDA and triton")
+@pytest.mark.parametrize("affine", [False, True])
+def test_triton_matches_torch(affine):
+    x, shift, scale = inputs(C=1152, device="cuda")
+    norm = torch.nn.LayerNorm(1152, elementwise_affine=affine, eps=1e-6).cuda()
+    if affine:
+        with torch.no_grad():
+            norm.weight.normal_()
+    with torch.no_grad():
+        out = norm_modulate(x, norm, shift, scale)
+    assert torch.allclose(out, fused.norm_modulate_torch(x, norm, shift, scale), atol=1e-4)
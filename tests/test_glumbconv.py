@@ -0,0 +1,27 @@
+import pytest
+import torch
+
+from extramodels.Sana.models.basic_modules import GLUMBConv
+
+def make(seed=0):
+    torch.manual_seed(seed)
+    mlp = GLUMBConv(in_features=32, hidden_features=64, use_bias=(True, True, False), norm=(None, None, None), act=("silu", "silu", None), dilation=2)
+    with torch.no_grad():
+        for p in mlp.parameters():
+            p.normal_(0, 0.2) # random biases too, so a missing halo or border row shows up
+    return mlp.eval()
+
+@pytest.mark.parametrize("H, W", [(12, 12), (10, 7)])
+@pytest.mark.parametrize("rows", [1, 2, 3, 4, 5, 9])
+def test_chunked_matches_full(H, W, rows):
+    """
+    Row bands that do and don't divide H, the last band is partial when they don't,
+    every band edge reads the dilated conv halo of its neighbours.
+    """
+    mlp = make()
+    x = torch.randn(2, H * W, 32, generator=torch.Generator().manual_seed(1))
+    with torch.no_grad():
+        full = mlp(x, HW=(H, W))
+        chunked = mlp(x, HW=(H, W), chunk=rows * W)
+    assert chunked.shape == full.shape
+    assert torch.equal(chunked, full)
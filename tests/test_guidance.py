@@ -0,0 +1,51 @@
+import torch
+
+from extramodels.utils.guidance import GuidanceTruncation
+
+def sample(truncation, steps=6):
+    """
+    Batched [cond, uncond] calls with a control dict, returns the batch size of every model call.
+    """
+    batches = []
+    def apply_model(x, sigma, c_crossattn, control, transformer_options):
+        batches.append(x.shape[0])
+        # controls are sliced with the rows they belong to
+        assert control["output"][0].shape[0] == x.shape[0]
+        assert torch.equal(control["output"][0][:, 0], c_crossattn[:, 0, 0])
+        return x + c_crossattn[:, :1, :1, None]
+    sigmas = torch.linspace(10, 0, steps + 1)
+    for i in range(steps):
+        x = torch.zeros(2, 4, 8, 8)
+        c_crossattn = torch.tensor([1.0, 2.0])[:, None, None].expand(2, 3, 4)
+        c = {
+            "c_crossattn": c_crossattn,
+            "control": {"output": [c_crossattn[:, :1, 0].clone()], "middle": []},
+            "transformer_options": {"sample_sigmas": sigmas},
+        }
+        out = truncation(apply_model, {"input": x, "timestep": sigmas[i].expand(2), "c": c, "cond_or_uncond": [0, 1]})
+        assert out.shape == x.shape
+    return batches
+
+def test_sigma_end():
+    truncation = GuidanceTruncation(sigma_end=5.0, threshold=float("inf"), extrapolate=False)
+    truncation.sampling.begin()
+    # sigmas 10, 8.33, 6.67, 5 run with cfg, the decision made on 5 is read back on the next call
+    assert sample(truncation) == [2, 2, 2, 2, 1, 1]
+
+def test_cos_threshold():
+    truncation = GuidanceTruncation(sigma_end=-1.0, threshold=0.5)
+    truncation.sampling.begin()
+    assert sample(truncation) == [2, 1, 1, 1, 1, 1]
+
+def test_finish_reports_and_resets():
+    truncation = GuidanceTruncation(sigma_end=-1.0, threshold=float("inf"))
+    truncation.sampling.begin()
+    assert sample(truncation) == [2] * 6
+    truncation.sampling.end()
+    assert truncation.step == -1 and not truncation.log
+
+def test_unhooked_runs_are_split_on_the_sigma():
+    truncation = GuidanceTruncation(sigma_end=5.0, threshold=float("inf"), extrapolate=False)
+    assert sample(truncation) == [2, 2, 2, 2, 1, 1]
+    # the sigma went back up, the next run starts with cfg again
+    assert sample(truncation) == [2, 2, 2, 2, 1, 1]
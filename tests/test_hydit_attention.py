@@ -0,0 +1,106 @@
+import pytest
+import torch
+
+from extramodels.HunYuanDiT.models.attn_layers import (
+    Attention, CrossAttention, FlashSelfMHAModified, FlashCrossMHAModified, SDPASelfMHA, SDPACrossMHA, apply_rotary_emb,
+)
+from extramodels.HunYuanDiT.models.posemb_layers import get_2d_rotary_pos_embed
+
+DIM, HEADS, TEXT_DIM = 256, 4, 128
+
+def pair(ref_cls, new_cls, *args, dtype=torch.float32, device="cpu"):
+    torch.manual_seed(0)
+    ref = ref_cls(*args, num_heads=HEADS, qk_norm=True)
+    new = new_cls(*args, num_heads=HEADS, qk_norm=True)
+    new.load_state_dict(ref.state_dict())
+    return ref.to(device, dtype).eval(), new.to(device, dtype).eval()
+
+def inputs(dtype=torch.float32, device="cpu"):
+    g = torch.Generator().manual_seed(1)
+    x = torch.randn(2, 64, DIM, generator=g).to(device, dtype)
+    y = torch.randn(2, 20, TEXT_DIM, generator=g).to(device, dtype)
+    rope = get_2d_rotary_pos_embed(DIM // HEADS, (0, 0), (8, 8), (8, 8))
+    return x, y, tuple(r.to(device) for r in rope)
+
+@pytest.mark.parametrize("dtype,tol", [(torch.float32, 1e-5), (torch.bfloat16, 5e-2)])
+def test_sdpa_matches_torch(dtype, tol):
+    x, y, rope = inputs(dtype)
+    with torch.no_grad():
+        ref, new = pair(Attention, SDPASelfMHA, DIM, dtype=dtype)
+        assert (ref(x, rope)[0].float() - new(x, rope)[0].float()).abs().max() < tol
+
+        ref, new = pair(CrossAttention, SDPACrossMHA, DIM, TEXT_DIM, dtype=dtype)
+        assert (ref(x, y, rope)[0].float() - new(x, y, rope)[0].float()).abs().max() < tol
+
+        mask = torch.ones(2, y.shape[1], dtype=torch.bool)
+        mask[0, 7:] = False
+        assert (ref(x, y, rope, mask)[0].float() - new(x, y, rope, mask)[0].float()).abs().max() < tol
+
+try:
+    from flash_attn.modules.mha import FlashSelfAttention, FlashCrossAttention
+except ImportError:
+    FlashSelfAttention = FlashCrossAttention = None
+
+class OriginalFlashSelfMHA(torch.nn.Module):
+    """
+    FlashSelfMHAModified as released, on flash_attn's own modules.
+    """
+    def __init__(self, dim, num_heads, qkv_bias=True, qk_norm=False):
+        super().__init__()
+        self.num_heads, self.head_dim = num_heads, dim // num_heads
+        self.Wqkv = torch.nn.Linear(dim, 3 * dim, bias=qkv_bias)
+        self.q_norm = torch.nn.LayerNorm(self.head_dim, elementwise_affine=True, eps=1e-6) if qk_norm else torch.nn.Identity()
+        self.k_norm = torch.nn.LayerNorm(self.head_dim, elementwise_affine=True, eps=1e-6) if qk_norm else torch.nn.Identity()
+        self.inner_attn = FlashSelfAttention(attention_dropout=0.0)
+        self.out_proj = torch.nn.Linear(dim, dim, bias=qkv_bias)
+
+    def forward(self, x, freqs_cis_img=None):
+        b, s, d = x.shape
+        qkv = self.Wqkv(x).view(b, s, 3, self.num_heads, self.head_dim)
+        q, k, v = qkv.unbind(dim=2)
+        q = self.q_norm(q).half()
+        k = self.k_norm(k).half()
+        if freqs_cis_img is not None:
+            q, k = apply_rotary_emb(q, k, freqs_cis_img)
+        qkv = torch.stack([q, k, v], dim=2)
+        context = self.inner_attn(qkv)
+        return (self.out_proj(context.view(b, s, d)),)
+
+class OriginalFlashCrossMHA(torch.nn.Module):
+    """
+    FlashCrossMHAModified as released, on flash_attn's own modules.
+    """
+    def __init__(self, qdim, kdim, num_heads, qkv_bias=True, qk_norm=False):
+        super().__init__()
+        self.num_heads, self.head_dim = num_heads, qdim // num_heads
+        self.q_proj = torch.nn.Linear(qdim, qdim, bias=qkv_bias)
+        self.kv_proj = torch.nn.Linear(kdim, 2 * qdim, bias=qkv_bias)
+        self.q_norm = torch.nn.LayerNorm(self.head_dim, elementwise_affine=True, eps=1e-6) if qk_norm else torch.nn.Identity()
+        self.k_norm = torch.nn.LayerNorm(self.head_dim, elementwise_affine=True, eps=1e-6) if qk_norm else torch.nn.Identity()
+        self.inner_attn = FlashCrossAttention(attention_dropout=0.0)
+        self.out_proj = torch.nn.Linear(qdim, qdim, bias=qkv_bias)
+
+    def forward(self, x, y, freqs_cis_img=None):
+        b, s1, _ = x.shape
+        _, s2, _ = y.shape
+        q = self.q_proj(x).view(b, s1, self.num_heads, self.head_dim)
+        kv = self.kv_proj(y).view(b, s2, 2, self.num_heads, self.head_dim)
+        k, v = kv.unbind(dim=2)
+        q = self.q_norm(q).half()
+        k = self.k_norm(k).half()
+        if freqs_cis_img is not None:
+            q, _ = apply_rotary_emb(q, None, freqs_cis_img)
+        kv = torch.stack([k, v], dim=2)
+        context = self.inner_attn(q, kv).view(b, s1, -1)
+        return (self.out_proj(context),)
+
+@pytest.mark.skipif(FlashSelfAttention is None or not torch.cuda.is_available(), reason="needs flash_attn on CUDA")
+@pytest.mark.parametrize("new_self, new_cross", [(FlashSelfMHAModified, FlashCrossMHAModified), (SDPASelfMHA, SDPACrossMHA)])
+def test_matches_original_fa(new_self, new_cross):
+    x, y, rope = inputs(torch.float16, "cuda")
+    with torch.no_grad():
+        ref, new = pair(OriginalFlashSelfMHA, new_self, DIM, dtype=torch.float16, device="cuda")
+        assert (ref(x, rope)[0].float() - new(x, rope)[0].float()).abs().max() < 1e-2
+
+        ref, new = pair(OriginalFlashCrossMHA, new_cross, DIM, TEXT_DIM, dtype=torch.float16, device="cuda")
+        assert (ref(x, y, rope)[0].float() - new(x, y, rope)[0].float()).abs().max() < 1e-2
@@ -0,0 +1,92 @@
+import pytest
+import torch
+from argparse import Namespace
+
+from extramodels.HunYuanDiT.conf import hydit_args
+from extramodels.HunYuanDiT.models.models import HunYuanDiT
+
+def make_model(depth=6):
+    torch.manual_seed(0)
+    args = Namespace(**{**vars(hydit_args), "infer_mode": "torch"})
+    model = HunYuanDiT(args, input_size=(32, 32), depth=depth, hidden_size=64, num_heads=2, patch_size=2, log_fn=lambda *a: None)
+    model.dtype = torch.float32
+    return model.eval()
+
+def sample(model, interval=None, steps=8):
+    """
+    Small euler run, the same way the sampler drives the model: one call per step with decreasing timesteps.
+    """
+    g = torch.Generator().manual_seed(1)
+    x = torch.randn(2, 4, 32, 32, generator=g)
+    cond = dict(
+        context = torch.randn(2, 77, 1024, generator=g),
+        context_mask = torch.ones(2, 77),
+        context_t5 = torch.randn(2, 256, 2048, generator=g),
+        context_t5_mask = torch.ones(2, 256),
+    )
+    sigmas = torch.linspace(1, 0, steps + 1)
+    transformer_options = {"sample_sigmas": sigmas, "cond_or_uncond": [0]}
+    if interval is not None:
+        transformer_options["hydit_deepcache"] = {"interval": interval, "depth": 1, "start_step": 0, "end_step": -1}
+    model.sampling_start()
+    try:
+        with torch.no_grad():
+            for i in range(steps):
+                t = torch.full((2,), 999 * float(sigmas[i]))
+                out = model(x, t, **cond, transformer_options=transformer_options)
+                x = x + (sigmas[i + 1] - sigmas[i]) * out[:, :4]
+        speedup = model.deepcache.speedup()
+    finally:
+        model.sampling_end()
+    return x, speedup
+
+def rel_err(x, ref):
+    return float((x - ref).norm() / ref.norm())
+
+def test_interval_one_matches_full_run():
+    model = make_model()
+    assert torch.equal(sample(model)[0], sample(model, interval=1)[0])
+
+@pytest.mark.parametrize("depth", [6, 8])
+def test_quality_against_full_run(depth):
+    model = make_model(depth)
+    ref, _ = sample(model)
+    x2, speedup2 = sample(model, interval=2)
+    x3, speedup3 = sample(model, interval=3)
+    # measured ~1-2% (interval 2) and ~3% (interval 3) on this config
+    assert 0 < rel_err(x2, ref) < 0.05
+    assert rel_err(x2, ref) < rel_err(x3, ref) < 0.1
+    assert 1.5 <= speedup2 < speedup3
+
+def test_features_cleared_after_sampling():
+    model = make_model()
+    model.sampling_start()
+    with torch.no_grad():
+        g = torch.Generator().manual_seed(1)
+        model(
+            torch.randn(2, 4, 32, 32, generator=g), torch.full((2,), 500.0),
+            context = torch.randn(2, 77, 1024, generator=g), context_mask = torch.ones(2, 77),
+            context_t5 = torch.randn(2, 256, 2048, generator=g), context_t5_mask = torch.ones(2, 256),
+            transformer_options = {"hydit_deepcache": {"interval": 2, "depth": 1, "start_step": 0, "end_step": -1}},
+        )
+    assert model.deepcache.features
+    model.sampling_end()
+    assert not model.deepcache.features
+
+def test_hooked_run_does_not_sync():
+    model = make_model()
+    opts = {"interval": 2, "depth": 1, "start_step": 0, "end_step": -1}
+    transformer_options = {"sample_sigmas": torch.linspace(1, 0, 5), "cond_or_uncond": [0]}
+    model.sampling_start()
+    # without the hooks the timestep is read back to detect new runs, inside a run it's never touched
+    t = torch.full((2,), 500.0, device="meta")
+    steps = [model.deepcache.update(opts, t, transformer_options)[2] for _ in range(4)]
+    assert steps == [False, True, False, True]
+    model.sampling_end()
+
+def test_unhooked_runs_are_split_on_the_timestep():
+    model = make_model()
+    opts = {"interval": 2, "depth": 1, "start_step": 0, "end_step": -1}
+    transformer_options = {"cond_or_uncond": [0]}
+    reuse = [model.deepcache.update(opts, torch.full((2,), t), transformer_options)[2] for t in (900.0, 500.0, 100.0, 900.0, 500.0)]
+    assert reuse == [False, True, False, False, True]
@@ -0,0 +1,106 @@
+import pytest
+import torch
+from argparse import Namespace
+
+from extramodels.HunYuanDiT.conf import hydit_args
+from extramodels.HunYuanDiT.models.models import HunYuanDiT
+
+def make_model(mode="torch", depth=4, device="cpu", dtype=torch.float32):
+    torch.manual_seed(0)
+    args = Namespace(**{**vars(hydit_args), "infer_mode": mode})
+    model = HunYuanDiT(args, input_size=(32, 32), depth=depth, hidden_size=64, num_heads=2, patch_size=2, log_fn=lambda *a: None)
+    model.dtype = dtype
+    return model.to(device, dtype).eval()
+
+def make_inputs(clip_lens, t5_lens, device="cpu"):
+    B = len(clip_lens)
+    g = torch.Generator().manual_seed(1)
+    inputs = dict(
+        x = torch.randn(B, 4, 32, 32, generator=g),
+        timesteps = torch.full((B,), 500.0),
+        context = torch.randn(B, 77, 1024, generator=g),
+        context_mask = torch.zeros(B, 77),
+        context_t5 = torch.randn(B, 256, 2048, generator=g),
+        context_t5_mask = torch.zeros(B, 256),
+    )
+    for i, (l_clip, l_t5) in enumerate(zip(clip_lens, t5_lens)):
+        inputs["context_mask"][i, :l_clip] = 1
+        inputs["context_t5_mask"][i, :l_t5] = 1
+    return {k: v.to(device) for k, v in inputs.items()}
+
+def run(model, inputs, text_attn, **kwargs):
+    with torch.no_grad():
+        return model(**inputs, **kwargs, transformer_options={"hydit_text_attn": text_attn})
+
+@pytest.mark.parametrize("mode", ["torch", "sdpa"])
+def test_masked_matches_padding_without_padding(mode):
+    model = make_model(mode)
+    inputs = make_inputs([77, 77], [256, 256])
+    ref = run(model, inputs, "padding")
+    out = run(model, inputs, "masked")
+    assert (ref - out).abs().max() < 1e-5
+
+@pytest.mark.parametrize("mode", ["torch", "sdpa"])
+def test_masked_ignores_padded_tokens(mode):
+    model = make_model(mode)
+    inputs = make_inputs([10, 25], [30, 12])
+    ref = run(model, inputs, "masked")
+    # the t5 states also feed the (unmasked) attention pool, only the clip padding is free
+    inputs["context"][0, 10:] = torch.randn_like(inputs["context"][0, 10:])
+    model.text_cond_cache.clear()
+    assert (ref - run(model, inputs, "masked")).abs().max() < 1e-5
+
+@pytest.mark.parametrize("mode", ["torch", "sdpa"])
+def test_mixed_lengths_match_rows_alone(mode):
+    model = make_model(mode)
+    # cond/uncond of different lengths, each row is cut to the longest one and the rest masked
+    inputs = make_inputs([10, 25], [30, 12])
+    text_lens = torch.tensor([[10, 30], [25, 12]])
+    batched = run(model, inputs, "masked", text_lens=text_lens)
+    for i in range(2):
+        row = {k: v[i:i + 1] for k, v in inputs.items()}
+        # alone, nothing is padded
+        assert (batched[i:i + 1] - run(model, row, "masked", text_lens=text_lens[i:i + 1])).abs().max() < 1e-5
+
+def test_host_lens_match_device_lens():
+    model = make_model()
+    inputs = make_inputs([10, 25], [30, 12])
+    ref = run(model, inputs, "masked")
+    model.text_cond_cache.clear()
+    text_lens = torch.tensor([[10, 30], [25, 12]])
+    assert torch.equal(ref, run(model, inputs, "masked", text_lens=text_lens))
+    # lens on the device would be a silent sync
+    with pytest.raises(AssertionError):
+        run(model, inputs, "masked", text_lens=text_lens.to("meta"))
+
+def test_empty_prompt_is_finite():
+    model = make_model()
+    inputs = make_inputs([0, 10], [0, 30])
+    assert torch.isfinite(run(model, inputs, "masked")).all()
+
+@pytest.mark.skipif(not torch.cuda.is_available(), reason="flash modules run in fp16 on CUDA")
+def test_masked_on_fa_falls_back():
+    model = make_model("fa", device="cuda", dtype=torch.float16)
+    inputs = make_inputs([10, 25], [30, 12], device="cuda")
+    assert torch.isfinite(run(model, inputs, "masked")).all()
+
+def test_text_cond_cached_within_sampling_run():
+    model = make_model()
+    inputs = make_inputs([10, 25], [30, 12])
+    transformer_options = {"hydit_text_attn": "masked", "uuids": ["cond", "uncond"]}
+    ref = run(model, inputs, "masked")
+    cache = model.text_cond_cache
+    # outside of a sampling run nothing is cached
+    assert not cache.entries
+
+    model.sampling_start()
+    with torch.no_grad():
+        assert torch.equal(model(**inputs, transformer_options=transformer_options), ref)
+        assert torch.equal(model(**inputs, transformer_options=transformer_options), ref)
+        assert (cache.hits, cache.misses) == (1, 1)
+        # another cond, or another size (e.g. a resolution switch) is prepared again
+        model(**inputs, transformer_options={**transformer_options, "uuids": ["cond", "other"]})
+        model(**{**inputs, "x": inputs["x"][..., :16, :]}, transformer_options=transformer_options)
+        assert (cache.hits, cache.misses) == (1, 3)
+    model.sampling_end()
+    assert not cache.entries
@@ -0,0 +1,79 @@
+import pytest
+import torch
+
+from extramodels.PixArt.models.PixArtMS import PixArtMS
+from extramodels.PixArt.models.PixArt_blocks import AttentionKVCompress
+
+def make_model(kv_compress_config=None):
+    torch.manual_seed(0)
+    model = PixArtMS(input_size=64, patch_size=2, in_channels=4, hidden_size=96, depth=4, num_heads=2, caption_channels=96, model_max_length=120, kv_compress_config=kv_compress_config)
+    model.dtype = torch.float32
+    return model.eval()
+
+def run(model, kv_compress=None):
+    g = torch.Generator().manual_seed(1)
+    x, y = torch.randn(2, 4, 64, 64, generator=g), torch.randn(2, 1, 120, 96, generator=g)
+    with torch.no_grad():
+        return model(x, torch.full((2,), 500.0), y, transformer_options={"pixart_kv_compress": kv_compress} if kv_compress else {})
+
+def override(sampling, scale_factor, start_block=0, end_block=-1):
+    return {"sampling": sampling, "scale_factor": scale_factor, "start_block": start_block, "end_block": end_block}
+
+def test_ratio_one_is_uncompressed():
+    plain = make_model()
+    ref = run(plain)
+    assert torch.equal(run(plain, override("auto", 1)), ref)
+    # a checkpoint trained with compression, switched off at runtime
+    compressed = make_model({"sampling": "conv", "scale_factor": 2, "kv_compress_layer": [1, 2]})
+    compressed.load_state_dict(plain.state_dict(), strict=False)
+    assert not torch.equal(run(compressed), ref)
+    assert torch.equal(run(compressed, override("auto", 1)), ref)
+
+def test_override_block_range():
+    model = make_model()
+    ref = run(model)
+    # an empty range changes nothing, any block in it does
+    assert torch.equal(run(model, override("ave", 2, start_block=2, end_block=2)), ref)
+    assert not torch.equal(run(model, override("ave", 2, start_block=3)), ref)
+
+def test_auto_sampling():
+    attn = AttentionKVCompress(96, num_heads=2, sampling="conv", sr_ratio=2)
+    assert attn.kv_compress_mode() == ("conv", 2)
+    assert attn.kv_compress_mode(("auto", 2)) == ("conv", 2)
+    # no learned sampler for other ratios
+    assert attn.kv_compress_mode(("auto", 4)) == ("ave", 4)
+    assert attn.kv_compress_mode(("uniform", 2)) == ("uniform", 2)
+
+@pytest.mark.parametrize("sampling, grid", [("uniform", (3, 4)), ("ave", (2, 3)), ("conv", (2, 3)), ("uniform_every", (18,))])
+def test_downsample_uneven_grid(sampling, grid):
+    attn = AttentionKVCompress(8, num_heads=2, sampling="conv", sr_ratio=2)
+    H, W = 5, 7
+    x = torch.randn(2, H * W, 8)
+    out, new_N = attn.downsample_2d(x, H, W, 2, sampling=sampling)
+    # the token count comes from the sampled grid, rounded down (ave/conv) or up (uniform)
+    assert new_N == out.shape[1] == torch.Size(grid).numel()
+    assert out.shape == (2, new_N, 8)
+    grid = x.reshape(2, H, W, 8)
+    if sampling == "uniform":
+        assert torch.equal(out, grid[:, ::2, ::2].reshape(2, -1, 8))
+    elif sampling == "ave":
+        # nearest on a 1/2 grid picks every other row/column
+        assert torch.equal(out, grid[:, :4:2, :6:2].reshape(2, -1, 8))
+
+@pytest.mark.parametrize("kv_compress", [None, ("uniform", 2), ("ave", 2)])
+def test_kv_gather_matches_full_sequence(kv_compress):
+    torch.manual_seed(0)
+    attn = AttentionKVCompress(96, num_heads=2, qk_norm=True).eval()
+    H, W = 8, 6
+    x = torch.randn(2, H * W, 96)
+    n = H * W // 2
+    with torch.no_grad():
+        ref = attn(x, HW=(H, W), kv_compress=kv_compress)
+
+        # "rank 0" holds the first half of the tokens and gets the K/V of the second one from the other rank
+        other = attn.qkv(x[:, n:]).reshape(2, n, 3, 96)
+        k_other, v_other = attn.k_norm(other[:, :, 1]), other[:, :, 2]
+        def gather(k, v):
+            return torch.cat([k, k_other], dim=1), torch.cat([v, v_other], dim=1)
+        out = attn(x[:, :n], HW=(H, W), kv_compress=kv_compress, kv_gather=gather)
+    assert torch.allclose(out, ref[:, :n], atol=1e-5)
@@ -0,0 +1,47 @@
+import pytest
+import torch
+import torch.nn.functional as F
+
+from extramodels.Sana.models.sana_blocks import LiteLA
+
+def padded_attn_matmul(attn, q, k, v):
+    """
+    The original implementation, everything upcast and v padded with a row of PAD_VAL.
+    """
+    q = attn.kernel_func(q)
+    k = attn.kernel_func(k)
+    q, k, v = q.float(), k.float(), v.float()
+    v = F.pad(v, (0, 0, 0, 1), mode="constant", value=LiteLA.PAD_VAL)
+    vk = torch.matmul(v, k)
+    out = torch.matmul(vk, q)
+    return out[:, :, :-1] / (out[:, :, -1:] + attn.eps)
+
+def inputs(dtype, B=2, h=4, h_d=32, N=1000):
+    g = torch.Generator().manual_seed(0)
+    q, v = (torch.randn(B, h, h_d, N, generator=g).to(dtype) for _ in range(2))
+    k = torch.randn(B, h, N, h_d, generator=g).to(dtype)
+    return q, k, v
+
+@pytest.mark.parametrize("dtype, rtol", [(torch.float32, 1e-5), (torch.bfloat16, 1e-2)])
+@pytest.mark.parametrize("chunk", [None, 256, 300])
+def test_matches_padded(dtype, rtol, chunk):
+    attn = LiteLA(128, 128, dim=32).eval()
+    q, k, v = inputs(dtype)
+    out = attn.attn_matmul(q, k, v, chunk=chunk)
+    ref = padded_attn_matmul(attn, q, k, v)
+    assert out.dtype == dtype
+    # bf16 only differs by the rounding of the output
+    assert torch.allclose(out.float(), ref, rtol=rtol, atol=rtol * ref.abs().max().item())
+
+def test_transposed_inputs():
+    """
+    forward passes q/k/v as reshaped views of the transposed projections.
+    """
+    attn = LiteLA(128, 128, dim=32).eval()
+    x = torch.randn(2, 500, 3 * 128, generator=torch.Generator().manual_seed(1))
+    q, k, v = x.reshape(2, 500, 3, 128).unbind(2)
+    q = q.transpose(-1, -2).reshape(2, 4, 32, 500)
+    k = k.transpose(-1, -2).reshape(2, 4, 32, 500).transpose(-1, -2)
+    v = v.transpose(-1, -2).reshape(2, 4, 32, 500)
+    out = attn.attn_matmul(q, k, v, chunk=128)
+    assert torch.allclose(out, padded_attn_matmul(attn, q, k, v), rtol=1e-5, atol=1e-6)
@@ -0,0 +1,99 @@
+import torch
+
+from extramodels.utils.offload import BlockOffload
+
+class Model(torch.nn.Module):
+    def __init__(self, depth=6):
+        super().__init__()
+        torch.manual_seed(0)
+        self.blocks = torch.nn.ModuleList(torch.nn.Linear(16, 16) for _ in range(depth))
+        self.skip = set()
+
+    def forward(self, x, timesteps=None):
+        for i, block in enumerate(self.blocks):
+            if i not in self.skip:
+                x = x + block(x)
+        return x
+
+def make_offload(model, **kwargs):
+    offload = BlockOffload(model.blocks, "cpu", **kwargs)
+    # what the node's object patches do while the model is loaded
+    for i in offload.managed:
+        model.blocks[i].forward = offload.forward(i, model.blocks[i].forward)
+    return offload
+
+def call(offload, model, x, t=500.0):
+    args = {"input": x, "timestep": torch.tensor([t]), "c": {"transformer_options": {}}, "cond_or_uncond": [0]}
+    return offload(lambda x, t, transformer_options: model(x, t), args)
+
+def test_streamed_output_matches():
+    model = Model()
+    x = torch.randn(2, 16)
+    with torch.no_grad():
+        ref = model(x)
+        offload = make_offload(model, resident=2, prefetch=2)
+        offload.sampling.begin()
+        out = [call(offload, model, x) for _ in range(3)]
+        stats = dict(offload.stats)
+        offload.sampling.end()
+    assert all(torch.equal(o, ref) for o in out)
+    # every step runs on 4 streamed copies, the first one also has to load the 2 it starts with
+    assert stats["blocks"] == 3 * 4 + 2
+    assert not offload.loaded
+
+def test_skipped_blocks_are_dropped():
+    model = Model()
+    x = torch.randn(2, 16)
+    offload = make_offload(model, resident=1, prefetch=2)
+    offload.sampling.begin()
+    # block 3 is prefetched while 2 runs, but skipped (e.g. layer skip / DeepCache)
+    model.skip = {3, 4}
+    with torch.no_grad():
+        call(offload, model, x)
+    # only the first streamed blocks stay, prefetched for the next step
+    assert set(offload.loaded) == offload.next_step()
+    offload.sampling.end()
+    assert not offload.loaded
+
+def test_patched_weights_are_streamed():
+    model = Model()
+    x = torch.randn(2, 16)
+    offload = make_offload(model, resident=2)
+    with torch.no_grad():
+        ref = model(x)
+        original = [block.weight for block in model.blocks]
+        offload.sampling.begin()
+        # the model management patches (e.g. a LoRA) after the sampling hooks ran, replacing the parameters
+        for block in model.blocks:
+            block.weight = torch.nn.Parameter(block.weight + 0.01)
+        patched = model(x)
+        assert not torch.equal(patched, ref)
+        assert torch.equal(call(offload, model, x), patched)
+        offload.sampling.end()
+
+        # and unpatches after the run
+        for block, weight in zip(model.blocks, original):
+            block.weight = weight
+        offload.sampling.begin()
+        assert torch.equal(call(offload, model, x), ref)
+        offload.sampling.end()
+
+def test_no_timestep_readback_when_hooked():
+    model = Model()
+    offload = make_offload(model, resident=0)
+    offload.sampling.begin()
+    class Timesteps:
+        def max(self):
+            raise AssertionError("read the timestep back")
+    args = {"input": torch.randn(2, 16), "timestep": Timesteps(), "c": {"transformer_options": {}}, "cond_or_uncond": [0]}
+    with torch.no_grad():
+        offload(lambda x, t, transformer_options: model(x), args)
+    offload.sampling.end()
+
+def test_unhooked_runs_are_split_on_the_timestep():
+    model = Model()
+    offload = make_offload(model, resident=0)
+    with torch.no_grad():
+        for t in (900.0, 500.0, 100.0, 900.0):
+            call(offload, model, torch.randn(2, 16), t)
+    assert offload.sampling.steps == {(0,): 0}
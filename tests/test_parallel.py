@@ -0,0 +1,65 @@
+import os
+import socket
+import torch
+import torch.multiprocessing as mp
+
+from extramodels.PixArt.models.PixArtMS import PixArtMS
+
+def make_model():
+    torch.manual_seed(0)
+    model = PixArtMS(input_size=64, patch_size=2, in_channels=4, hidden_size=96, depth=4, num_heads=2, caption_channels=96, model_max_length=120)
+    model.dtype = torch.float32
+    return model.eval()
+
+def make_inputs():
+    g = torch.Generator().manual_seed(3)
+    return torch.randn(2, 4, 64, 64, generator=g), torch.randn(2, 1, 120, 96, generator=g)
+
+def sample(model, patch_parallel=None):
+    x, y = make_inputs()
+    transformer_options = {"cond_or_uncond": [0, 1], "sample_sigmas": torch.zeros(4)}
+    if patch_parallel is not None:
+        transformer_options["patch_parallel"] = patch_parallel
+    with torch.no_grad():
+        return [model(x, torch.tensor([t, t]), y, transformer_options=transformer_options) for t in (900.0, 800.0, 700.0)]
+
+def worker(rank, world_size, port, queue):
+    os.environ.update(RANK=str(rank), WORLD_SIZE=str(world_size), MASTER_ADDR="127.0.0.1", MASTER_PORT=str(port), EXTRAMODELS_DIST_BACKEND="gloo")
+    import conftest # spawned processes need the package registered again
+    from extramodels.utils.parallel import PatchParallel, init_process_group, is_parallel
+    # nothing happens on import, the node sets the process group up
+    assert not is_parallel()
+    assert init_process_group() and is_parallel()
+    model = make_model()
+    # without the sampling hooks the steps are told apart by the timestep
+    sync = sample(model, PatchParallel(stale=False))
+    patch_parallel = PatchParallel(stale=True, warmup_steps=1)
+    patch_parallel.sampling.begin()
+    stale = sample(model, patch_parallel)
+    stale_steps = sorted(patch_parallel.stale_steps)
+    patch_parallel.sampling.end()
+    if rank == 0:
+        # compared here, tensors sent back through the queue can outlive the process sharing them
+        ref = sample(model)
+        errors = lambda outs: [float((out - r).norm() / r.norm()) for out, r in zip(outs, ref)]
+        queue.put((errors(sync), errors(stale), stale_steps))
+
+def test_gloo_matches_single_process():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    procs = [ctx.Process(target=worker, args=(rank, 2, port, queue)) for rank in range(2)]
+    for p in procs:
+        p.start()
+    sync, stale, stale_steps = queue.get(timeout=300)
+    for p in procs:
+        p.join(timeout=60)
+        assert p.exitcode == 0
+
+    assert max(sync) < 1e-5
+    # the first step is synchronous, the later ones attend to the other rank's K/V of the step before
+    assert stale_steps == [1, 2]
+    assert stale[0] < 1e-5
+    assert max(stale[1:]) < 0.02
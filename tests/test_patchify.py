@@ -0,0 +1,59 @@
+import pytest
+import torch
+
+from extramodels.PixArt.models.PixArtMS import PatchEmbed as PixArtPatchEmbed
+from extramodels.Sana.models.sana_blocks import PatchEmbed, PatchEmbedMS
+from extramodels.utils.patchify import patchify, unpatchify
+
+def conv_tokens(embed, x):
+    """
+    The conv path the patch embeddings had before.
+    """
+    return embed.norm(embed.proj(x).flatten(2).transpose(1, 2))
+
+def einsum_unpatchify(x, h, w, p, c):
+    """
+    The einsum unpatchify the models had before, for h != w.
+    """
+    x = x.reshape(x.shape[0], h, w, p, p, c)
+    x = torch.einsum("nhwpqc->nchpwq", x)
+    return x.reshape(x.shape[0], c, h * p, w * p)
+
+@pytest.mark.parametrize("p", [1, 2, 4])
+def test_patchify_matches_conv(p):
+    torch.manual_seed(0)
+    proj = torch.nn.Conv2d(8, 32, kernel_size=p, stride=p)
+    x = torch.randn(2, 8, 8 * p, 5 * p)
+    ref = proj(x).flatten(2).transpose(1, 2)
+    out = patchify(x, proj)
+    assert out.is_contiguous()
+    assert torch.allclose(out, ref, atol=1e-5)
+
+def test_patchify_falls_back():
+    x = torch.randn(1, 8, 16, 16)
+    # overlapping, padded or not dividing the input: left to the conv
+    assert patchify(x, torch.nn.Conv2d(8, 32, kernel_size=3, stride=1, padding=1)) is None
+    assert patchify(x, torch.nn.Conv2d(8, 32, kernel_size=2, stride=2, padding=1)) is None
+    assert patchify(torch.randn(1, 8, 15, 16), torch.nn.Conv2d(8, 32, kernel_size=2, stride=2)) is None
+
+@pytest.mark.parametrize("patch_size, kernel_size", [(1, None), (2, None), (1, 3)])
+def test_patch_embed_ms_matches_conv(patch_size, kernel_size):
+    torch.manual_seed(0)
+    embed = PatchEmbedMS(patch_size, 8, 32, kernel_size=kernel_size, norm_layer=torch.nn.LayerNorm)
+    x = torch.randn(2, 8, 12, 20)
+    with torch.no_grad():
+        assert torch.allclose(embed(x), conv_tokens(embed, x), atol=1e-5)
+
+@pytest.mark.parametrize("make", [lambda: PatchEmbed((12, 20), 2, 8, 32), lambda: PixArtPatchEmbed(2, 8, 32)])
+def test_patch_embed_matches_conv(make):
+    torch.manual_seed(0)
+    embed = make()
+    x = torch.randn(2, 8, 12, 20)
+    with torch.no_grad():
+        assert torch.allclose(embed(x), conv_tokens(embed, x), atol=1e-5)
+
+@pytest.mark.parametrize("p", [1, 2])
+def test_unpatchify_matches_einsum(p):
+    h, w, c = 6, 10, 4
+    x = torch.randn(2, h * w, p * p * c)
+    assert torch.equal(unpatchify(x, h, w, p, c), einsum_unpatchify(x, h, w, p, c))
@@ -0,0 +1,51 @@
+import pytest
+import torch
+from types import SimpleNamespace
+
+import comfy.samplers
+from extramodels.utils.progressive import sample_progressive
+
+def euler(model, x, sigmas, extra_args=None, callback=None, disable=None):
+    s_in = x.new_ones([x.shape[0]])
+    for i in range(len(sigmas) - 1):
+        denoised = model(x, sigmas[i] * s_in, **extra_args)
+        if callback is not None:
+            callback({"x": x, "i": i, "sigma": sigmas[i], "sigma_hat": sigmas[i], "denoised": denoised})
+        x = x + (x - denoised) / sigmas[i] * (sigmas[i + 1] - sigmas[i])
+    return x
+
+class Model:
+    """
+    Records every evaluation, the way the sampler's model wrapper gets called.
+    """
+    def __init__(self):
+        self.calls = []
+        model_sampling = SimpleNamespace(noise_scaling=lambda sigma, noise, latent: latent + noise * sigma[:, None, None, None])
+        self.inner_model = SimpleNamespace(model_patcher=SimpleNamespace(get_model_object=lambda name: model_sampling))
+
+    def __call__(self, x, sigma, model_options={}, seed=None):
+        self.calls.append((tuple(x.shape[-2:]), float(sigma[0]), model_options.get("transformer_options", {}).get("resolution_from_latent", False)))
+        return x * 0.5
+
+@pytest.mark.parametrize("switch_percent, switch", [(0.5, 4), (0.125, 1), (0.875, 7)])
+def test_switch_is_part_of_the_step_budget(switch_percent, switch):
+    model = Model()
+    sigmas = torch.linspace(10, 0, 9)
+    steps = []
+    x = torch.randn(1, 4, 16, 24)
+    out = sample_progressive(
+        model, x, sigmas, extra_args={"seed": 0}, callback=lambda d: steps.append(d["i"]),
+        sampler=comfy.samplers.KSAMPLER(euler), scale=0.5, switch_percent=switch_percent,
+    )
+    assert out.shape == x.shape
+    # one evaluation per step, the switch included, and every step reported once
+    assert len(model.calls) == 8
+    assert steps == list(range(8))
+    assert model.calls[:switch] == [((8, 12), float(s), True) for s in sigmas[:switch]]
+    assert model.calls[switch:] == [((16, 24), float(s), False) for s in sigmas[switch:-1]]
+
+def test_no_switch_runs_the_sampler():
+    model = Model()
+    sigmas = torch.linspace(10, 0, 5)
+    sample_progressive(model, torch.randn(1, 4, 16, 16), sigmas, sampler=comfy.samplers.KSAMPLER(euler), switch_percent=0.0)
+    assert [c[0] for c in model.calls] == [(16, 16)] * 4
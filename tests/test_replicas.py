@@ -0,0 +1,45 @@
+import torch
+
+from extramodels.PixArt.models.PixArtMS import PixArtMS
+from extramodels.utils.replicas import ReplicaPool
+
+def make_model():
+    torch.manual_seed(0)
+    model = PixArtMS(input_size=64, patch_size=2, in_channels=4, hidden_size=96, depth=2, num_heads=2, caption_channels=96, model_max_length=120)
+    model.dtype = torch.float32
+    return model.eval()
+
+def run(model, x, y):
+    with torch.no_grad():
+        return model(x, torch.full((x.shape[0],), 500.0), y, transformer_options={"cond_or_uncond": [0, 1]})
+
+def test_cpu_replicas_match_primary():
+    g = torch.Generator().manual_seed(1)
+    x, y = torch.randn(4, 4, 64, 64, generator=g), torch.randn(4, 1, 120, 96, generator=g)
+    primary = make_model()
+    pool = ReplicaPool(primary, [torch.device("cpu")] * 3)
+    pool.sampling_start()
+    assert torch.allclose(run(pool, x, y), run(primary, x, y), atol=1e-5)
+    # more pseudo-devices than cond/uncond chunks, split per row and spread over every replica
+    assert len(pool.replicas) == 3 and pool.replicas[0] is None
+    assert all(rows > 0 for rows in pool.rows)
+    pool.sampling_end()
+
+def test_weights_checked_once_per_run():
+    g = torch.Generator().manual_seed(1)
+    x, y = torch.randn(2, 4, 64, 64, generator=g), torch.randn(2, 1, 120, 96, generator=g)
+    primary = make_model()
+    pool = ReplicaPool(primary, [torch.device("cpu")] * 2)
+    pool.sampling_start()
+    run(pool, x, y)
+
+    # e.g. a LoRA applied on load, picked up by the next run
+    with torch.no_grad():
+        primary.final_layer.linear.bias.add_(1.0)
+    stale = run(pool, x, y)
+    pool.sampling_end()
+    pool.sampling_start()
+    fresh = run(pool, x, y)
+    ref = run(primary, x, y)
+    assert not torch.allclose(stale, ref, atol=1e-3)
+    assert torch.allclose(fresh, ref, atol=1e-5)
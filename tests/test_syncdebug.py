@@ -0,0 +1,93 @@
+import threading
+import pytest
+import torch
+from argparse import Namespace
+
+from extramodels.HunYuanDiT.conf import hydit_args
+from extramodels.HunYuanDiT.models.models import HunYuanDiT
+from extramodels.PixArt.models.PixArtMS import PixArtMS
+from extramodels.Sana.models.sana_multi_scale import SanaMS
+from extramodels.utils.syncdebug import SyncCounter
+
+def test_counts_and_restores_tolist():
+    counter = SyncCounter(count_cpu=True)
+    with counter:
+        torch.arange(3).tolist()
+        torch.ones(2).sum().item()
+        torch.arange(4).nonzero()
+    assert counter.counts == {"tolist": 1, "item": 1, "nonzero": 1}
+    assert "tolist" not in torch.Tensor.__dict__
+
+def test_tolist_restored_on_error():
+    with pytest.raises(ValueError):
+        with SyncCounter(count_cpu=True):
+            raise ValueError()
+    assert "tolist" not in torch.Tensor.__dict__
+
+def test_nested_and_other_threads():
+    outer, inner = SyncCounter(count_cpu=True), SyncCounter(count_cpu=True)
+    with outer:
+        with inner:
+            torch.arange(3).tolist()
+        # other threads aren't counted
+        thread = threading.Thread(target=lambda: torch.arange(3).tolist())
+        thread.start()
+        thread.join()
+        torch.arange(3).tolist()
+    assert inner.counts["tolist"] == 1 and outer.counts["tolist"] == 1
+    assert "tolist" not in torch.Tensor.__dict__
+
+def pixart():
+    model = PixArtMS(input_size=64, patch_size=2, in_channels=4, hidden_size=96, depth=2, num_heads=2, caption_channels=96, model_max_length=120)
+    model.dtype = torch.float32
+    g = torch.Generator().manual_seed(1)
+    return model.eval(), dict(x=torch.randn(2, 4, 64, 64, generator=g), timesteps=torch.full((2,), 500.0), context=torch.randn(2, 1, 120, 96, generator=g))
+
+def sana():
+    model = SanaMS(input_size=32, patch_size=1, in_channels=32, hidden_size=64, depth=2, num_heads=2, caption_channels=96, model_max_length=300, linear_head_dim=32)
+    model.dtype = torch.float32
+    g = torch.Generator().manual_seed(1)
+    context = torch.randn(2, 1, 300, 96, generator=g)
+    context[:, :, 40:] = 0
+    return model.eval(), dict(x=torch.randn(2, 32, 32, 32, generator=g), timesteps=torch.full((2,), 500.0), context=context)
+
+def hydit():
+    args = Namespace(**{**vars(hydit_args), "infer_mode": "torch"})
+    model = HunYuanDiT(args, input_size=(32, 32), depth=2, hidden_size=64, num_heads=2, patch_size=2, log_fn=lambda *a: None)
+    model.dtype = torch.float32
+    g = torch.Generator().manual_seed(1)
+    return model.eval(), dict(
+        x = torch.randn(2, 4, 32, 32, generator=g),
+        timesteps = torch.full((2,), 500.0),
+        context = torch.randn(2, 77, 1024, generator=g),
+        context_mask = torch.ones(2, 77),
+        context_t5 = torch.randn(2, 256, 2048, generator=g),
+        context_t5_mask = torch.ones(2, 256),
+    )
+
+# host syncs of a steady state model call within a sampling run, counted on CPU so a CPU-only runner
+# catches regressions. Sana reads the prompt length back unless the blocks are compiled.
+budgets = [
+    (pixart, {}, {}),
+    (sana, {}, {"tolist": 1}),
+    (sana, {"static_text": True}, {}),
+    (hydit, {"hydit_text_attn": "padding"}, {}),
+    (hydit, {"hydit_text_attn": "masked"}, {}),
+]
+
+@pytest.mark.parametrize("make, transformer_options, budget", budgets)
+def test_model_sync_budget(make, transformer_options, budget):
+    torch.manual_seed(0)
+    model, inputs = make()
+    transformer_options = {**transformer_options, "cond_or_uncond": [0, 1], "uuids": ["cond", "uncond"]}
+    sampling_start, sampling_end = getattr(model, "sampling_start", None), getattr(model, "sampling_end", None)
+    if sampling_start is not None:
+        sampling_start() # what the loader's sampling hooks do
+    with torch.no_grad():
+        model(**inputs, transformer_options=transformer_options) # first call fills the caches
+        counter = SyncCounter(count_cpu=True)
+        with counter:
+            model(**inputs, transformer_options=transformer_options)
+    if sampling_end is not None:
+        sampling_end()
+    assert dict(counter.counts) == budget
@@ -0,0 +1,55 @@
+import pytest
+import torch
+
+from extramodels.PixArt.models.PixArtMS import PixArtMS
+from extramodels.utils.tiled import TiledDiffusion, get_tiles
+
+def make_args(B=2, H=32, W=32):
+    g = torch.Generator().manual_seed(1)
+    x = torch.randn(B, 4, H, W, generator=g)
+    # one value per row, so the rows can be told apart after the tiling
+    c_crossattn = torch.arange(B, dtype=torch.float32)[:, None, None].expand(B, 3, 8)
+    c = {"c_crossattn": c_crossattn, "transformer_options": {"cond_or_uncond": list(range(B))}}
+    return {"input": x, "timestep": torch.full((B,), 500.0), "c": c, "cond_or_uncond": list(range(B))}
+
+def test_single_tile_is_plain_forward():
+    torch.manual_seed(0)
+    model = PixArtMS(input_size=64, patch_size=2, in_channels=4, hidden_size=96, depth=2, num_heads=2, caption_channels=96, model_max_length=120).eval()
+    model.dtype = torch.float32
+    def apply_model(x, t, c_crossattn, transformer_options):
+        return model(x, t, c_crossattn[:, None], transformer_options=transformer_options)
+    args = make_args(H=64, W=64)
+    args["c"]["c_crossattn"] = torch.randn(2, 120, 96, generator=torch.Generator().manual_seed(2))
+    with torch.no_grad():
+        ref = apply_model(args["input"], args["timestep"], **args["c"])
+        assert torch.equal(TiledDiffusion(tile_size=64, overlap=16)(apply_model, args), ref)
+
+@pytest.mark.parametrize("size, tile, overlap", [((40, 56), 16, 8), ((40, 56), 16, 0), ((33, 17), 16, 6), ((64, 24), 32, 16)])
+def test_overlapping_tiles_blend(size, tile, overlap):
+    args = make_args(H=size[0], W=size[1])
+    calls = []
+    def apply_model(x, t, c_crossattn, transformer_options):
+        n = x.shape[0] // 2
+        # every window repeats the batch in order, the same way cond_or_uncond is repeated
+        assert transformer_options["cond_or_uncond"] == [0, 1] * n
+        assert c_crossattn[:, 0, 0].tolist() == [0.0, 1.0] * n
+        assert t.shape == (x.shape[0],)
+        calls.append(n)
+        # pointwise, so the blended windows have to give back the plain result
+        return x * 2 + c_crossattn[:, :1, :1, None]
+    out = TiledDiffusion(tile_size=tile, overlap=overlap, tile_batch=3)(apply_model, args)
+    x = args["input"]
+    tiles = len(get_tiles(size[0], tile, overlap)) * len(get_tiles(size[1], tile, overlap))
+    assert tiles > 1 and sum(calls) == tiles and max(calls) <= 3
+    # a window missing anywhere would divide by a zero weight sum
+    assert torch.isfinite(out).all()
+    assert torch.allclose(out, x * 2 + torch.tensor([0.0, 1.0])[:, None, None, None], atol=1e-5)
+
+@pytest.mark.parametrize("size, tile, overlap", [(40, 16, 8), (33, 16, 6), (16, 16, 4), (100, 32, 0)])
+def test_tiles_cover_everything(size, tile, overlap):
+    covered = torch.zeros(size, dtype=torch.bool)
+    starts = get_tiles(size, tile, overlap)
+    for start in starts:
+        assert (start % 2 == 0 or start == size - tile) and start + min(tile, size) <= size
+        covered[start:start + tile] = True
+    assert covered.all()
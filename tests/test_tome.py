@@ -0,0 +1,41 @@
+import torch
+from argparse import Namespace
+
+from extramodels.HunYuanDiT.conf import hydit_args
+from extramodels.HunYuanDiT.models.models import HunYuanDiT
+from extramodels.utils.tome import TokenMerging, bipartite_soft_matching_2d
+
+def test_merge_unmerge_identical_tokens():
+    x = torch.randn(2, 1, 16).expand(2, 64, 16)
+    merge, unmerge, keep_idx = bipartite_soft_matching_2d(x, 8, 8, 2, 2, r=32)
+    assert merge(x).shape == (2, 32, 16) and len(keep_idx) == 32
+    assert torch.allclose(unmerge(merge(x)), x)
+
+def test_hydit_plan_uses_skip_connection():
+    torch.manual_seed(0)
+    args = Namespace(**{**vars(hydit_args), "infer_mode": "torch"})
+    model = HunYuanDiT(args, input_size=(32, 32), depth=6, hidden_size=64, num_heads=2, patch_size=2, log_fn=lambda *a: None).eval()
+    model.dtype = torch.float32
+
+    planned, skip_outputs = {}, {}
+    class Spy(TokenMerging):
+        def __call__(self, layer, x, hw):
+            planned[layer] = x
+            return super().__call__(layer, x, hw)
+    for layer, block in enumerate(model.blocks):
+        if block.skip_linear is not None:
+            block.skip_linear.register_forward_hook(lambda m, i, o, layer=layer: skip_outputs.__setitem__(layer, o))
+
+    tome = Spy([(0, -1, 0.5)])
+    tome.report = lambda *args: None
+    g = torch.Generator().manual_seed(1)
+    with torch.no_grad():
+        out = model(
+            torch.randn(2, 4, 32, 32, generator=g), torch.full((2,), 500.0),
+            context = torch.randn(2, 77, 1024, generator=g), context_mask = torch.ones(2, 77),
+            context_t5 = torch.randn(2, 256, 2048, generator=g), context_t5_mask = torch.ones(2, 256),
+            transformer_options = {"tome": tome},
+        )
+    assert torch.isfinite(out).all()
+    assert sorted(planned) == list(range(6))
+    assert skip_outputs and all(planned[layer] is skip_outputs[layer] for layer in skip_outputs)
@@ -0,0 +1,332 @@
+#
+# Attention backend registry, every softmax attention of the models goes through `attention`
+#  sdpa / xformers / flash / sliced / math, "auto" (opt-in) benchmarks the usable ones once per shape class
+#
+import os
+import json
+import time
+import torch
+import torch.nn.functional as F
+from comfy import model_management
+from tqdm import tqdm
+
+backends = {} # name -> (fn, supports)
+
+def register_backend(name, supports=None):
+    """
+    Decorator for fn(q, k, v, attn_mask=None, dropout_p=0.0), q/k/v are (B, H, N, D).
+    supports(q, k, v, attn_mask) tells whether the backend can run a call, it's skipped otherwise.
+    """
+    def register(fn):
+        backends[name] = (fn, supports or (lambda q, k, v, attn_mask: True))
+        return fn
+    return register
+
+#
+# sdpa, with the 4GB workaround for Intel Arc GPUs
+#
+sdpa_32b = None
+Q_4GB_LIMIT = 32000000
+"""If q is greater than this, the operation will likely require >4GB VRAM, which will fail on Intel Arc Alchemist GPUs without a workaround."""
+# 2k   = 37 748 736
+# 1024 =  9 437 184
+# 2k model goes very slightly over 4GB
+
+if model_management.xpu_available:
+    import intel_extension_for_pytorch as ipex
+    if not torch.xpu.has_fp64_dtype() and not os.environ.get('IPEX_FORCE_ATTENTION_SLICE', None):
+        from .IPEX.attention import scaled_dot_product_attention_32_bit
+        sdpa_32b = scaled_dot_product_attention_32_bit
+        tqdm.write("Using IPEX 4GB SDPA workaround")
+    else:
+        tqdm.write("No IPEX 4GB workaround")
+
+@register_backend("sdpa")
+def sdpa_attention(q, k, v, attn_mask=None, dropout_p=0.0):
+    if sdpa_32b is not None and (q.element_size() * q.nelement()) > Q_4GB_LIMIT:
+        return sdpa_32b(q, k, v, attn_mask=attn_mask, dropout_p=dropout_p)
+    return F.scaled_dot_product_attention(q, k, v, attn_mask=attn_mask, dropout_p=dropout_p)
+
+#
+# xformers / flash_attn, both take (B, N, H, D)
+#
+xformers = None
+if model_management.xformers_enabled():
+    import xformers
+    import xformers.ops
+
+def xformers_supports(q, k, v, attn_mask):
+    return xformers is not None and model_management.xformers_enabled() and q.is_cuda and attn_mask is None
+
+@register_backend("xformers", xformers_supports)
+def xformers_attention(q, k, v, attn_mask=None, dropout_p=0.0):
+    q, k, v = (t.transpose(1, 2) for t in (q, k, v))
+    return xformers.ops.memory_efficient_attention(q, k, v, p=dropout_p).transpose(1, 2)
+
+try:
+    from flash_attn import flash_attn_func
+except Exception: # missing, or built against another torch
+    flash_attn_func = None
+
+def flash_supports(q, k, v, attn_mask):
+    return (
+        flash_attn_func is not None and q.is_cuda and attn_mask is None and
+        q.dtype in (torch.float16, torch.bfloat16) and q.shape[-1] <= 256 and q.shape[-1] % 8 == 0
+    )
+
+@register_backend("flash", flash_supports)
+def flash_attention(q, k, v, attn_mask=None, dropout_p=0.0):
+    q, k, v = (t.transpose(1, 2) for t in (q, k, v))
+    return flash_attn_func(q, k, v, dropout_p=dropout_p).transpose(1, 2)
+
+#
+# sliced / math, plain torch
+#
+SLICE_BYTES = 512 * 1024**2 # attention scores per slice
+
+def score_bytes(q, k):
+    return q.shape[0] * q.shape[1] * q.shape[2] * k.shape[2] * 4
+
+def sliced_supports(q, k, v, attn_mask):
+    return score_bytes(q, k) > SLICE_BYTES # plain sdpa otherwise
+
+@register_backend("sliced", sliced_supports)
+def sliced_attention(q, k, v, attn_mask=None, dropout_p=0.0):
+    """
+    sdpa over slices of the queries, bounds the score matrix of the math kernels sdpa
+    falls back to (masks, CPU, older GPUs) to SLICE_BYTES.
+    """
+    B, H, N, _ = q.shape
+    chunk = max(1, SLICE_BYTES // (B * H * k.shape[-2] * 4))
+    if N <= chunk:
+        return sdpa_attention(q, k, v, attn_mask=attn_mask, dropout_p=dropout_p)
+    out = q.new_empty((B, H, N, v.shape[-1]))
+    for start in range(0, N, chunk):
+        mask = attn_mask
+        if mask is not None and mask.ndim == 4 and mask.shape[-2] > 1:
+            mask = mask[..., start:start + chunk, :]
+        out[:, :, start:start + chunk] = sdpa_attention(q[:, :, start:start + chunk], k, v, attn_mask=mask, dropout_p=dropout_p)
+    return out
+
+@register_backend("math")
+def math_attention(q, k, v, attn_mask=None, dropout_p=0.0):
+    """
+    Explicit scores with an fp32 softmax, the reference the other backends are checked against.
+    """
+    attn = (q * q.shape[-1] ** -0.5) @ k.transpose(-2, -1)
+    if attn_mask is not None and attn_mask.dtype == torch.bool:
+        attn = attn.masked_fill(~attn_mask, float('-inf'))
+    elif attn_mask is not None:
+        attn = attn + attn_mask
+    attn = attn.softmax(dim=-1, dtype=torch.float32).to(v.dtype)
+    if dropout_p > 0.0:
+        attn = F.dropout(attn, p=dropout_p)
+    return attn @ v
+
+#
+# backend selection
+#
+default_backend = os.environ.get("EXTRAMODELS_ATTENTION", "sdpa") # "auto" only when asked for, it times backends mid-run
+forced = [] # backends picked by the Attention Backend node for the running model calls
+
+def bucket(n):
+    return 1 << max(0, int(n) - 1).bit_length()
+
+def device_name(device):
+    if device.type == "cuda":
+        return torch.cuda.get_device_name(device)
+    if device.type == "xpu":
+        return torch.xpu.get_device_name(device)
+    return device.type
+
+class BackendCache:
+    """
+    Fastest backend per (device, dtype, shape class), picked by timing every usable
+    backend on the first call of the class. Persisted next to the compile cache,
+    keys include the torch version and device name so stale entries are never hit.
+    """
+    repeat = 3
+
+    def __init__(self):
+        self.selected = None
+        self.path = None
+        self.resolved = {} # exact call shape -> backend, skips building the key every call
+
+    def key(self, q, k, attn_mask):
+        B, H, N, D = q.shape
+        mask = "none" if attn_mask is None else ("bool" if attn_mask.dtype == torch.bool else "bias")
+        dtype = str(q.dtype).replace("torch.", "")
+        return f"torch-{torch.__version__}|{device_name(q.device)}|{dtype}|bh{bucket(B * H)}|q{bucket(N)}|k{bucket(k.shape[-2])}|d{D}|{mask}"
+
+    def load(self):
+        from .compiled import get_cache_root
+        self.path = os.path.join(get_cache_root(), "attention_backends.json")
+        self.selected = {}
+        try:
+            with open(self.path) as f:
+                self.selected = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def save(self):
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path + ".tmp", "w") as f:
+                json.dump(self.selected, f, indent=1, sort_keys=True)
+            os.replace(self.path + ".tmp", self.path)
+        except OSError as e:
+            tqdm.write(f"AttentionBackend: couldn't save the backend cache, timing again after a restart ({e})")
+
+    def sync(self, device):
+        if device.type == "cuda":
+            torch.cuda.synchronize(device)
+        elif device.type == "xpu":
+            torch.xpu.synchronize(device)
+
+    def benchmark(self, candidates, q, k, v, attn_mask):
+        timings = {}
+        with torch.no_grad():
+            for name in candidates:
+                fn = backends[name][0]
+                try:
+                    fn(q, k, v, attn_mask=attn_mask) # warmup
+                    self.sync(q.device)
+                    start = time.perf_counter()
+                    for _ in range(self.repeat):
+                        fn(q, k, v, attn_mask=attn_mask)
+                    self.sync(q.device)
+                    timings[name] = time.perf_counter() - start
+                except Exception: # e.g. OOM in the math backend
+                    model_management.soft_empty_cache()
+        return min(timings, key=timings.get) if timings else "sdpa"
+
+    def get(self, q, k, v, attn_mask):
+        if self.selected is None:
+            self.load()
+        key = self.key(q, k, attn_mask)
+        name = self.selected.get(key, None)
+        if name in backends:
+            return name
+        candidates = [n for n, (fn, supports) in backends.items() if supports(q, k, v, attn_mask)]
+        if score_bytes(q, k) > SLICE_BYTES:
+            candidates = [n for n in candidates if n != "math"] # full score matrix, only where it's small
+        name = self.benchmark(candidates, q, k, v, attn_mask) if len(candidates) > 1 else "sdpa"
+        tqdm.write(f"AttentionBackend: using {name} for {key.split('|', 2)[2]}")
+        self.selected[key] = name
+        self.save()
+        return name
+
+    def resolve(self, q, k, v, attn_mask):
+        """
+        `get` memoized per (device, dtype, shapes, mask kind), one dict lookup per call.
+        """
+        mask = None if attn_mask is None else attn_mask.dtype == torch.bool
+        key = (q.device, q.dtype, q.shape, k.shape[-2], mask)
+        name = self.resolved.get(key, None)
+        if name is None:
+            name = self.resolved[key] = self.get(q, k, v, attn_mask)
+        return name
+
+backend_cache = BackendCache()
+
+def attention(q, k, v, attn_mask=None, dropout_p=0.0, backend=None):
+    """
+    Softmax attention through the selected backend, scaled by 1/sqrt(D).
+    q/k/v: (B, H, N, D), the output has the same layout but may be a transposed view.
+    attn_mask: broadcastable to (B, H, Nq, Nk), bool (True attends) or an additive bias.
+    backend: the layer's own preference, the Attention Backend node still overrides it.
+    """
+    name = forced[-1] if forced else (backend or default_backend)
+    if name == "auto" and (dropout_p > 0.0 or torch.compiler.is_compiling()):
+        name = "sdpa" # training, or traced where inductor lowers sdpa itself
+    elif name == "auto":
+        name = backend_cache.resolve(q, k, v, attn_mask)
+    elif name not in backends:
+        raise ValueError(f"Unknown attention backend '{name}', expected auto or one of {', '.join(backends)}")
+    fn, supports = backends[name]
+    if not supports(q, k, v, attn_mask):
+        fn = backends["sdpa"][0]
+    return fn(q, k, v, attn_mask=attn_mask, dropout_p=dropout_p)
+
+def unpack_kv(k, v, lens, batch):
+    """
+    Text K/V packed as (1, sum(lens), H, D) to (B, H, L, D) per image row, plus the
+    (B, 1, 1, L) key padding mask. Only a view and no mask when every row has the
+    same length, lens=None means every row attends to all of the packed tokens.
+    A (B,) lens tensor means the rows are padded to the same length and only masked,
+    the shapes don't depend on the prompt and nothing is read back (compiled blocks).
+    """
+    _, total, H, D = k.shape
+    if lens is None:
+        k, v = (t.expand(batch, total, H, D) for t in (k, v))
+        return k.transpose(1, 2), v.transpose(1, 2), None
+    if torch.is_tensor(lens):
+        L = total // batch
+        k, v = (t.view(batch, L, H, D) for t in (k, v))
+        # rows without tokens keep the first one, a fully masked row would softmax to NaN
+        lens = lens.to(k.device).clamp(min=1)
+        mask = torch.arange(L, device=k.device)[None] < lens[:, None]
+        return k.transpose(1, 2), v.transpose(1, 2), mask[:, None, None]
+    L = max(lens)
+    if all(n == L for n in lens):
+        k, v = (t.view(batch, L, H, D) for t in (k, v))
+        return k.transpose(1, 2), v.transpose(1, 2), None
+    kp = k.new_zeros((batch, L, H, D))
+    vp = v.new_zeros((batch, L, H, D))
+    mask = torch.zeros((batch, 1, 1, L), dtype=torch.bool, device=k.device)
+    start = 0
+    for i, n in enumerate(lens):
+        kp[i, :n] = k[0, start:start + n]
+        vp[i, :n] = v[0, start:start + n]
+        mask[i, ..., :n] = True
+        start += n
+    return kp.transpose(1, 2), vp.transpose(1, 2), mask
+
+class AttentionBackend:
+    """
+    Model function wrapper that runs every attention call of the model with one backend.
+    """
+    def __init__(self, backend, wrapper=None):
+        self.backend = backend
+        self.wrapper = wrapper # previous model function wrapper, if any
+
+    def __call__(self, apply_model, args):
+        forced.append(self.backend)
+        try:
+            if self.wrapper is not None:
+                return self.wrapper(apply_model, args)
+            return apply_model(args["input"], args["timestep"], **args["c"])
+        finally:
+            forced.pop()
+
+class AttentionBackendNode:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "backend": (["auto"] + list(backends.keys()),),
+            }
+        }
+
+    RETURN_TYPES = ("MODEL",)
+    FUNCTION = "patch"
+    CATEGORY = "other"
+    TITLE = "Attention Backend"
+
+    def patch(self, model, backend):
+        """
+        backend: auto times the usable backends once per device/dtype/shape and remembers the fastest.
+        Backends that can't run a call (masks, dtypes, devices) fall back to sdpa.
+        EXTRAMODELS_ATTENTION sets the default for models without this node and the VAEs, sdpa unless set.
+        """
+        m = model.clone()
+        m.set_model_unet_function_wrapper(AttentionBackend(
+            backend = backend,
+            wrapper = m.model_options.get("model_function_wrapper", None),
+        ))
+        return (m,)
+
+NODE_CLASS_MAPPINGS = {
+    "AttentionBackend": AttentionBackendNode,
+}
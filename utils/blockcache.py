@@ -0,0 +1,119 @@
+#
+# First block cache for the PixArt/Sana style DiTs
+#
+from tqdm import tqdm
+from .sampling import SamplingRun, HostFlag
+
+class FirstBlockCache:
+    """
+    Residual-difference block cache (First-Block-Cache/TeaCache style).
+    The first block always runs. If its residual barely changed since the last
+    fully computed step, the cached residual of the remaining blocks is added
+    instead of running them.
+
+    Lives in transformer_options["block_cache"], models that support it call
+    `bind(timesteps, transformer_options)` once per forward pass and then the
+    returned function with their first block and remaining blocks.
+
+    The comparison stays on the device. Each step predicts whether the next one
+    may be skipped (change since the last computed step plus this step's change)
+    and copies that flag to the host without waiting for it. A flag that isn't
+    ready by the next step counts as "run the blocks".
+    """
+    def __init__(self, threshold=0.1, max_skips=3):
+        self.threshold = threshold
+        self.max_skips = max_skips
+        self.sampling = SamplingRun(reset=self.reset, report=self.report) # hooked by FirstBlockCacheNode
+
+    def __deepcopy__(self, memo):
+        # the sampling hooks of cloned model patchers still point at this one, it's reset for every run anyway
+        return self
+
+    def reset(self):
+        self.states = {}
+        self.skipped = set()
+
+    def report(self):
+        if not self.sampling.steps:
+            return
+        steps = sorted(self.skipped)
+        tqdm.write(f"FirstBlockCache: skipped {len(steps)}/{self.sampling.step_count} steps {steps}")
+
+    def bind(self, timesteps, transformer_options):
+        # steps are counted separately for cond/uncond in case they aren't batched
+        key = (tuple(transformer_options.get("cond_or_uncond", [])), transformer_options.get("tile_batch", None))
+        step = self.sampling.step(timesteps, transformer_options, key=key)
+        def run(x, first, rest):
+            return self.run(key, step, x, first, rest)
+        return run
+
+    def run(self, key, step, x, first, rest):
+        """
+        first: runs the first block
+        rest: runs every block after it
+        """
+        h = first(x)
+        first_residual = h - x
+
+        state = self.states.get(key, None)
+        if state is not None and state["first"].shape != first_residual.shape:
+            state = None
+
+        if state is not None and state["skips"] < self.max_skips and state["close"].get():
+            state["skips"] += 1
+            self.skipped.add(step)
+            out = h + state["residual"]
+        else:
+            out = rest(h)
+            self.states[key] = state = {
+                "first": first_residual,
+                "residual": out - h,
+                "skips": 0,
+                "last": state["last"] if state is not None else None,
+                "close": state["close"] if state is not None else HostFlag(),
+            }
+        self.predict(state, first_residual)
+        self.sampling.last(step)
+        return out
+
+    def predict(self, state, first_residual):
+        """
+        Flags whether the next step may reuse the residual, without a host sync.
+        """
+        last, state["last"] = state["last"], first_residual
+        if last is None:
+            state["close"].clear()
+            return
+        ref = state["first"]
+        change = (first_residual - ref).abs().mean() + (first_residual - last).abs().mean()
+        state["close"].set(change < self.threshold * ref.abs().mean())
+
+class FirstBlockCacheNode:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "threshold": ("FLOAT", {"default": 0.1, "min": 0.0, "max": 1.0, "step": 0.005, "tooltip": "Relative change of the first block's residual below which the other blocks are skipped. The default is untuned, tune it per model and step count."}),
+                "max_consecutive_skips": ("INT", {"default": 3, "min": 1, "max": 100}),
+            }
+        }
+
+    RETURN_TYPES = ("MODEL",)
+    FUNCTION = "patch"
+    CATEGORY = "other"
+    TITLE = "First Block Cache (PixArt/Sana)"
+
+    def patch(self, model, threshold, max_consecutive_skips):
+        m = model.clone()
+        cache = FirstBlockCache(
+            threshold = threshold,
+            max_skips = max_consecutive_skips,
+        )
+        cache.sampling.hook(m, "block_cache")
+        m.model_options["transformer_options"]["block_cache"] = cache
+        return (m,)
+
+NODE_CLASS_MAPPINGS = {
+    "FirstBlockCache": FirstBlockCacheNode,
+}
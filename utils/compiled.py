@@ -0,0 +1,251 @@
+#
+# torch.compile for the DiT block stacks, one static graph per resolution bucket
+#
+import os
+import shutil
+import time
+import torch
+from tqdm import tqdm
+
+from ..PixArt.conf import pixart_res
+from ..Sana.conf import sana_res
+
+resolution_tables = {**pixart_res, **sana_res}
+
+def get_buckets(table, downscale=8):
+    """
+    Latent (h, w) of every entry of a resolution table, values are [height, width] in pixels.
+    """
+    return set((h // downscale, w // downscale) for h, w in resolution_tables[table].values())
+
+def get_cache_root():
+    """
+    EXTRAMODELS_COMPILE_CACHE, else the ComfyUI user directory, else the user cache
+    directory (outside ComfyUI, e.g. tests). Never inside the package itself.
+    """
+    root = os.environ.get("EXTRAMODELS_COMPILE_CACHE", None)
+    if root is None:
+        try:
+            import folder_paths
+            root = os.path.join(folder_paths.get_user_directory(), "extramodels_compile_cache")
+        except (ImportError, AttributeError):
+            cache = os.environ.get("XDG_CACHE_HOME", None) or os.path.join(os.path.expanduser("~"), ".cache")
+            root = os.path.join(cache, "extramodels_compile_cache")
+    return root
+
+class CompileCache:
+    """
+    Persists the torch.compile artifacts (inductor/autotune caches) across restarts.
+    torch only exports everything compiled by the process at once, so every process
+    keeps a single file that it rewrites after each new compile, the newest `max_files`
+    are kept. Files live in a per torch version folder, folders of other torch
+    versions are removed. Only used by the compile node, nothing happens on load.
+    """
+    loaded = set() # files loaded by this process
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.bin" # file of this process
+
+    def __init__(self, root=None, max_files=8):
+        self.root = root or get_cache_root()
+        self.path = os.path.join(self.root, f"torch-{torch.__version__}")
+        self.max_files = max_files
+        self.supported = hasattr(torch.compiler, "save_cache_artifacts")
+
+    def use_inductor_dir(self):
+        """
+        The default inductor cache lives in /tmp, move it next to the artifacts unless the
+        user picked one. Covers the compiled kernels the artifacts don't include (e.g. CPU).
+        """
+        try:
+            from torch._inductor.runtime.cache_dir_utils import default_cache_dir
+        except ImportError:
+            return
+        current = os.environ.get("TORCHINDUCTOR_CACHE_DIR", None)
+        if current is None or os.path.abspath(current) == os.path.abspath(default_cache_dir()):
+            os.environ["TORCHINDUCTOR_CACHE_DIR"] = os.path.join(self.path, "inductor")
+
+    def files(self):
+        if not os.path.isdir(self.path):
+            return []
+        paths = [os.path.join(self.path, name) for name in os.listdir(self.path) if name.endswith(".bin")]
+        return sorted(paths, key=lambda path: (os.stat(path).st_mtime_ns, path)) # oldest first
+
+    def prune(self):
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith("torch-") and path != self.path and os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+        own = os.path.join(self.path, self.name)
+        for path in [f for f in self.files() if f != own][:-self.max_files]:
+            os.remove(path)
+
+    def load(self):
+        """
+        Sets up the cache folders and loads the files of earlier processes, once per process.
+        """
+        self.use_inductor_dir()
+        if not self.supported:
+            return 0
+        self.prune()
+        count = 0
+        for path in self.files():
+            if path in self.loaded:
+                continue
+            with open(path, "rb") as f:
+                torch.compiler.load_cache_artifacts(f.read())
+            self.loaded.add(path)
+            count += 1
+        if count:
+            tqdm.write(f"CompileCache: loaded {count} compiled artifact file(s) from {self.path}")
+        return count
+
+    def save(self):
+        if not self.supported:
+            return
+        artifacts = torch.compiler.save_cache_artifacts()
+        if artifacts is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        path = os.path.join(self.path, self.name)
+        with open(path + ".tmp", "wb") as f:
+            f.write(artifacts[0])
+        os.replace(path + ".tmp", path)
+        self.loaded.add(path)
+
+class CompiledBlocks:
+    """
+    Model function wrapper for the blocks in `model.blocks`, their forwards are replaced
+    by dispatchers (object patches of the cloned model, see `forwards`).
+    Latents whose size is in `buckets` run the torch.compile'd block, each bucket
+    gets its own static graph the first time it's seen. Any other size runs the
+    eager block, so odd resolutions never cause recompiles. buckets=None compiles
+    everything, with dynamic=True that's a single shape-generic graph.
+    Compiled calls get `static_text` in the transformer options, the models then keep
+    the text padded to its full length and mask it with a device tensor, so a new
+    prompt length doesn't change any shape or guarded value.
+    """
+    def __init__(self, buckets=None, mode="default", backend="inductor", dynamic=False, cache=None, wrapper=None):
+        self.buckets = buckets
+        self.wrapper = wrapper # previous model function wrapper, if any
+        self.cache = cache # CompileCache, saved after the first pass of every new bucket
+        self.save_key = None
+        self.mode = mode
+        self.backend = backend
+        self.dynamic = dynamic
+        self.active = False
+        self.seen = set()
+        self.depth = 0
+
+    def forwards(self, model):
+        """
+        {index: dispatcher} for the blocks of `model`, installed as object patches so only
+        this clone runs them. Each one wraps the block's own forward, never the patch of an
+        earlier compile node.
+        """
+        self.depth = len(model.blocks)
+        out = {}
+        for i, block in enumerate(model.blocks):
+            eager = type(block).forward.__get__(block)
+            compiled = torch.compile(eager, mode=self.mode, backend=self.backend, dynamic=self.dynamic)
+            def forward(*args, eager=eager, compiled=compiled, **kwargs):
+                if self.active:
+                    return compiled(*args, **kwargs)
+                return eager(*args, **kwargs)
+            out[i] = forward
+
+        # the blocks share their code object, every block/bucket/batch size is a cache entry
+        entries = self.depth * (len(self.buckets) if self.buckets else 8) * 4
+        torch._dynamo.config.cache_size_limit = max(torch._dynamo.config.cache_size_limit, entries)
+        if hasattr(torch._dynamo.config, "accumulated_cache_size_limit"):
+            torch._dynamo.config.accumulated_cache_size_limit = max(torch._dynamo.config.accumulated_cache_size_limit, entries)
+        return out
+
+    def __call__(self, apply_model, args):
+        x = args["input"]
+        key = (tuple(x.shape[-2:]), x.shape[0])
+        self.active = self.buckets is None or key[0] in self.buckets
+        save = False
+        if self.active:
+            if key not in self.seen:
+                if not self.seen and self.cache is not None:
+                    self.load_cache()
+                self.seen.add(key)
+                save = True
+                if not self.dynamic or len(self.seen) == 1:
+                    tqdm.write(f"CompiledBlocks: compiling {self.depth} blocks for {key[0][0]}x{key[0][1]} latent, batch {key[1]}")
+            c = args["c"]
+            transformer_options = {**c.get("transformer_options", {}), "static_text": True}
+            args = {**args, "c": {**c, "transformer_options": transformer_options}}
+        try:
+            if self.wrapper is not None:
+                out = self.wrapper(apply_model, args)
+            else:
+                out = apply_model(args["input"], args["timestep"], **args["c"])
+        finally:
+            self.active = False
+        if save and self.cache is not None:
+            self.save_cache()
+        return out
+
+    def load_cache(self):
+        try:
+            self.cache.load()
+        except Exception as e:
+            tqdm.write(f"CompileCache: couldn't load the saved artifacts, compiling from scratch ({e})")
+
+    def save_cache(self):
+        try:
+            self.cache.save()
+        except Exception as e:
+            tqdm.write(f"CompileCache: couldn't save the compiled artifacts, the next restart compiles again ({e})")
+
+class CompileBlocksNode:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "buckets": (["all sizes"] + list(resolution_tables.keys()),),
+                "mode": (["default", "reduce-overhead", "max-autotune", "max-autotune-no-cudagraphs"],),
+                "dynamic": ("BOOLEAN", {"default": False}),
+                "persistent_cache": ("BOOLEAN", {"default": True}),
+            }
+        }
+
+    RETURN_TYPES = ("MODEL",)
+    FUNCTION = "patch"
+    CATEGORY = "other"
+    TITLE = "Compile Blocks (torch.compile)"
+
+    def patch(self, model, buckets, mode, dynamic, persistent_cache):
+        """
+        buckets: resolution table whose sizes get compiled graphs, other sizes run eagerly.
+        dynamic: one shape-generic graph instead of one static graph per size.
+        persistent_cache: keep the compiled artifacts across restarts (EXTRAMODELS_COMPILE_CACHE to relocate).
+        """
+        m = model.clone()
+        diffusion_model = m.get_model_object("diffusion_model")
+        wrapper = m.model_options.get("model_function_wrapper", None)
+        if isinstance(wrapper, CompiledBlocks):
+            wrapper = wrapper.wrapper # compiling again replaces the previous settings
+        if buckets != "all sizes":
+            downscale = getattr(model.get_model_object("latent_format"), "spacial_downscale_ratio", 8)
+            buckets = get_buckets(buckets, downscale)
+        else:
+            buckets = None
+        compiled = CompiledBlocks(
+            buckets = buckets,
+            mode = mode,
+            dynamic = dynamic,
+            cache = CompileCache() if persistent_cache else None,
+            wrapper = wrapper,
+        )
+        for i, forward in compiled.forwards(diffusion_model).items():
+            m.add_object_patch(f"diffusion_model.blocks.{i}.forward", forward)
+        m.set_model_unet_function_wrapper(compiled)
+        return (m,)
+
+NODE_CLASS_MAPPINGS = {
+    "CompileBlocks": CompileBlocksNode,
+}
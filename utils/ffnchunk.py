@@ -0,0 +1,49 @@
+#
+# Feed-forward chunking, bounds the (B, N, mlp_ratio * C) intermediate at high resolutions
+#
+import torch
+
+def chunked_ffn(ffn, x, chunk=None):
+    """
+    ffn(x) over sequence chunks of `chunk` tokens. Only for token-wise FFNs (Mlp),
+    each token gives the same result as in the full pass.
+    x: (B, N, C)
+    """
+    B, N, _ = x.shape
+    if not chunk or N <= chunk:
+        return ffn(x)
+    out = None
+    for start in range(0, N, chunk):
+        y = ffn(x[:, start:start + chunk])
+        if out is None:
+            out = y.new_empty((B, N, y.shape[-1]))
+        out[:, start:start + chunk] = y
+    return out
+
+class FFNChunkNode:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "chunk_tokens": ("INT", {"default": 4096, "min": 256, "max": 262144, "step": 256}),
+            }
+        }
+
+    RETURN_TYPES = ("MODEL",)
+    FUNCTION = "patch"
+    CATEGORY = "other"
+    TITLE = "FFN Chunking (high-res memory)"
+
+    def patch(self, model, chunk_tokens):
+        """
+        chunk_tokens: tokens per FFN pass, Sana's GLUMBConv runs over bands of chunk_tokens // width image rows.
+        PixArt, Sana and HunYuanDiT only.
+        """
+        m = model.clone()
+        m.model_options["transformer_options"]["ffn_chunk"] = chunk_tokens
+        return (m,)
+
+NODE_CLASS_MAPPINGS = {
+    "FFNChunk": FFNChunkNode,
+}
@@ -0,0 +1,67 @@
+#
+# Fused adaLN-single helpers for the PixArt/Sana blocks
+#  LayerNorm + t2i_modulate in one pass, gated residual add without the gate * y temporary
+#
+import os
+import torch
+import torch.nn.functional as F
+
+try:
+    import triton
+    import triton.language as tl
+except ImportError:
+    triton = None
+
+use_triton = triton is not None and os.environ.get("EXTRAMODELS_NO_TRITON", "0") != "1"
+
+if triton is not None:
+    @triton.jit
+    def _norm_modulate_kernel(X, SHIFT, SCALE, Y, N, C, stride_mod, eps, BLOCK_C: tl.constexpr):
+        row = tl.program_id(0)
+        b = row // N
+        cols = tl.arange(0, BLOCK_C)
+        mask = cols < C
+        x = tl.load(X + row * C + cols, mask=mask, other=0.0).to(tl.float32)
+        mean = tl.sum(x, axis=0) / C
+        xc = tl.where(mask, x - mean, 0.0)
+        rstd = 1.0 / tl.sqrt(tl.sum(xc * xc, axis=0) / C + eps)
+        shift = tl.load(SHIFT + b * stride_mod + cols, mask=mask, other=0.0).to(tl.float32)
+        scale = tl.load(SCALE + b * stride_mod + cols, mask=mask, other=0.0).to(tl.float32)
+        y = xc * rstd * (1.0 + scale) + shift
+        tl.store(Y + row * C + cols, y.to(Y.dtype.element_ty), mask=mask)
+
+    def norm_modulate_triton(x, shift, scale, eps):
+        B, N, C = x.shape
+        x = x.contiguous()
+        shift = shift.to(x.dtype).reshape(B, C).contiguous()
+        scale = scale.to(x.dtype).reshape(B, C).contiguous()
+        y = torch.empty_like(x)
+        _norm_modulate_kernel[(B * N,)](x, shift, scale, y, N, C, C, eps, BLOCK_C=triton.next_power_of_2(C))
+        return y
+
+def norm_modulate_torch(x, norm, shift, scale):
+    return torch.addcmul(shift, F.layer_norm(x, norm.normalized_shape, norm.weight, norm.bias, norm.eps), 1 + scale)
+
+def norm_modulate(x, norm, shift, scale):
+    """
+    t2i_modulate(norm(x), shift, scale) for a nn.LayerNorm over the last dim.
+    x: (B, N, C), shift/scale: (B, 1, C)
+    One read and one write of x with the triton kernel, the torch fallback still
+    saves the x * (1 + scale) temporary. Under torch.compile inductor fuses it itself.
+    The kernel has no affine weights, norms with elementwise_affine use the fallback.
+    """
+    if (
+        use_triton and x.is_cuda and norm.weight is None and norm.bias is None and
+        not torch.compiler.is_compiling() and not torch.is_grad_enabled()
+    ):
+        return norm_modulate_triton(x, shift, scale, norm.eps)
+    return norm_modulate_torch(x, norm, shift, scale)
+
+def gated_residual(x, gate, y, inplace=False):
+    """
+    x + gate * y without the gate * y temporary.
+    inplace: reuse x for the output, only for block-local x that nothing else holds on to.
+    """
+    if inplace and not torch.is_grad_enabled() and x.dtype == gate.dtype == y.dtype:
+        return x.addcmul_(gate, y)
+    return torch.addcmul(x, gate, y)
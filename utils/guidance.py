@@ -0,0 +1,152 @@
+#
+# Adaptive guidance truncation, stops running the uncond branch late in sampling
+#
+import torch
+from tqdm import tqdm
+from .sampling import SamplingRun, HostFlag
+
+def slice_rows(v, rows, batch):
+    """
+    Slices the batch dim of the tensors in a cond, including nested ones like `control`.
+    """
+    if torch.is_tensor(v):
+        return v[rows] if v.ndim > 0 and v.shape[0] == batch else v
+    if isinstance(v, dict):
+        return {k: slice_rows(x, rows, batch) for k, x in v.items()}
+    if isinstance(v, (list, tuple)):
+        return type(v)(slice_rows(x, rows, batch) for x in v)
+    return v
+
+class GuidanceTruncation:
+    """
+    Model function wrapper. Once the sampler is past `sigma_end`, or the cond/uncond
+    predictions got more similar than `threshold`, only the cond rows of the batch
+    are evaluated. The uncond rows are filled in from the cond prediction, either
+    as-is (plain conditional prediction after CFG) or minus the last guidance delta,
+    which keeps extrapolating with that delta.
+    Only applies when cond and uncond are batched together.
+
+    Both checks run on the device and are read back on the next model call (see
+    HostFlag), so the uncond branch stops one call after they first pass.
+    """
+    def __init__(self, sigma_end, threshold=1.0, extrapolate=True, wrapper=None):
+        self.sigma_end = sigma_end
+        self.threshold = threshold
+        self.extrapolate = extrapolate
+        self.wrapper = wrapper # previous model function wrapper, if any
+        self.sampling = SamplingRun(reset=self.reset, report=self.report) # hooked by GuidanceTruncationNode
+
+    def __deepcopy__(self, memo):
+        # the sampling hooks of cloned model patchers still point at this one, it's reset for every run anyway
+        return self
+
+    def reset(self):
+        self.step = -1
+        self.truncated = False
+        self.stop = HostFlag()
+        self.delta = None
+        self.log = []
+
+    def report(self):
+        if not self.log:
+            return
+        full = [step for step, mode, _ in self.log if mode == "cfg"]
+        cond = [step for step, mode, _ in self.log if mode != "cfg"]
+        # the similarities stayed on the device until now
+        text = ", ".join(f"{step}:{mode}" + (f"({float(cos):.4f})" if cos is not None else "") for step, mode, cos in self.log)
+        tqdm.write(f"GuidanceTruncation: {len(full)} full / {len(cond)} cond-only steps [{text}]")
+
+    def log_step(self, mode, cos=None):
+        self.log.append((self.step, mode, cos))
+        self.sampling.last(self.step)
+
+    def apply_model(self, apply_model, args):
+        if self.wrapper is not None:
+            return self.wrapper(apply_model, args)
+        return apply_model(args["input"], args["timestep"], **args["c"])
+
+    def __call__(self, apply_model, args):
+        x, sigma, c = args["input"], args["timestep"], args["c"]
+        cond_or_uncond = args["cond_or_uncond"]
+        if cond_or_uncond.count(0) != 1 or cond_or_uncond.count(1) != 1:
+            return self.apply_model(apply_model, args)
+
+        self.step = self.sampling.step(sigma, c.get("transformer_options", {}))
+        chunk = x.shape[0] // len(cond_or_uncond)
+        cond_rows = slice(cond_or_uncond.index(0) * chunk, (cond_or_uncond.index(0) + 1) * chunk)
+        uncond_rows = slice(cond_or_uncond.index(1) * chunk, (cond_or_uncond.index(1) + 1) * chunk)
+
+        if not self.truncated and not self.stop.get():
+            out = self.apply_model(apply_model, args)
+            cond, uncond = out[cond_rows], out[uncond_rows]
+            self.delta = cond - uncond
+            cos = torch.nn.functional.cosine_similarity(cond.flatten(1), uncond.flatten(1), dim=1).min()
+            self.stop.set((sigma.max() <= self.sigma_end) | (cos >= self.threshold))
+            self.log_step("cfg", cos)
+            return out
+
+        self.truncated = True
+        c_cond = {}
+        for k, v in c.items():
+            if k == "transformer_options":
+                v = {**v, "cond_or_uncond": [0]}
+            else:
+                v = slice_rows(v, cond_rows, x.shape[0])
+            c_cond[k] = v
+        cond = self.apply_model(apply_model, {
+            **args,
+            "input": x[cond_rows],
+            "timestep": sigma[cond_rows],
+            "c": c_cond,
+            "cond_or_uncond": [0],
+        })
+
+        out = torch.empty((x.shape[0], *cond.shape[1:]), dtype=cond.dtype, device=cond.device)
+        out[cond_rows] = cond
+        if self.extrapolate and self.delta is not None and self.delta.shape == cond.shape:
+            out[uncond_rows] = cond - self.delta.to(cond)
+            self.log_step("extrapolated")
+        else:
+            out[uncond_rows] = cond
+            self.log_step("cond")
+        return out
+
+class GuidanceTruncationNode:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "end_percent": ("FLOAT", {"default": 0.7, "min": 0.0, "max": 1.0, "step": 0.01}),
+                "cos_threshold": ("FLOAT", {"default": 1.0, "min": 0.0, "max": 1.0, "step": 0.0001}),
+                "extrapolate": ("BOOLEAN", {"default": True}),
+            }
+        }
+
+    RETURN_TYPES = ("MODEL",)
+    FUNCTION = "patch"
+    CATEGORY = "other"
+    TITLE = "Adaptive Guidance Truncation"
+
+    def patch(self, model, end_percent, cos_threshold, extrapolate):
+        """
+        end_percent: stop running uncond past this point of the schedule (1.0 to never stop).
+        cos_threshold: also stop once cond/uncond cosine similarity reaches this (1.0 to disable).
+        """
+        m = model.clone()
+        sigma_end = -1.0
+        if end_percent < 1.0:
+            sigma_end = m.get_model_object("model_sampling").percent_to_sigma(end_percent)
+        truncation = GuidanceTruncation(
+            sigma_end = sigma_end,
+            threshold = cos_threshold if cos_threshold < 1.0 else float("inf"),
+            extrapolate = extrapolate,
+            wrapper = m.model_options.get("model_function_wrapper", None),
+        )
+        truncation.sampling.hook(m, "guidance_truncation")
+        m.set_model_unet_function_wrapper(truncation)
+        return (m,)
+
+NODE_CLASS_MAPPINGS = {
+    "GuidanceTruncation": GuidanceTruncationNode,
+}
@@ -0,0 +1,66 @@
+#
+# Layer skip draft mode, runs a subset of the transformer blocks for previews
+#
+from tqdm import tqdm
+
+class LayerSkip:
+    """
+    Lives in transformer_options["layer_skip"]. Models call it with the block
+    index and their depth, blocks it returns True for are skipped and the
+    residual stream is passed through unchanged.
+    """
+    def __init__(self, start_block=2, end_block=-2, keep_every=2):
+        self.start_block = start_block
+        self.end_block = end_block
+        self.keep_every = keep_every
+
+    def __call__(self, layer, depth):
+        end = self.end_block if self.end_block > 0 else depth + self.end_block
+        if layer < self.start_block or layer >= end:
+            return False
+        return (layer - self.start_block) % self.keep_every != 0
+
+    def budget(self, depth):
+        """
+        Number of blocks that still run out of `depth`.
+        """
+        return sum(not self(layer, depth) for layer in range(depth))
+
+class LayerSkipNode:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "start_block": ("INT", {"default": 2, "min": 0, "max": 100}),
+                "end_block": ("INT", {"default": -2, "min": -100, "max": 100}),
+                "keep_every": ("INT", {"default": 2, "min": 1, "max": 100}),
+            }
+        }
+
+    RETURN_TYPES = ("MODEL",)
+    FUNCTION = "patch"
+    CATEGORY = "other"
+    TITLE = "Layer Skip Draft Mode (DiT/PixArt/Sana/HunyuanDiT)"
+
+    def patch(self, model, start_block, end_block, keep_every):
+        """
+        Only every keep_every-th block in [start_block, end_block) runs, the rest are skipped.
+        end_block <= 0 counts from the last block. Only affects this model clone,
+        the weights stay shared with the full quality model.
+        """
+        m = model.clone()
+        layer_skip = LayerSkip(
+            start_block = start_block,
+            end_block = end_block,
+            keep_every = keep_every,
+        )
+        blocks = getattr(m.get_model_object("diffusion_model"), "blocks", None)
+        if blocks is not None:
+            tqdm.write(f"LayerSkip: running {layer_skip.budget(len(blocks))}/{len(blocks)} blocks")
+        m.model_options["transformer_options"]["layer_skip"] = layer_skip
+        return (m,)
+
+NODE_CLASS_MAPPINGS = {
+    "LayerSkip": LayerSkipNode,
+}
@@ -3,6 +3,42 @@ NODE_CLASS_MAPPINGS = {}
 from .offload import NODE_CLASS_MAPPINGS as Offload_Nodes
 NODE_CLASS_MAPPINGS.update(Offload_Nodes)
 
+from .blockcache import NODE_CLASS_MAPPINGS as BlockCache_Nodes
+NODE_CLASS_MAPPINGS.update(BlockCache_Nodes)
+
+from .tome import NODE_CLASS_MAPPINGS as ToMe_Nodes
+NODE_CLASS_MAPPINGS.update(ToMe_Nodes)
+
+from .guidance import NODE_CLASS_MAPPINGS as Guidance_Nodes
+NODE_CLASS_MAPPINGS.update(Guidance_Nodes)
+
+from .progressive import NODE_CLASS_MAPPINGS as Progressive_Nodes
+NODE_CLASS_MAPPINGS.update(Progressive_Nodes)
+
+from .layerskip import NODE_CLASS_MAPPINGS as LayerSkip_Nodes
+NODE_CLASS_MAPPINGS.update(LayerSkip_Nodes)
+
+from .tiled import NODE_CLASS_MAPPINGS as Tiled_Nodes
+NODE_CLASS_MAPPINGS.update(Tiled_Nodes)
+
+from .parallel import NODE_CLASS_MAPPINGS as Parallel_Nodes
+NODE_CLASS_MAPPINGS.update(Parallel_Nodes)
+
+from .replicas import NODE_CLASS_MAPPINGS as Replicas_Nodes
+NODE_CLASS_MAPPINGS.update(Replicas_Nodes)
+
+from .compiled import NODE_CLASS_MAPPINGS as Compiled_Nodes
+NODE_CLASS_MAPPINGS.update(Compiled_Nodes)
+
+from .syncdebug import NODE_CLASS_MAPPINGS as SyncDebug_Nodes
+NODE_CLASS_MAPPINGS.update(SyncDebug_Nodes)
+
+from .ffnchunk import NODE_CLASS_MAPPINGS as FFNChunk_Nodes
+NODE_CLASS_MAPPINGS.update(FFNChunk_Nodes)
+
+from .attention import NODE_CLASS_MAPPINGS as Attention_Nodes
+NODE_CLASS_MAPPINGS.update(Attention_Nodes)
+
 for name, node in NODE_CLASS_MAPPINGS.items():
 	cat = node.CATEGORY
 	if not cat.startswith("ExtraModels/"):
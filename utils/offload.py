@@ -5,6 +5,9 @@
 import types
 import torch
 import comfy.model_management
+from tqdm import tqdm
+
+from .sampling import SamplingRun
 
 class OverrideDevice:
     @classmethod
@@ -69,9 +72,191 @@ class OverrideVAEDevice(OverrideDevice):
     def patch(self, vae, device):
         return self.override(vae, "first_stage_model", torch.device(device))
 
+class BlockOffload:
+    """
+    Model function wrapper. Keeps the transformer blocks after the first `resident`
+    ones in (pinned) host memory and copies them onto `device` right before they run.
+    The next `prefetch` blocks are copied on a side CUDA stream while the current one
+    computes. The copies are issued from the sampling thread and the compute stream
+    waits for them through events, without blocking the host.
+    The blocks run on their copies through `torch.func.functional_call`, their own
+    tensors are only read, so weights patched by the model management (LoRA etc.)
+    are what gets copied.
+    Copies of blocks that didn't run in a step (layer skip, DeepCache, block
+    cache) are dropped at the end of it, except the ones prefetched for the
+    start of the next step.
+    """
+    def __init__(self, blocks, device, resident=0, prefetch=1, wrapper=None):
+        self.blocks = list(blocks)
+        self.device = torch.device(device)
+        self.resident = resident
+        self.prefetch = max(1, prefetch)
+        self.managed = list(range(min(resident, len(self.blocks)), len(self.blocks)))
+        self.stream = torch.cuda.Stream(self.device) if self.device.type == "cuda" else None
+        self.wrapper = wrapper # previous model function wrapper, if any
+        self.running = None # block running on its copies
+        self.sampling = SamplingRun(reset=self.reset, report=self.report) # hooked by BlockOffloadNode
+
+    def __deepcopy__(self, memo):
+        # the sampling hooks of cloned model patchers still point at this one, it's reset for every run anyway
+        return self
+
+    def reset(self):
+        self.loaded = {} # block index -> (device copies, event recorded after the copy)
+        self.hosted = set() # blocks checked to be in host memory this run
+        self.stats = {"blocks": 0, "bytes": 0}
+        self.timings = [] # (start, end) events of the copies
+
+    def report(self):
+        s = self.stats
+        if not s["blocks"]:
+            return
+        transfer = ""
+        if self.timings:
+            # the copies were never waited on from the host until now
+            self.timings[-1][1].synchronize()
+            seconds = sum(start.elapsed_time(end) for start, end in self.timings) / 1000
+            transfer = f" in {seconds:.2f}s"
+        tqdm.write(
+            f"BlockOffload: {len(self.managed)}/{len(self.blocks)} blocks streamed, {s['blocks']} loads, "
+            f"{s['bytes']/1024**3:.2f} GiB{transfer}"
+        )
+
+    @staticmethod
+    def tensors(block):
+        return {**dict(block.named_parameters()), **dict(block.named_buffers())}
+
+    def to_host(self, i):
+        """
+        Moves a block the model management put on the device back to the host, once per run.
+        """
+        if i in self.hosted:
+            return
+        block = self.blocks[i]
+        pin = self.stream is not None
+        if any(t.device.type != "cpu" or (pin and not t.is_pinned()) for t in self.tensors(block).values()):
+            block.to("cpu")
+            if pin:
+                block._apply(lambda t: t.pin_memory()) # what Module.to uses, keeps the parameter objects
+        self.hosted.add(i)
+
+    def load(self, i):
+        self.to_host(i)
+        tensors = self.tensors(self.blocks[i])
+        self.stats["blocks"] += 1
+        self.stats["bytes"] += sum(t.numel() * t.element_size() for t in tensors.values())
+        if self.stream is None:
+            self.loaded[i] = ({k: t.to(self.device) for k, t in tensors.items()}, None)
+            return
+        start, done = torch.cuda.Event(enable_timing=True), torch.cuda.Event(enable_timing=True)
+        with torch.cuda.stream(self.stream):
+            start.record()
+            copies = {k: t.to(self.device, non_blocking=True) for k, t in tensors.items()}
+            done.record()
+        self.loaded[i] = (copies, done)
+        self.timings.append((start, done))
+
+    def fetch(self, i):
+        """
+        Returns the device copies of block `i`, the compute stream waits for them on the device.
+        """
+        if i not in self.loaded:
+            self.load(i)
+        copies, done = self.loaded.pop(i)
+        if done is not None:
+            stream = torch.cuda.current_stream(self.device)
+            stream.wait_event(done)
+            for t in copies.values():
+                t.record_stream(stream) # allocated on the side stream
+        return copies
+
+    def schedule(self, i):
+        # next blocks stream in while this one computes, wraps around to the next step
+        pos = self.managed.index(i)
+        for k in range(1, min(self.prefetch, len(self.managed) - 1) + 1):
+            j = self.managed[(pos + k) % len(self.managed)]
+            if j not in self.loaded:
+                self.load(j)
+
+    def next_step(self):
+        # prefetched by the last block for the start of the next step
+        return set(self.managed[:self.prefetch])
+
+    def drop(self, keep=()):
+        for i in list(self.loaded):
+            if i not in keep:
+                del self.loaded[i]
+
+    def forward(self, i, forward):
+        """
+        Returns the forward for streamed block `i`, `forward` is the one it had.
+        """
+        block = self.blocks[i]
+        def run(*args, **kwargs):
+            if self.running == i:
+                return forward(*args, **kwargs) # called back by functional_call, on the copies
+            copies = self.fetch(i)
+            self.schedule(i)
+            self.running = i
+            try:
+                return torch.func.functional_call(block, copies, args, kwargs)
+            finally:
+                self.running = None
+        return run
+
+    def __call__(self, apply_model, args):
+        c = args["c"]
+        step = self.sampling.step(args["timestep"], c.get("transformer_options", {}), key=tuple(args["cond_or_uncond"]))
+        try:
+            if self.wrapper is not None:
+                return self.wrapper(apply_model, args)
+            return apply_model(args["input"], args["timestep"], **c)
+        finally:
+            self.drop(keep=self.next_step())
+            self.sampling.last(step)
+
+class BlockOffloadNode:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "resident_blocks": ("INT", {"default": 0, "min": 0, "max": 100}),
+                "prefetch_blocks": ("INT", {"default": 1, "min": 1, "max": 16}),
+            }
+        }
+
+    RETURN_TYPES = ("MODEL",)
+    FUNCTION = "patch"
+    CATEGORY = "other"
+    TITLE = "Block Offload (stream blocks)"
+
+    def patch(self, model, resident_blocks, prefetch_blocks):
+        """
+        resident_blocks: leading blocks left to the regular model management
+        prefetch_blocks: how many blocks are copied ahead of the one running
+        The model management still loads the streamed blocks, they're moved to
+        the host on their first call of every sampling run.
+        """
+        m = model.clone()
+        diffusion_model = m.get_model_object("diffusion_model")
+        offload = BlockOffload(
+            blocks = diffusion_model.blocks,
+            device = m.load_device,
+            resident = resident_blocks,
+            prefetch = prefetch_blocks,
+            wrapper = m.model_options.get("model_function_wrapper", None),
+        )
+        for i in offload.managed:
+            key = f"diffusion_model.blocks.{i}.forward"
+            m.add_object_patch(key, offload.forward(i, m.get_model_object(key)))
+        offload.sampling.hook(m, "block_offload")
+        m.set_model_unet_function_wrapper(offload)
+        return (m,)
 
 NODE_CLASS_MAPPINGS = {
     "OverrideCLIPDevice": OverrideCLIPDevice,
     "OverrideVAEDevice": OverrideVAEDevice,
+    "BlockOffload": BlockOffloadNode,
 }
 NODE_DISPLAY_NAME_MAPPINGS = {k:v.TITLE for k,v in NODE_CLASS_MAPPINGS.items()}
@@ -0,0 +1,188 @@
+#
+# Patch parallel inference (DistriFusion style), splits the image tokens across processes
+#  arXiv:2402.19481
+#
+import os
+import atexit
+import inspect
+import torch
+import torch.distributed as dist
+from tqdm import tqdm
+
+from .offload import OverrideDevice
+from .sampling import SamplingRun
+
+class PatchParallel:
+    """
+    Lives in transformer_options["patch_parallel"]. Every rank runs the same
+    workflow, models that support it call `bind(timesteps, transformer_options)`
+    once per forward pass, then run their blocks on `split(x)`, attend to the
+    K/V returned by `kv_gather(layer)` and `gather` the final tokens back.
+
+    With `stale` set, the K/V of the other ranks are taken from the previous
+    step after `warmup_steps` synchronous steps, and this step's K/V are sent
+    in the background while the rest of the step runs.
+
+    Steps are counted by `sampling`, hooked by PatchParallelNode.
+    """
+    def __init__(self, group=None, stale=True, warmup_steps=1):
+        self.group = group
+        self.rank = dist.get_rank(group)
+        self.world_size = dist.get_world_size(group)
+        self.stale = stale
+        self.warmup_steps = warmup_steps
+        self.buffers = {}
+        self.sampling = SamplingRun(reset=self.reset, report=self.report)
+
+    def __deepcopy__(self, memo):
+        # process groups can't be copied, and the sampling hooks of cloned model patchers
+        # still point at this one. The buffers are reset for every run anyway.
+        return self
+
+    def reset(self):
+        for buf in self.buffers.values():
+            if buf["handle"] is not None:
+                buf["handle"].wait()
+        self.step = -1
+        self.key = None
+        self.buffers = {}
+        self.stale_steps = set()
+        self.tokens = None
+
+    def report(self):
+        if self.step < 0 or self.rank != 0:
+            return
+        tqdm.write(
+            f"PatchParallel: {self.world_size} ranks, {self.tokens} -> {self.tokens // self.world_size} tokens per rank, "
+            f"stale K/V on {len(self.stale_steps)}/{self.step + 1} steps"
+        )
+
+    def bind(self, timesteps, transformer_options):
+        self.key = tuple(transformer_options.get("cond_or_uncond", []))
+        self.step = self.sampling.step(timesteps, transformer_options, key=self.key)
+        return self
+
+    def can_split(self, x):
+        return x.shape[1] % self.world_size == 0
+
+    def split(self, x):
+        """
+        x: (B, N, C) full token sequence, returns the contiguous slice of this rank
+        """
+        self.tokens = x.shape[1]
+        n = x.shape[1] // self.world_size
+        return x[:, self.rank * n:(self.rank + 1) * n]
+
+    def gather(self, x):
+        """
+        x: (B, n, C) local tokens, returns the (B, N, C) sequence of all ranks
+        """
+        parts = [torch.empty_like(x) for _ in range(self.world_size)]
+        dist.all_gather(parts, x.contiguous(), group=self.group)
+        self.sampling.last(self.step)
+        return torch.cat(parts, dim=1)
+
+    def kv_gather(self, layer):
+        key = (self.key, layer)
+        def gather(k, v):
+            kv = torch.cat([k, v], dim=-1).contiguous()
+            buf = self.buffers.get(key, None)
+            use_stale = (
+                self.stale and self.step >= self.warmup_steps and
+                buf is not None and buf["parts"][0].shape == kv.shape
+            )
+
+            parts = [torch.empty_like(kv) for _ in range(self.world_size)]
+            if use_stale:
+                if buf["handle"] is not None:
+                    buf["handle"].wait()
+                full = torch.cat(buf["parts"], dim=1)
+                n = kv.shape[1]
+                full[:, self.rank * n:(self.rank + 1) * n] = kv
+                handle = dist.all_gather(parts, kv, group=self.group, async_op=True)
+                self.stale_steps.add(self.step)
+            else:
+                dist.all_gather(parts, kv, group=self.group)
+                full = torch.cat(parts, dim=1)
+                handle = None
+            self.buffers[key] = {"parts": parts, "handle": handle}
+            return full.chunk(2, dim=-1)
+        return gather
+
+def init_process_group():
+    """
+    Joins the process group once per process, the first time a PatchParallel node runs.
+    Every rank runs the same workflow, so they all get here.
+    Uses the usual torchrun environment variables (RANK, WORLD_SIZE, MASTER_ADDR, MASTER_PORT),
+    EXTRAMODELS_DIST_BACKEND selects the backend (nccl on CUDA, gloo otherwise by default).
+    Returns False when not launched with more than one process.
+    """
+    if not dist.is_available():
+        return False
+    if dist.is_initialized():
+        return dist.get_world_size() > 1
+    if int(os.environ.get("WORLD_SIZE", 1)) <= 1:
+        return False
+    backend = os.environ.get("EXTRAMODELS_DIST_BACKEND", "nccl" if torch.cuda.is_available() else "gloo")
+    dist.init_process_group(backend=backend, init_method="env://")
+    atexit.register(destroy_process_group)
+    return True
+
+def destroy_process_group():
+    if dist.is_available() and dist.is_initialized():
+        dist.destroy_process_group()
+
+def is_parallel():
+    return dist.is_available() and dist.is_initialized() and dist.get_world_size() > 1
+
+class PatchParallelNode(OverrideDevice):
+    @classmethod
+    def INPUT_TYPES(s):
+        k = super().INPUT_TYPES()
+        k["required"]["device"][0].insert(0, "auto")
+        k["required"]["device"][1]["default"] = "auto"
+        return {
+            "required": {
+                "model": ("MODEL",),
+                **k["required"],
+                "stale_kv": ("BOOLEAN", {"default": True}),
+                "warmup_steps": ("INT", {"default": 1, "min": 0, "max": 100}),
+            }
+        }
+
+    RETURN_TYPES = ("MODEL",)
+    TITLE = "Patch Parallel (PixArt)"
+
+    def patch(self, model, device, stale_kv, warmup_steps):
+        """
+        Start one ComfyUI process per rank (e.g. with torchrun) running the same workflow,
+        the process group is set up the first time this runs (see init_process_group).
+        auto puts every rank on cuda:LOCAL_RANK if available, cpu otherwise.
+        Only PixArtMS models are supported. Sana's linear attention and conv FFN mix
+        tokens across the split in ways the K/V exchange doesn't cover.
+        """
+        if not init_process_group():
+            tqdm.write("PatchParallel: not launched with WORLD_SIZE > 1, running on a single process")
+            return (model,)
+        diffusion_model = model.get_model_object("diffusion_model")
+        forward_raw = getattr(diffusion_model, "forward_raw", None)
+        if forward_raw is None or "patch_parallel" not in inspect.signature(forward_raw).parameters:
+            raise ValueError(f"PatchParallel: {type(diffusion_model).__name__} is not supported, only PixArtMS models are")
+        if device == "auto":
+            local_rank = int(os.environ.get("LOCAL_RANK", dist.get_rank()))
+            device = f"cuda:{local_rank % torch.cuda.device_count()}" if torch.cuda.is_available() else "cpu"
+
+        # only this clone samples on the rank's device, the shared model stays movable
+        m = model.clone()
+        m.load_device = torch.device(device)
+        patch_parallel = PatchParallel(
+            stale = stale_kv,
+            warmup_steps = warmup_steps,
+        )
+        patch_parallel.sampling.hook(m, "patch_parallel")
+        m.model_options["transformer_options"]["patch_parallel"] = patch_parallel
+        return (m,)
+
+NODE_CLASS_MAPPINGS = {
+    "PatchParallel": PatchParallelNode,
+}
@@ -0,0 +1,37 @@
+#
+# Patch embedding / unpatchify without the extra copies of the einsum versions
+#
+import torch
+import torch.nn.functional as F
+
+def patchify(x, proj):
+    """
+    Non-overlapping conv patch embedding as a single matmul.
+    x: (N, C, H, W), proj: Conv2d with kernel_size == stride
+    Returns contiguous (N, T, D) tokens, the conv path gives a transposed view
+    that the first norm/add of the blocks has to copy again. Only the (small)
+    latent gets rearranged. Returns None if the conv can't be expressed this way.
+    """
+    p, q = proj.kernel_size
+    N, C, H, W = x.shape
+    if proj.stride != (p, q) or proj.padding not in ((0, 0), "valid") or proj.dilation != (1, 1) or proj.groups != 1:
+        return None
+    if H % p or W % q:
+        return None
+    h, w = H // p, W // q
+    if p == 1 and q == 1:
+        x = x.flatten(2).transpose(1, 2)
+    else:
+        x = x.reshape(N, C, h, p, w, q).permute(0, 2, 4, 1, 3, 5).reshape(N, h * w, C * p * q)
+    return F.linear(x, proj.weight.reshape(proj.out_channels, -1), proj.bias)
+
+def unpatchify(x, h, w, p, c):
+    """
+    x: (N, h * w, p * p * c) tokens, returns (N, c, h * p, w * p)
+    p=1 is a pure view (channels last strides), p>1 is a single permute + copy.
+    """
+    N = x.shape[0]
+    if p == 1:
+        return x.reshape(N, h, w, c).permute(0, 3, 1, 2)
+    x = x.reshape(N, h, w, p, p, c).permute(0, 5, 1, 3, 2, 4)
+    return x.reshape(N, c, h * p, w * p)
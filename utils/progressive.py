@@ -0,0 +1,98 @@
+#
+# Progressive resolution sampling, early high-noise steps at a reduced latent size
+#
+import torch
+import torch.nn.functional as F
+import comfy.samplers
+
+def sample_progressive(model, x, sigmas, extra_args=None, callback=None, disable=None, sampler=None, scale=0.5, switch_percent=0.5, upscale_method="bicubic", multiple=2):
+    """
+    Runs `sampler` on a downscaled latent for the first `switch_percent` of the steps,
+    then upscales the denoised estimate, re-noises it to the next sigma at full size
+    and runs the remaining steps there.
+    The switch takes the place of the last reduced step: its single model evaluation
+    gives the denoised estimate, so a first order sampler costs the same number of
+    evaluations as without the switch (higher order ones save their extra ones on it).
+    """
+    extra_args = {} if extra_args is None else extra_args
+    steps = len(sigmas) - 1
+    switch = min(steps, max(0, round(steps * switch_percent)))
+    if switch == 0 or switch == steps or scale >= 1.0 or extra_args.get("denoise_mask", None) is not None:
+        return sampler.sampler_function(model, x, sigmas, extra_args=extra_args, callback=callback, disable=disable, **sampler.extra_options)
+
+    H, W = x.shape[-2:]
+    h = max(multiple, round(H * scale / multiple) * multiple)
+    w = max(multiple, round(W * scale / multiple) * multiple)
+
+    # nearest keeps the per-pixel noise statistics intact
+    x_lo = F.interpolate(x, size=(h, w), mode="nearest-exact")
+
+    # size conditioning follows the reduced latent during the first pass
+    model_options = extra_args.get("model_options", {})
+    lo_args = {
+        **extra_args,
+        "model_options": {
+            **model_options,
+            "transformer_options": {
+                **model_options.get("transformer_options", {}),
+                "resolution_from_latent": True,
+            },
+        },
+    }
+    if switch > 1:
+        x_lo = sampler.sampler_function(model, x_lo, sigmas[:switch], extra_args=lo_args, callback=callback, disable=disable, **sampler.extra_options)
+
+    # step switch - 1: denoise at the reduced size, re-noise to the next sigma at full size
+    s_in = x.new_ones([x.shape[0]])
+    denoised = model(x_lo, sigmas[switch - 1] * s_in, **lo_args)
+    if callback is not None:
+        callback({"x": x_lo, "i": switch - 1, "sigma": sigmas[switch - 1], "sigma_hat": sigmas[switch - 1], "denoised": denoised})
+    denoised = F.interpolate(denoised, size=(H, W), mode=upscale_method)
+    sigma = sigmas[switch]
+
+    seed = extra_args.get("seed", None)
+    generator = torch.Generator(device="cpu")
+    if seed is not None:
+        generator.manual_seed(seed + 1)
+    noise = torch.randn(x.shape, generator=generator, dtype=torch.float32, device="cpu").to(x)
+    model_sampling = model.inner_model.model_patcher.get_model_object("model_sampling")
+    x = model_sampling.noise_scaling(sigma * s_in, noise, denoised)
+
+    def step_callback(d):
+        if callback is not None:
+            callback({**d, "i": d["i"] + switch})
+
+    return sampler.sampler_function(model, x, sigmas[switch:], extra_args=extra_args, callback=step_callback, disable=disable, **sampler.extra_options)
+
+class ProgressiveResolutionSampler:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "sampler": ("SAMPLER",),
+                "scale": ("FLOAT", {"default": 0.5, "min": 0.1, "max": 1.0, "step": 0.05}),
+                "switch_percent": ("FLOAT", {"default": 0.5, "min": 0.0, "max": 1.0, "step": 0.01}),
+                "upscale_method": (["bicubic", "bilinear", "nearest-exact"], {"default": "bicubic"}),
+            }
+        }
+
+    RETURN_TYPES = ("SAMPLER",)
+    FUNCTION = "get_sampler"
+    CATEGORY = "sampling"
+    TITLE = "Progressive Resolution Sampler (PixArt/Sana)"
+
+    def get_sampler(self, sampler, scale, switch_percent, upscale_method):
+        """
+        scale: latent size of the first pass, relative to the final latent (0.5 = 1/4 of the tokens)
+        switch_percent: fraction of the steps run at the reduced size
+        """
+        return (comfy.samplers.KSAMPLER(sample_progressive, extra_options={
+            "sampler": sampler,
+            "scale": scale,
+            "switch_percent": switch_percent,
+            "upscale_method": upscale_method,
+        }),)
+
+NODE_CLASS_MAPPINGS = {
+    "ProgressiveResolutionSampler": ProgressiveResolutionSampler,
+}
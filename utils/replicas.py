@@ -0,0 +1,252 @@
+#
+# Replica pool, runs the diffusion model on several devices at once
+#
+import copy
+import time
+import threading
+import torch
+from concurrent.futures import ThreadPoolExecutor
+from tqdm import tqdm
+
+from .offload import OverrideDevice
+from .sampling import add_sampling_hooks, SamplingRun
+
+def parse_devices(devices):
+    """
+    Comma separated device list, "auto" for every CUDA device. Repeating a device
+    (e.g. "cpu,cpu") is allowed and gives multiple replicas on it.
+    """
+    if devices.strip() == "auto":
+        count = torch.cuda.device_count()
+        return [torch.device(f"cuda:{k}") for k in range(count)] or [torch.device("cpu")]
+    return [torch.device(d.strip()) for d in devices.split(",") if d.strip()]
+
+class ReplicaPool(torch.nn.Module):
+    """
+    Stands in for the diffusion model. Every forward pass is split along the
+    batch into units (whole cond/uncond chunks where possible) which are sent
+    to the replica with the least queued work relative to its measured
+    throughput. The replicas are copied from the primary model on first use
+    and re-synced whenever its weights change (e.g. LoRA patching).
+
+    With sampling hooks (see ReplicaPoolNode) the weights are only checked once
+    per sampling run, right after ComfyUI applied the patches, and the replicas
+    are loaded through the model management like any other model.
+    """
+    def __init__(self, primary, devices):
+        super().__init__()
+        self.primary = primary
+        self.devices = list(devices)
+        self.replicas = [] # not registered, model.to() only moves the primary, None uses the primary
+        self.patchers = [] # model patchers of the replicas, when managed
+        self.managed = False
+        self.version = None
+        self.run_version = None # weights version of the current sampling run, if hooked
+        self.loaded = False
+        self.lock = threading.Lock()
+        self.pending = [0] * len(self.devices)
+        self.speed = [1.0] * len(self.devices) # rows/s, running average
+        self.rows = [0] * len(self.devices)
+        self.executor = None
+        self.sampling = SamplingRun(reset=self.reset_stats, report=self.report)
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            return getattr(self._modules["primary"], name)
+
+    def weights_version(self):
+        return tuple((p.data_ptr(), p._version) for p in self.primary.parameters())
+
+    def sampling_start(self):
+        # patches are applied when the model gets loaded, before the sampling run starts
+        self.run_version = self.weights_version()
+        self.loaded = False
+        self.sampling.begin()
+
+    def sampling_end(self):
+        self.sampling.end()
+        self.run_version = None
+
+    def sync(self, device):
+        """
+        device: current device of the primary, the first replica on it reuses the primary
+        """
+        version = self.run_version if self.run_version is not None else self.weights_version()
+        if version == self.version and len(self.replicas) == len(self.devices):
+            return
+        if len(self.replicas) != len(self.devices):
+            self.replicas = []
+            for d in self.devices:
+                if d == device and None not in self.replicas:
+                    self.replicas.append(None)
+                else:
+                    self.replicas.append(copy.deepcopy(self.primary).to(d))
+            self.patchers = []
+            self.loaded = False
+        else:
+            state = self.primary.state_dict()
+            for replica in self.replicas:
+                if replica is not None:
+                    replica.load_state_dict(state)
+        self.version = version
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=len(self.devices))
+
+    def load(self):
+        """
+        Loads the replicas through the model management, so their memory is accounted
+        for and they get offloaded like other models when it runs out.
+        """
+        import comfy.model_patcher
+        import comfy.model_management
+        if not self.patchers:
+            self.patchers = [
+                comfy.model_patcher.ModelPatcher(replica, load_device=d, offload_device=torch.device("cpu"))
+                for replica, d in zip(self.replicas, self.devices) if replica is not None
+            ]
+        comfy.model_management.load_models_gpu(self.patchers)
+        self.loaded = True
+
+    def pick(self, rows):
+        """
+        Least loaded replica for a unit of `rows` batch rows, reserves the work.
+        """
+        with self.lock:
+            k = min(range(len(self.devices)), key=lambda k: (self.pending[k] + rows) / self.speed[k])
+            self.pending[k] += rows
+            return k
+
+    def done(self, k, rows, elapsed):
+        with self.lock:
+            self.pending[k] -= rows
+            self.rows[k] += rows
+            rate = rows / max(elapsed, 1e-6)
+            self.speed[k] = 0.8 * self.speed[k] + 0.2 * rate if self.rows[k] > rows else rate
+
+    def reset_stats(self):
+        self.step = -1
+        self.rows = [0] * len(self.devices)
+
+    def report(self):
+        if not sum(self.rows):
+            return
+        total = sum(self.rows)
+        text = ", ".join(f"{d}: {r/total:.0%} ({s:.2f} rows/s)" for d, r, s in zip(self.devices, self.rows, self.speed))
+        tqdm.write(f"ReplicaPool: {text}")
+
+    def forward(self, x, timesteps, context=None, **kwargs):
+        B = x.shape[0]
+        if len(self.devices) <= 1 or B <= 1:
+            return self.primary(x, timesteps, context, **kwargs)
+        self.sync(x.device)
+        if self.managed and not self.loaded:
+            self.load()
+        self.step = self.sampling.step(timesteps, kwargs.get("transformer_options", {}))
+
+        # split along cond/uncond chunks if possible so every unit keeps a valid cond_or_uncond
+        transformer_options = kwargs.get("transformer_options", {})
+        cond_or_uncond = transformer_options.get("cond_or_uncond", [])
+        if len(cond_or_uncond) > 1 and B % len(cond_or_uncond) == 0:
+            chunk = B // len(cond_or_uncond)
+            units = [(i * chunk, (i + 1) * chunk, [c]) for i, c in enumerate(cond_or_uncond)]
+            if len(units) < len(self.devices): # more devices than chunks, go per row
+                units = [(i, i + 1, [cond_or_uncond[i // chunk]]) for i in range(B)]
+        else:
+            units = [(i, i + 1, cond_or_uncond) for i in range(B)]
+
+        # merge the units that end up on the same replica
+        assigned = {}
+        for start, end, cu in units:
+            k = self.pick(end - start)
+            assigned.setdefault(k, []).append((start, end, cu))
+
+        def run(k, parts):
+            device = self.devices[k]
+            host_rows = torch.cat([torch.arange(s, e) for s, e, _ in parts])
+            rows = host_rows.to(x.device)
+            def take(v):
+                if torch.is_tensor(v) and v.ndim > 0 and v.shape[0] == B:
+                    if v.device.type == "cpu" and x.device.type != "cpu":
+                        return v[host_rows] # host side metadata (e.g. text lengths) stays there
+                    return v[rows].to(device)
+                if torch.is_tensor(v):
+                    return v.to(device)
+                return v
+            args = {name: take(v) for name, v in kwargs.items() if name != "transformer_options"}
+            args["transformer_options"] = {
+                **transformer_options,
+                "cond_or_uncond": [c for _, _, cu in parts for c in cu],
+            }
+            start = time.perf_counter()
+            with torch.no_grad():
+                replica = self.replicas[k] if self.replicas[k] is not None else self.primary
+                out = replica(take(x), take(timesteps), take(context), **args)
+            if device.type == "cuda":
+                torch.cuda.synchronize(device)
+            self.done(k, len(rows), time.perf_counter() - start)
+            return rows, out
+
+        futures = [self.executor.submit(run, k, parts) for k, parts in assigned.items()]
+        results = [f.result() for f in futures]
+
+        out = None
+        for rows, part in results:
+            if out is None:
+                out = torch.empty((B, *part.shape[1:]), dtype=part.dtype, device=x.device)
+            out[rows] = part.to(x.device)
+        self.sampling.last(self.step)
+        return out
+
+class ReplicaPoolNode(OverrideDevice):
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "devices": ("STRING", {"default": "auto"}),
+            },
+            "optional": {
+                "clip": ("CLIP",),
+                "vae": ("VAE",),
+            }
+        }
+
+    RETURN_TYPES = ("MODEL", "CLIP", "VAE")
+    TITLE = "Replica Pool (multi-device)"
+
+    def patch(self, model, devices, clip=None, vae=None):
+        """
+        devices: comma separated list (cuda:0,cuda:1 / cpu,cpu), "auto" for all CUDA devices.
+        The text encoder and VAE, if connected, are moved to the last device of the pool.
+        """
+        devices = parse_devices(devices)
+        m = model.clone()
+        pool = ReplicaPool(m.get_model_object("diffusion_model"), devices)
+        pool.managed = True
+        add_sampling_hooks(m, "replica_pool", start=pool.sampling_start, end=pool.sampling_end)
+        m.add_object_patch("diffusion_model", pool)
+
+        if len(devices) > 1:
+            if clip is not None:
+                clip = self.on_device(clip, devices[-1])
+            if vae is not None:
+                vae = self.on_device(vae, devices[-1])
+        return (m, clip, vae)
+
+    @staticmethod
+    def on_device(obj, device):
+        """
+        Copy of a CLIP/VAE whose own model patcher loads it on `device`, the input is left as-is.
+        """
+        obj = copy.copy(obj)
+        obj.patcher = obj.patcher.clone()
+        obj.patcher.load_device = device
+        if hasattr(obj, "device"):
+            obj.device = device
+        return obj
+
+NODE_CLASS_MAPPINGS = {
+    "ReplicaPool": ReplicaPoolNode,
+}
@@ -0,0 +1,141 @@
+#
+# Hooks around a whole sampling run, without reading the timesteps back from the device
+#
+import torch
+
+try:
+    import comfy.conds
+    import comfy.utils
+except ImportError: # only the torch side of this module is used outside of ComfyUI
+    comfy = None
+
+def add_sampling_hooks(model_patcher, key, start=None, end=None):
+    """
+    start() runs before and end() after every sampling run of the patcher (comfy's outer sample),
+    end() also runs when sampling fails or is interrupted. Only plain functions end up in the
+    model options, clone() deep copies those and would duplicate any object they're bound to.
+    Returns False on ComfyUI versions without model wrappers, nothing is installed then.
+    """
+    if not hasattr(model_patcher, "add_wrapper_with_key"):
+        return False
+    import comfy.patcher_extension
+
+    def outer_sample(executor, *args, **kwargs):
+        if start is not None:
+            start()
+        try:
+            return executor(*args, **kwargs)
+        finally:
+            if end is not None:
+                end()
+
+    model_patcher.add_wrapper_with_key(comfy.patcher_extension.WrappersMP.OUTER_SAMPLE, key, outer_sample)
+    return True
+
+if comfy is not None:
+    class CONDHost(comfy.conds.CONDRegular):
+        """
+        Per-row metadata that stays on the CPU, the model can read it without waiting for the device.
+        """
+        def process_cond(self, batch_size, *args, **kwargs):
+            return self._copy_with(comfy.utils.repeat_to_batch_size(self.cond, batch_size))
+
+class HostFlag:
+    """
+    A boolean computed on the device and read on the host on a later step without waiting for it,
+    for per-step decisions that can lag by one step instead of syncing. Not ready means `default`.
+    """
+    def __init__(self):
+        self.value = None
+        self.event = None
+        self.ready = False
+
+    def set(self, flag):
+        if flag.device.type == "cuda":
+            if self.event is None:
+                self.value = torch.empty((), dtype=torch.bool, pin_memory=True)
+                self.event = torch.cuda.Event()
+            self.value.copy_(flag, non_blocking=True)
+            self.event.record()
+        else:
+            self.value = flag
+        self.ready = True
+
+    def clear(self):
+        self.ready = False
+
+    def get(self, default=False):
+        if not self.ready:
+            return default
+        if self.event is not None and not self.event.query():
+            return default # still running, don't wait for it
+        return bool(self.value)
+
+class SamplingRun:
+    """
+    Run and step bookkeeping for the objects that act once per model call (caches, guidance,
+    offload, ...). With the sampling hooks (see `hook`) begin()/end() frame every run and steps
+    are counted per model call without reading anything from the device. On ComfyUI versions
+    without the hooks a run ends once the timestep goes back up, the one host sync left.
+    reset: clears the owner's per-run state. report: logs the owner's stats, once per run.
+    """
+    def __init__(self, reset=None, report=None):
+        self.on_reset = reset
+        self.on_report = report
+        self.hooked = False # inside a run started by the sampling hooks
+        self.clear()
+
+    def clear(self):
+        self.steps = {}
+        self.total_steps = None
+        self.last_t = None
+        self.reported = False
+        if self.on_reset is not None:
+            self.on_reset()
+
+    def hook(self, model_patcher, key):
+        """
+        Runs begin()/end() around every sampling run of the patcher, False on older ComfyUI.
+        """
+        return add_sampling_hooks(model_patcher, key, start=lambda: self.begin(), end=lambda: self.end())
+
+    def begin(self):
+        self.clear()
+        self.hooked = True
+
+    def end(self):
+        self.report()
+        self.clear()
+        self.hooked = False
+
+    def report(self):
+        if not self.reported and self.on_report is not None:
+            self.reported = True
+            self.on_report()
+
+    def step(self, timesteps, transformer_options, key=()):
+        """
+        Counts a model call, returns its step index. Calls with different `key`s (e.g. cond and
+        uncond when they aren't batched) are counted separately.
+        """
+        if not self.hooked:
+            t = float(timesteps.max())
+            if self.last_t is not None and t > self.last_t:
+                self.end()
+            self.last_t = t
+        sample_sigmas = transformer_options.get("sample_sigmas", None)
+        if sample_sigmas is not None:
+            self.total_steps = len(sample_sigmas) - 1
+        step = self.steps[key] = self.steps.get(key, -1) + 1
+        return step
+
+    @property
+    def step_count(self):
+        return max(self.steps.values()) + 1 if self.steps else 0
+
+    def last(self, step):
+        """
+        Without the hooks nothing marks the end of a run, the stats are reported on its last step.
+        """
+        if not self.hooked and self.total_steps is not None and step >= self.total_steps - 1:
+            self.report()
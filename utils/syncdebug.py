@@ -0,0 +1,167 @@
+#
+# Host sync debugging, counts the ops that make the CPU wait for the device
+#
+import torch
+import threading
+from collections import Counter
+from contextlib import contextmanager, ExitStack
+from tqdm import tqdm
+from torch.utils._python_dispatch import TorchDispatchMode
+
+aten = torch.ops.aten
+
+# ops that return python values or data-dependent shapes
+sync_ops = {
+    aten._local_scalar_dense.default: "item", # .item(), float(), int(), bool(), tensor slice bounds
+    aten.nonzero.default: "nonzero",
+    aten.masked_select.default: "masked_select",
+    aten.equal.default: "equal",
+    aten.repeat_interleave.Tensor: "repeat_interleave",
+    aten._unique2.default: "unique",
+}
+
+active = threading.local() # SyncCounters entered by this thread, innermost last
+
+def counted_tolist(t):
+    counters = getattr(active, "counters", None)
+    if not counters:
+        return torch._C.TensorBase.tolist(t)
+    counter = counters[-1]
+    if counter.on_device(t):
+        counter.counts["tolist"] += 1
+    counter.paused = True
+    try:
+        return torch._C.TensorBase.tolist(t)
+    finally:
+        counter.paused = False
+
+@contextmanager
+def count_tolist(counter):
+    """
+    tolist() reads CPU tensors without going through the dispatcher, count its calls on
+    `counter` while inside. Only calls of this thread count, the original is always restored.
+    """
+    counters = active.__dict__.setdefault("counters", [])
+    patched = "tolist" not in torch.Tensor.__dict__
+    if patched:
+        torch.Tensor.tolist = counted_tolist
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+        if patched:
+            del torch.Tensor.tolist
+
+class SyncCounter(TorchDispatchMode):
+    """
+    Counts the host syncs of everything run inside it, by op.
+    count_cpu: also count them for CPU tensors, where they're free but show what
+    would sync on a GPU (e.g. to catch regressions on a CPU-only CI runner).
+    """
+    def __init__(self, count_cpu=False):
+        super().__init__()
+        self.count_cpu = count_cpu
+        self.counts = Counter()
+        self.paused = False
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def on_device(self, t):
+        return torch.is_tensor(t) and (self.count_cpu or t.device.type != "cpu")
+
+    def sync_name(self, func, args, kwargs):
+        if func in sync_ops:
+            return sync_ops[func] if self.on_device(args[0]) else None
+        if func is aten.index.Tensor:
+            bool_index = any(i is not None and i.dtype == torch.bool for i in args[1])
+            return "bool index" if bool_index and self.on_device(args[0]) else None
+        if func is aten._to_copy.default:
+            device = kwargs.get("device", None)
+            if device is not None and torch.device(device).type == "cpu" and args[0].device.type != "cpu":
+                return "to cpu"
+        if func is aten.copy_.default:
+            if args[0].device.type == "cpu" and args[1].device.type != "cpu":
+                return "to cpu"
+        return None
+
+    def __torch_dispatch__(self, func, types, args=(), kwargs=None):
+        kwargs = kwargs or {}
+        name = None if self.paused else self.sync_name(func, args, kwargs)
+        if name is not None:
+            self.counts[name] += 1
+        return func(*args, **kwargs)
+
+    def __enter__(self):
+        self.exit_stack = ExitStack()
+        self.exit_stack.enter_context(count_tolist(self))
+        try:
+            return super().__enter__()
+        except BaseException:
+            self.exit_stack.close()
+            raise
+
+    def __exit__(self, *args):
+        try:
+            return super().__exit__(*args)
+        finally:
+            self.exit_stack.close()
+
+class SyncDebug:
+    """
+    Model function wrapper that counts the host syncs of every model call.
+    Reports them and, with `max_syncs` >= 0, raises once a call has more.
+    """
+    def __init__(self, count_cpu=False, max_syncs=-1, wrapper=None):
+        self.count_cpu = count_cpu
+        self.max_syncs = max_syncs
+        self.wrapper = wrapper # previous model function wrapper, if any
+
+    def __call__(self, apply_model, args):
+        counter = SyncCounter(self.count_cpu)
+        with counter:
+            if self.wrapper is not None:
+                out = self.wrapper(apply_model, args)
+            else:
+                out = apply_model(args["input"], args["timestep"], **args["c"])
+        ops = ", ".join(f"{name} x{count}" for name, count in counter.counts.most_common())
+        text = f"{counter.total} host sync(s) in the model call" + (f" ({ops})" if ops else "")
+        tqdm.write(f"SyncDebug: {text}")
+        if 0 <= self.max_syncs < counter.total:
+            raise RuntimeError(f"SyncDebug: {text}, at most {self.max_syncs} allowed")
+        return out
+
+class SyncDebugNode:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "count_cpu": ("BOOLEAN", {"default": False}),
+                "max_syncs": ("INT", {"default": -1, "min": -1, "max": 10000}),
+            }
+        }
+
+    RETURN_TYPES = ("MODEL",)
+    FUNCTION = "patch"
+    CATEGORY = "other"
+    TITLE = "Sync Debug (count host syncs)"
+
+    def patch(self, model, count_cpu, max_syncs):
+        """
+        count_cpu: count on CPU tensors too, for CPU-only runs.
+        max_syncs: raise an error when a model call syncs more often, -1 only reports.
+        """
+        m = model.clone()
+        m.set_model_unet_function_wrapper(SyncDebug(
+            count_cpu = count_cpu,
+            max_syncs = max_syncs,
+            wrapper = m.model_options.get("model_function_wrapper", None),
+        ))
+        return (m,)
+
+NODE_CLASS_MAPPINGS = {
+    "SyncDebug": SyncDebugNode,
+}
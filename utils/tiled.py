@@ -0,0 +1,110 @@
+#
+# Tiled (MultiDiffusion) denoising, bounds activation memory by tile size
+#
+import torch
+
+def get_tiles(size, tile, overlap, multiple=2):
+    """
+    Start offsets of overlapping windows covering [0, size), the last one aligned to the end.
+    The others are multiples of `multiple`, the last one too unless `size` isn't.
+    """
+    if size <= tile:
+        return [0]
+    stride = max(multiple, (tile - overlap) // multiple * multiple)
+    starts = list(range(0, size - tile, stride))
+    starts.append(size - tile)
+    return sorted(set(starts))
+
+def feather(tile_h, tile_w, overlap, device, dtype):
+    """
+    Blending weights that ramp down linearly over `overlap` pixels towards the tile edges.
+    """
+    def ramp(n):
+        i = torch.arange(n, device=device, dtype=dtype)
+        r = torch.minimum(i + 1, n - i) / (overlap + 1)
+        return r.clamp(max=1.0)
+    if overlap <= 0:
+        return torch.ones(tile_h, tile_w, device=device, dtype=dtype)
+    return ramp(tile_h)[:, None] * ramp(tile_w)[None, :]
+
+class TiledDiffusion:
+    """
+    Model function wrapper that runs the model on overlapping latent windows,
+    `tile_batch` windows per call, and blends the predictions with feathered weights.
+    Conditioning is shared by every window.
+    """
+    def __init__(self, tile_size=64, overlap=16, tile_batch=4, wrapper=None):
+        self.tile_size = tile_size
+        self.overlap = overlap
+        self.tile_batch = tile_batch
+        self.wrapper = wrapper # previous model function wrapper, if any
+
+    def __call__(self, apply_model, args):
+        if self.wrapper is not None:
+            return self.wrapper(lambda x, t, **c: self.apply_tiled(apply_model, x, t, c), args)
+        return self.apply_tiled(apply_model, args["input"], args["timestep"], args["c"])
+
+    def apply_tiled(self, apply_model, x, t, c):
+        B, _, H, W = x.shape
+        tile_h, tile_w = min(self.tile_size, H), min(self.tile_size, W)
+        tiles = [(y0, x0) for y0 in get_tiles(H, tile_h, self.overlap) for x0 in get_tiles(W, tile_w, self.overlap)]
+        if len(tiles) == 1:
+            return apply_model(x, t, **c)
+
+        out = None
+        weight = feather(tile_h, tile_w, self.overlap, x.device, torch.float32)
+        weight_sum = torch.zeros((1, 1, H, W), device=x.device, dtype=torch.float32)
+        for i in range(0, len(tiles), self.tile_batch):
+            batch = tiles[i:i + self.tile_batch]
+            n = len(batch)
+            x_tiles = torch.cat([x[:, :, y0:y0 + tile_h, x0:x0 + tile_w] for y0, x0 in batch])
+            c_tiles = {}
+            for k, v in c.items():
+                if torch.is_tensor(v) and v.shape[0] == B:
+                    v = v.repeat(n, *([1] * (v.ndim - 1)))
+                elif k == "transformer_options":
+                    v = {**v, "tile_batch": i // self.tile_batch} # keeps per-call caches apart
+                    if "cond_or_uncond" in v:
+                        v["cond_or_uncond"] = v["cond_or_uncond"] * n
+                c_tiles[k] = v
+            pred = apply_model(x_tiles, t.repeat(n), **c_tiles)
+            if out is None:
+                out = torch.zeros((B, pred.shape[1], H, W), device=pred.device, dtype=torch.float32)
+            for j, (y0, x0) in enumerate(batch):
+                out[:, :, y0:y0 + tile_h, x0:x0 + tile_w] += pred[j * B:(j + 1) * B].float() * weight
+                weight_sum[:, :, y0:y0 + tile_h, x0:x0 + tile_w] += weight
+        return (out / weight_sum).to(pred.dtype)
+
+class TiledDiffusionNode:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "tile_size": ("INT", {"default": 64, "min": 16, "max": 1024, "step": 8}),
+                "overlap": ("INT", {"default": 16, "min": 0, "max": 512, "step": 8}),
+                "tile_batch": ("INT", {"default": 4, "min": 1, "max": 64}),
+            }
+        }
+
+    RETURN_TYPES = ("MODEL",)
+    FUNCTION = "patch"
+    CATEGORY = "other"
+    TITLE = "Tiled Diffusion (PixArt/Sana)"
+
+    def patch(self, model, tile_size, overlap, tile_batch):
+        """
+        tile_size/overlap are in latent pixels, tile_batch windows are evaluated per model call.
+        """
+        m = model.clone()
+        m.set_model_unet_function_wrapper(TiledDiffusion(
+            tile_size = tile_size,
+            overlap = min(overlap, tile_size // 2),
+            tile_batch = tile_batch,
+            wrapper = m.model_options.get("model_function_wrapper", None),
+        ))
+        return (m,)
+
+NODE_CLASS_MAPPINGS = {
+    "TiledDiffusion": TiledDiffusionNode,
+}
@@ -0,0 +1,147 @@
+#
+# Token merging (ToMe) for the DiT self-attention/MLP
+#  based on tomesd (arXiv:2303.17604) [MIT]
+#
+import torch
+from tqdm import tqdm
+
+def bipartite_soft_matching_2d(metric, h, w, sx, sy, r, offset=0):
+    """
+    Merges `r` tokens of an (h, w) token grid. One destination token is kept
+    per (sy, sx) cell, the `r` most similar source tokens are merged into them.
+    The matching is shared across the batch so the merged tokens keep a single
+    set of positions (needed for RoPE). Returns merge, unmerge and the indices
+    of the positions the merged sequence was taken from.
+    """
+    B, N, _ = metric.shape
+    hsy, wsx = h // sy, w // sx
+    num_dst = hsy * wsx
+    r = min(r, N - num_dst)
+    if r <= 0 or num_dst == 0:
+        return None
+
+    with torch.no_grad():
+        # pick the destination token of every cell, rotated by `offset` between blocks
+        idx_buffer_view = torch.zeros(hsy, wsx, sy * sx, device=metric.device, dtype=torch.int64)
+        idx_buffer_view[:, :, offset % (sy * sx)] = -1
+        idx_buffer_view = idx_buffer_view.view(hsy, wsx, sy, sx).transpose(1, 2).reshape(hsy * sy, wsx * sx)
+        if (hsy * sy) < h or (wsx * sx) < w:
+            idx_buffer = torch.zeros(h, w, device=metric.device, dtype=torch.int64)
+            idx_buffer[:(hsy * sy), :(wsx * sx)] = idx_buffer_view
+        else:
+            idx_buffer = idx_buffer_view
+        rand_idx = idx_buffer.reshape(-1).argsort(stable=True)
+        a_idx = rand_idx[num_dst:] # src
+        b_idx = rand_idx[:num_dst] # dst
+
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = metric[:, a_idx], metric[:, b_idx]
+        scores = (a @ b.transpose(-1, -2)).mean(dim=0)
+
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)
+        unm_idx = edge_idx[r:] # unmerged tokens
+        src_idx = edge_idx[:r] # merged tokens
+        dst_idx = node_idx[src_idx]
+        keep_idx = torch.cat([a_idx[unm_idx], b_idx])
+
+    def merge(x):
+        src, dst = x[:, a_idx], x[:, b_idx]
+        n, _, c = src.shape
+        unm = src[:, unm_idx]
+        src = src[:, src_idx]
+        dst = dst.scatter_reduce(1, dst_idx[None, :, None].expand(n, r, c), src, reduce="mean")
+        return torch.cat([unm, dst], dim=1)
+
+    def unmerge(x):
+        unm_len = unm_idx.shape[0]
+        unm, dst = x[:, :unm_len], x[:, unm_len:]
+        out = torch.empty(x.shape[0], N, x.shape[-1], device=x.device, dtype=x.dtype)
+        out[:, b_idx] = dst
+        out[:, a_idx[unm_idx]] = unm
+        out[:, a_idx[src_idx]] = dst[:, dst_idx]
+        return out
+
+    return merge, unmerge, keep_idx
+
+class TokenMerging:
+    """
+    Lives in transformer_options["tome"]. Models that support it call it with
+    the block index, the block input and the token grid and pass the returned
+    (merge, unmerge, keep_idx) to the block, None means run the block as-is.
+    """
+    def __init__(self, ranges, sx=2, sy=2):
+        self.ranges = list(ranges) # [(start_block, end_block, ratio)]
+        self.sx = sx
+        self.sy = sy
+        self.reported = set()
+
+    def __deepcopy__(self, memo):
+        return TokenMerging(self.ranges, self.sx, self.sy)
+
+    def ratio(self, layer):
+        ratio = 0.0
+        for start, end, r in self.ranges: # later ranges override earlier ones
+            if start <= layer and (end < 0 or layer < end):
+                ratio = r
+        return ratio
+
+    def __call__(self, layer, x, hw):
+        ratio = self.ratio(layer)
+        if ratio <= 0:
+            return None
+        h, w = hw
+        N, C = x.shape[1], x.shape[2]
+        r = int(N * ratio)
+        plan = bipartite_soft_matching_2d(x, h, w, self.sx, self.sy, r, offset=layer)
+        if plan is not None and (hw, ratio) not in self.reported:
+            self.reported.add((hw, ratio))
+            self.report(hw, N, len(plan[2]), C, ratio)
+        return plan
+
+    @staticmethod
+    def attention_flops(n, c):
+        # QK^T and attn @ V, per batch item
+        return 4 * n * n * c
+
+    def report(self, hw, n, n_merged, c, ratio):
+        full = self.attention_flops(n, c)
+        merged = self.attention_flops(n_merged, c)
+        tqdm.write(
+            f"ToMe: {hw[0]}x{hw[1]} grid, ratio {ratio:.2f}: {n} -> {n_merged} tokens, "
+            f"self-attention {full/1e9:.2f} -> {merged/1e9:.2f} GFLOPs per merged block ({1-merged/full:.0%} saved)"
+        )
+
+class TokenMergingNode:
+    @classmethod
+    def INPUT_TYPES(s):
+        return {
+            "required": {
+                "model": ("MODEL",),
+                "ratio": ("FLOAT", {"default": 0.5, "min": 0.0, "max": 0.75, "step": 0.05}),
+                "start_block": ("INT", {"default": 0, "min": 0, "max": 100}),
+                "end_block": ("INT", {"default": -1, "min": -1, "max": 100}),
+            }
+        }
+
+    RETURN_TYPES = ("MODEL",)
+    FUNCTION = "patch"
+    CATEGORY = "other"
+    TITLE = "Token Merging (PixArt/HunyuanDiT)"
+
+    def patch(self, model, ratio, start_block, end_block):
+        """
+        Chain multiple nodes to set different ratios for different block ranges.
+        end_block is exclusive, -1 for the last block.
+        """
+        m = model.clone()
+        prev = m.model_options["transformer_options"].get("tome", None)
+        ranges = prev.ranges if prev is not None else []
+        m.model_options["transformer_options"]["tome"] = TokenMerging(
+            ranges = ranges + [(start_block, end_block, ratio)],
+        )
+        return (m,)
+
+NODE_CLASS_MAPPINGS = {
+    "TokenMerging": TokenMergingNode,
+}